@@ -1,11 +1,133 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+
+from . import thumbnails
+from .models import User, PerevalAdded, Coords, PerevalImage, PerevalAreas, SprActivitiesTypes, ImageBlob
 
-from .models import User, PerevalAdded, Coords, PerevalImage, PerevalAreas, SprActivitiesTypes
 
 # Register your models here.
-admin.site.register(User)
-admin.site.register(PerevalAdded)
-admin.site.register(Coords)
-admin.site.register(PerevalImage)
-admin.site.register(PerevalAreas)
-admin.site.register(SprActivitiesTypes)
\ No newline at end of file
+
+class EstimatedCountPaginator(Paginator):
+    # COUNT(*) по таблице из миллионов строк занимает секунды. Для списка без фильтров на PostgreSQL
+    # число строк берётся из статистики планировщика (pg_class.reltuples); для маленьких таблиц
+    # и списков с фильтрами — точный подсчёт.
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_threshold:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Без второго COUNT(*) по всей таблице при поиске и фильтрации
+    show_full_result_count = False
+    ordering = ('-id',)
+
+
+def thumbnail_html(image):
+    # Ссылка на endpoint уменьшенных копий: список не проверяет наличие файлов в хранилище
+    if not image.pk or not image.data or image.status != 'ready':
+        return '—'
+    url = reverse('pereval_image_thumbnail', kwargs={'id': image.pk, 'size': thumbnails.VARIANT_SIZES[0]})
+    return format_html('<img src="{}" alt="" style="max-height: 64px;">', url)
+
+
+class PerevalImageInline(admin.TabularInline):
+    model = PerevalImage
+    fields = ('thumbnail', 'title', 'data', 'status', 'date_added')
+    # Файл только для просмотра: замена обошла бы учёт ссылок на общий файл (mountain_pass/blobs.py)
+    readonly_fields = ('thumbnail', 'data', 'status', 'date_added')
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Миниатюра')
+    def thumbnail(self, image):
+        return thumbnail_html(image)
+
+
+@admin.register(PerevalAdded)
+class PerevalAddedAdmin(LargeTableAdmin):
+    list_display = ('id', 'title', 'status', 'user', 'area', 'moderator', 'add_time')
+    list_select_related = ('user', 'area', 'moderator')
+    # Фильтры по полям с индексами (status — pereval_status_level_idx, area — pereval_area_status_idx)
+    list_filter = ('status', 'area')
+    # Поиск только по точному совпадению: поиск подстроки просматривал бы всю таблицу
+    search_fields = ('=id', '=user__email')
+    # Вместо выпадающих списков со всеми пользователями, координатами и уровнями — ввод id
+    raw_id_fields = ('user', 'coords', 'level', 'moderator')
+    autocomplete_fields = ('area',)
+    filter_horizontal = ('activities',)
+    readonly_fields = ('add_time', 'claimed_at')
+    inlines = [PerevalImageInline]
+
+
+@admin.register(PerevalImage)
+class PerevalImageAdmin(LargeTableAdmin):
+    list_display = ('id', 'thumbnail', 'title', 'pereval', 'status', 'date_added')
+    list_select_related = ('pereval',)
+    list_filter = ('status',)
+    search_fields = ('=id', '=pereval__id')
+    raw_id_fields = ('pereval',)
+    # Изображения добавляются через API; файл только для просмотра, как и в PerevalImageInline
+    readonly_fields = ('data',)
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description='Миниатюра')
+    def thumbnail(self, image):
+        return thumbnail_html(image)
+
+
+@admin.register(ImageBlob)
+class ImageBlobAdmin(LargeTableAdmin):
+    # Файлы меняются только через изображения: число ссылок ведётся в mountain_pass/blobs.py
+    list_display = ('sha256', 'name', 'size', 'refcount', 'created_at')
+    search_fields = ('=sha256', '=name')
+    ordering = ('-created_at',)
+    readonly_fields = ('sha256', 'name', 'size', 'refcount', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(User)
+class UserAdmin(LargeTableAdmin):
+    list_display = ('id', 'email', 'fam', 'name', 'otc', 'phone', 'is_active')
+    search_fields = ('=email',)
+
+
+@admin.register(Coords)
+class CoordsAdmin(LargeTableAdmin):
+    list_display = ('id', 'latitude', 'longitude', 'height')
+
+
+@admin.register(PerevalAreas)
+class PerevalAreasAdmin(admin.ModelAdmin):
+    list_display = ('title', 'id_parent', 'path')
+    list_select_related = ('id_parent',)
+    search_fields = ('title',)
+    autocomplete_fields = ('id_parent',)
+    ordering = ('path',)
+
+
+admin.site.register(SprActivitiesTypes)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MountainPassConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mountain_pass'
+
+    def ready(self):
+        from . import signals  # noqa: F401 (подключение обработчиков сигналов)
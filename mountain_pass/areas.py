@@ -0,0 +1,51 @@
+# Дерево районов перевалов. У каждого района хранится материализованный путь — id предков и самого района
+# через «/» (например, «1/5/12/»), поэтому весь подрайон выбирается одним условием path LIKE '1/5/%'
+# по индексу, независимо от глубины иерархии.
+SEPARATOR = '/'
+
+
+def make_path(parent_path, area_id):
+    return f'{parent_path or ""}{area_id}{SEPARATOR}'
+
+
+def path_ids(path):
+    return [int(value) for value in path.split(SEPARATOR) if value]
+
+
+class AreaTree:
+    # Неизменяемый снимок дерева районов в памяти: строится одним запросом, см. PerevalAreasManager.tree()
+    def __init__(self, rows):
+        # rows: (id, title, id_parent, path)
+        self.nodes = {
+            area_id: {'id': area_id, 'title': title, 'parent': parent_id, 'path': path, 'children': []}
+            for area_id, title, parent_id, path in rows
+        }
+        self.roots = []
+        for node in sorted(self.nodes.values(), key=lambda node: (node['title'], node['id'])):
+            parent = self.nodes.get(node['parent'])
+            (parent['children'] if parent else self.roots).append(node['id'])
+
+    def __contains__(self, area_id):
+        return area_id in self.nodes
+
+    def path(self, area_id):
+        return self.nodes[area_id]['path']
+
+    def ancestors(self, area_id):
+        # Id предков от корня, без самого района
+        return path_ids(self.path(area_id))[:-1]
+
+    def descendants(self, area_id):
+        # Id района и всех его подрайонов
+        path = self.path(area_id)
+        return [node['id'] for node in self.nodes.values() if node['path'].startswith(path)]
+
+    def as_list(self, root_id=None):
+        # Вложенное представление для ответа API: [{id, title, children: [...]}, ...]
+        def build(area_id):
+            node = self.nodes[area_id]
+            return {'id': area_id, 'title': node['title'], 'children': [build(child) for child in node['children']]}
+
+        if root_id is not None:
+            return [build(root_id)]
+        return [build(area_id) for area_id in self.roots]
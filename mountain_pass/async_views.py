@@ -0,0 +1,273 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import idempotency, response_cache, uploads
+from .models import PerevalAdded, User
+from .pagination import KeysetPagination
+from .serializers import PerevalAddedSerializer, PerevalDetailSerializer, PerevalNotEditable
+from .views import STREAM_CHUNK_SIZE, submitted_emails
+
+# Асинхронные версии основных методов API (submitData, получение, редактирование и список по email).
+# Подключаются в pereval/urls_async.py, который используется при запуске через ASGI (pereval/asgi.py):
+# под ASGI синхронные представления DRF выполнялись бы в отдельном потоке на каждый запрос.
+# Чтение идёт через асинхронный API ORM; запись — в синхронном коде (sync_to_async), потому что
+# транзакции и обработчики сигналов моделей в Django синхронные. Сериализация тоже выполняется в потоке
+# (serialize): она обращается к кешу и хранилищу файлов. Формат ответов тот же, что у views.py.
+
+
+def json_response(payload, status=200):
+    # Как JSONRenderer в DRF: кириллица без экранирования, компактные разделители
+    return JsonResponse(payload, status=status, safe=False, encoder=JSONEncoder,
+                        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+@sync_to_async
+def serialize(perevals, many=False):
+    # Вне цикла событий: представление изображений проверяет наличие уменьшенных копий
+    # в кеше и хранилище (thumbnails.existing_variants), а это блокирующий ввод-вывод
+    return PerevalDetailSerializer(perevals, many=many).data
+
+
+def cached_response(request, payload, etag):
+    if response_cache.not_modified(request, etag):
+        return response_cache.add_etag(HttpResponse(status=304), etag)
+    return response_cache.add_etag(json_response(payload), etag)
+
+
+class AsyncAPIView(View):
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Как и у представлений DRF, сессии не используются — проверка CSRF не нужна
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except ValidationError as exc:
+            return json_response(exc.detail, status=400)
+
+    @staticmethod
+    def parse_json(request):
+        try:
+            return json.loads(request.body or b'null')
+        except ValueError as exc:
+            raise ValidationError({'detail': f'JSON parse error - {exc}'})
+
+
+class PerevalCreateAsyncView(AsyncAPIView):
+    async def post(self, request, *args, **kwargs):
+        data = self.parse_json(request)
+        key = request.headers.get(idempotency.HEADER)
+        if key is not None:
+            return await sync_to_async(self.post_idempotent)(key, request.path, data)
+
+        # Пользователя и загрузки изображений ищем заранее асинхронно: тогда проверка данных сериализатором
+        # не обращается к БД
+        users = await User.objects.aresolve_many(submitted_emails([data]))
+        serializer = PerevalAddedSerializer(data=data, context={
+            'known_users': users,
+            'known_uploads': await uploads.aknown([data]),
+        })
+        if not serializer.is_valid():
+            status_code, payload = self.invalid(serializer)
+        else:
+            status_code, payload = await sync_to_async(self.save)(serializer)
+        return json_response(payload, status=status_code)
+
+    def post_idempotent(self, key, path, data):
+        # Всё в одном синхронном вызове: повтор с тем же ключом возвращает сохранённый ответ,
+        # не обращаясь к БД за пользователем и загрузками
+        def handler():
+            serializer = PerevalAddedSerializer(data=data)
+            return self.save(serializer) if serializer.is_valid() else self.invalid(serializer)
+
+        try:
+            status_code, payload, replayed = idempotency.run(key, idempotency.fingerprint(path, data), handler)
+        except idempotency.IdempotencyError as e:
+            return json_response({"status": e.status_code, "message": str(e)}, status=e.status_code)
+        response = json_response(payload, status=status_code)
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+
+    @staticmethod
+    def invalid(serializer):
+        return 400, {
+            "status": 400,
+            "message": "Bad Request (не корректные данные)",
+            "errors": serializer.errors,
+            "id": None
+        }
+
+    @staticmethod
+    def save(serializer):
+        try:
+            pereval_added = serializer.save()
+        except Exception as e:
+            return 500, {
+                "status": 500,
+                "message": f"Ошибка при выполнении операции: {str(e)}",
+                "id": None
+            }
+        return 200, {
+            "status": 200,
+            "message": "успех",
+            "id": pereval_added.id
+        }
+
+
+class PerevalDetailUpdateAsyncView(AsyncAPIView):
+    @staticmethod
+    def not_found():
+        return json_response({
+            "status": 404,
+            "message": "Перевал не найден.",
+            "data": None
+        }, status=404)
+
+    async def get(self, request, id, *args, **kwargs):
+        key = response_cache.detail_key(id)
+        cached = await response_cache.aget(key)
+        if cached is not None:
+            etag, payload = cached
+            return cached_response(request, payload, etag)
+
+        pereval = await PerevalAdded.objects.with_related().filter(id=id).afirst()
+        if pereval is None:
+            return self.not_found()
+
+        payload = {
+            "status": 200,
+            "message": "успех",
+            "data": await serialize(pereval)
+        }
+        return cached_response(request, payload, await response_cache.astore(key, payload))
+
+    async def patch(self, request, id, *args, **kwargs):
+        pereval = await PerevalAdded.objects.select_related('coords', 'level').filter(id=id).afirst()
+        if pereval is None:
+            return self.not_found()
+
+        if pereval.status != 'new':
+            return self.not_editable()
+
+        serializer = PerevalAddedSerializer(pereval, data=self.parse_json(request), partial=True)
+        try:
+            await sync_to_async(self.save)(serializer)
+        except PerevalNotEditable:
+            return self.not_editable()
+        return json_response({
+            "state": 1,
+            "message": "Запись успешно отредактирована."
+        })
+
+    @staticmethod
+    def not_editable():
+        return json_response({
+            "state": 0,
+            "message": "Редактирование доступно только для записей со статусом 'new'."
+        }, status=400)
+
+    @staticmethod
+    def save(serializer):
+        # Проверка данных (может искать пользователя) и сохранение в одном синхронном вызове
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+
+class PerevalListByEmailAsyncView(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        params = request.GET
+        email = params.get('user__email')
+        stream = params.get('stream') in ('1', 'true')
+        if stream or not email:
+            return await self.build_response(email, params, stream)
+
+        key = await response_cache.alist_key(email, {
+            name: params.get(name)
+            for name in (KeysetPagination.cursor_query_param, KeysetPagination.limit_query_param)
+        })
+        cached = await response_cache.aget(key)
+        if cached is not None:
+            etag, payload = cached
+            return cached_response(request, payload, etag)
+
+        payload = await self.build_payload(email, params)
+        if payload is None:
+            return self.not_found()
+        return cached_response(request, payload, await response_cache.astore(key, payload))
+
+    @staticmethod
+    def not_found():
+        return json_response({
+            "status": 404,
+            "message": "Email не найден или записи отсутствуют",
+            "data": []
+        }, status=404)
+
+    @staticmethod
+    def get_queryset(email):
+        if email:
+            return PerevalAdded.objects.with_related().filter(user__email=email).order_by(*KeysetPagination.ordering)
+        return PerevalAdded.objects.none()
+
+    async def load(self, email, params):
+        # Постраничная выдача включается параметрами cursor/limit, без них возвращаются все записи
+        queryset = self.get_queryset(email)
+        if KeysetPagination.cursor_query_param in params or KeysetPagination.limit_query_param in params:
+            paginator = KeysetPagination()
+            return await paginator.apaginate_queryset(queryset, params), paginator
+        return [pereval async for pereval in queryset], None
+
+    async def build_payload(self, email, params):
+        perevals, paginator = await self.load(email, params)
+        if not perevals:
+            return None
+        payload = {
+            "status": 200,
+            "message": "успех",
+            "data": await serialize(perevals, many=True)
+        }
+        if paginator is not None:
+            payload["next"] = paginator.next_cursor
+        return payload
+
+    async def build_response(self, email, params, stream):
+        if not stream:
+            payload = await self.build_payload(email, params)
+            return self.not_found() if payload is None else json_response(payload)
+
+        if KeysetPagination.cursor_query_param in params or KeysetPagination.limit_query_param in params:
+            perevals, paginator = await self.load(email, params)
+            perevals = aiter_list(perevals)
+        else:
+            # Читаем записи порциями, не загружая весь список в память
+            perevals, paginator = self.get_queryset(email).aiterator(chunk_size=STREAM_CHUNK_SIZE), None
+
+        # Проверяем, найден ли хотя бы один объект
+        first = await anext(perevals, None)
+        if first is None:
+            return self.not_found()
+        return StreamingHttpResponse(self.stream_json(first, perevals, paginator), content_type='application/json')
+
+    @staticmethod
+    async def stream_json(first, perevals, paginator):
+        yield '{"status": 200, "message": "успех", "data": ['
+        yield json.dumps(await serialize(first), cls=JSONEncoder, ensure_ascii=False)
+        async for pereval in perevals:
+            yield ',' + json.dumps(await serialize(pereval), cls=JSONEncoder, ensure_ascii=False)
+        yield ']'
+        if paginator is not None:
+            yield ', "next": ' + json.dumps(paginator.next_cursor)
+        yield '}'
+
+
+async def aiter_list(items):
+    for item in items:
+        yield item
@@ -0,0 +1,223 @@
+import json
+import math
+import random
+import time
+
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Level, PerevalAdded, PerevalAreas, SprActivitiesTypes, User
+from .serializers import PerevalAddedSerializer
+from .signals import perevals_changed
+
+# Нагрузочные сценарии для основных методов API (manage.py benchmark).
+# Данные генерируются детерминированно (random.Random(seed)), запросы выполняются тестовым клиентом Django
+# последовательно, поэтому для каждого запроса известно и время, и число запросов к БД.
+
+SEASONS_LEVELS = [value for value, _ in Level.CHOICE_LEVEL if value]
+STATUSES = ['new', 'new', 'pending', 'accepted', 'accepted', 'accepted', 'rejected']
+WORDS = ['Перевал', 'Седло', 'Северный', 'Южный', 'Белый', 'Чёрный', 'Ледниковый', 'Каменный', 'Верхний',
+         'Дятлова', 'Туристов', 'Орлиный', 'Снежный', 'Восточный', 'Западный', 'Малый', 'Большой']
+FAMILIES = ['Иванов', 'Петров', 'Сидоров', 'Кузнецов', 'Смирнов', 'Попов', 'Волков', 'Соколов']
+NAMES = ['Иван', 'Пётр', 'Анна', 'Мария', 'Олег', 'Елена', 'Сергей', 'Ольга']
+AREAS = ['Кавказ', 'Алтай', 'Урал', 'Саяны', 'Хибины', 'Памир', 'Тянь-Шань', 'Камчатка']
+ACTIVITIES = ['Пешком', 'Лыжи', 'Катамаран', 'Байдарка', 'Плот', 'Сплав', 'Велосипед', 'Автомобиль']
+
+SCENARIOS = ('create', 'detail', 'patch', 'list_by_email')
+
+# Метрики, по которым сравнивается с эталоном, и направление «хуже»
+TIMING_METRICS = {'p50_ms': 'higher', 'p99_ms': 'higher', 'rps': 'lower'}
+
+
+class DataGenerator:
+    def __init__(self, seed=1):
+        self.random = random.Random(seed)
+        self.counter = 0
+
+    def user(self, index):
+        return {
+            'email': f'user{index}@example.com',
+            'fam': self.random.choice(FAMILIES),
+            'name': self.random.choice(NAMES),
+            'otc': self.random.choice(['', 'Иванович', 'Петровна']),
+            'phone': f'+7 9{self.random.randint(10, 99)} {self.random.randint(100, 999)} '
+                     f'{self.random.randint(10, 99)} {self.random.randint(10, 99)}',
+        }
+
+    def level(self):
+        return {season: self.random.choice(SEASONS_LEVELS + ['', '']) for season in Level.SEASONS}
+
+    def pereval(self, user_index, images_per_pass):
+        self.counter += 1
+        title = ' '.join(self.random.sample(WORDS, 2))
+        return {
+            'beauty_title': 'пер.',
+            'title': f'{title} {self.counter}',
+            'other_titles': self.random.choice([None, ' '.join(self.random.sample(WORDS, 2))]),
+            'connect': '',
+            'user': self.user(user_index),
+            'coords': {
+                'latitude': round(self.random.uniform(38.0, 56.0), 6),
+                'longitude': round(self.random.uniform(40.0, 99.0), 6),  # Coords допускает две цифры до запятой
+                'height': self.random.randint(800, 5500),
+            },
+            'level': self.level(),
+            'images': [
+                {'data': f'pereval_images/seed/{self.counter}_{index}.jpg', 'title': self.random.choice(WORDS)}
+                for index in range(images_per_pass)
+            ],
+        }
+
+
+def seed(generator, users=200, passes=2000, images_per_pass=2, areas=40, batch_size=500):
+    # Наполнение БД через пакетное создание (тот же путь, что у POST /submitData/bulk)
+    area_rows = []
+    for index in range(areas):
+        parent = area_rows[generator.random.randrange(len(area_rows))] if area_rows and index % 4 else None
+        area_rows.append(PerevalAreas.objects.create(
+            title=f'{generator.random.choice(AREAS)} {index}', id_parent=parent))
+    activities = [SprActivitiesTypes.objects.get_or_create(title=title)[0] for title in ACTIVITIES]
+
+    for start in range(0, passes, batch_size):
+        items = [generator.pereval(generator.random.randrange(users), images_per_pass)
+                 for _ in range(min(batch_size, passes - start))]
+        known_users = User.objects.resolve_many(item['user']['email'] for item in items)
+        serializer = PerevalAddedSerializer(data=items, many=True, context={'known_users': known_users})
+        serializer.is_valid(raise_exception=True)
+        perevals = serializer.save()
+
+        with transaction.atomic():
+            for pereval in perevals:
+                pereval.status = generator.random.choice(STATUSES)
+                pereval.area = generator.random.choice(area_rows) if area_rows else None
+            PerevalAdded.objects.bulk_update(perevals, ['status', 'area'])
+            through = PerevalAdded.activities.through
+            through.objects.bulk_create([
+                through(perevaladded_id=pereval.id, spractivitiestypes_id=activity.id)
+                for pereval in perevals
+                for activity in generator.random.sample(activities, generator.random.randint(1, 3))
+            ])
+            # bulk_update не отправляет post_save: агрегаты карты и кеш ответов обновляем через общий сигнал
+            perevals_changed.send(sender=PerevalAdded, pereval_ids=[pereval.id for pereval in perevals])
+
+
+def percentile(sorted_values, share):
+    # Ближайший ранг: значение, которого не превышает доля share запросов
+    if not sorted_values:
+        return None
+    index = max(math.ceil(share * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed, query_counts=None):
+    latencies = sorted(latencies)
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+    }
+    if query_counts:
+        result['queries_avg'] = round(sum(query_counts) / len(query_counts), 2)
+        result['queries_max'] = max(query_counts)
+    return result
+
+
+class Suite:
+    def __init__(self, generator, requests=200, users=200, images_per_pass=2):
+        self.generator = generator
+        self.requests = requests
+        self.users = users
+        self.images_per_pass = images_per_pass
+        self.client = Client()
+
+    def measure(self, make_request, expected_status=200):
+        latencies, query_counts, errors = [], [], 0
+        started = time.perf_counter()
+        for index in range(self.requests):
+            with CaptureQueriesContext(connection) as queries:
+                request_started = time.perf_counter()
+                response = make_request(index)
+                latencies.append(time.perf_counter() - request_started)
+            query_counts.append(len(queries))
+            errors += response.status_code != expected_status
+        return summarize(latencies, errors, time.perf_counter() - started, query_counts)
+
+    def sample(self, values):
+        values = list(values)
+        return [self.generator.random.choice(values) for _ in range(self.requests)] if values else None
+
+    def run_create(self):
+        url = reverse('submit_data')
+        payloads = [self.generator.pereval(self.generator.random.randrange(self.users * 2), self.images_per_pass)
+                    for _ in range(self.requests)]
+        return self.measure(lambda index: self.client.post(url, payloads[index], content_type='application/json'))
+
+    def run_detail(self):
+        ids = self.sample(PerevalAdded.objects.values_list('id', flat=True))
+        if ids is None:
+            return None
+        return self.measure(lambda index: self.client.get(reverse('pereval_detail_update', kwargs={'id': ids[index]})))
+
+    def run_patch(self):
+        ids = self.sample(PerevalAdded.objects.filter(status='new').values_list('id', flat=True))
+        if ids is None:
+            return None
+
+        def make_request(index):
+            url = reverse('pereval_detail_update', kwargs={'id': ids[index]})
+            return self.client.patch(url, {'title': f'Изменённый {index}', 'images': []},
+                                     content_type='application/json')
+        return self.measure(make_request)
+
+    def run_list_by_email(self):
+        picks = self.sample(PerevalAdded.objects.values_list('user__email', flat=True).distinct())
+        if picks is None:
+            return None
+        url = reverse('submit_data_by_email')
+        return self.measure(lambda index: self.client.get(url, {'user__email': picks[index]}))
+
+    def run(self, scenarios=SCENARIOS):
+        # Сценарий без подходящих данных (например, нет перевалов в статусе new) пропускается
+        results = {}
+        for name in scenarios:
+            result = getattr(self, f'run_{name}')()
+            if result is not None:
+                results[name] = result
+        return results
+
+
+def compare(results, baseline, tolerance):
+    # Возвращает список регрессий относительно эталона (результат предыдущего запуска в том же формате).
+    # Время сравнивается с допуском tolerance (доля), число запросов к БД — точно: оно детерминировано.
+    # Ошибочные ответы считаются регрессией и без эталона.
+    regressions = []
+    for name, current in results.items():
+        if current.get('errors'):
+            regressions.append(f'{name}: {current["errors"]} ошибочных ответов')
+        reference = (baseline or {}).get(name)
+        if reference is None:
+            continue
+        for metric, worse in TIMING_METRICS.items():
+            old, new = reference.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            if worse == 'higher' and new > old * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {new} > {old} (+{tolerance:.0%})')
+            if worse == 'lower' and new < old / (1 + tolerance):
+                regressions.append(f'{name}: {metric} {new} < {old} (-{tolerance:.0%})')
+        old, new = reference.get('queries_max'), current.get('queries_max')
+        if old is not None and new is not None and new > old:
+            regressions.append(f'{name}: queries_max {new} > {old}')
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as file:
+        data = json.load(file)
+    return data.get('results', data)
@@ -0,0 +1,108 @@
+import hashlib
+import os
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import ImageBlob, PerevalImage
+
+# Хранение изображений по содержимому. Файл называется по SHA-256 своих байтов, поэтому одно и то же фото,
+# приложенное к нескольким перевалам или отправленное повторно, записывается на диск один раз.
+# ImageBlob.refcount — число изображений (PerevalImage.blob), ссылающихся на файл: acquire() увеличивает его,
+# release() уменьшает и возвращает имена файлов, на которые больше никто не ссылается.
+
+# Каталог файлов: pereval_blobs/ab/ab12...ef.jpg (первые два символа хеша — подкаталог)
+BLOB_DIR = 'pereval_blobs'
+
+
+def get_storage():
+    return PerevalImage._meta.get_field('data').storage
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest}.{extension}'
+
+
+def file_digest(content):
+    # Хеш считается по частям файла (File.chunks), без чтения его в память целиком
+    hasher = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    content.seek(0)
+    return hasher.hexdigest()
+
+
+def _take(digest):
+    # Ещё одна ссылка на существующий файл; None — такого файла нет
+    with transaction.atomic():
+        if not ImageBlob.objects.filter(sha256=digest).update(refcount=F('refcount') + 1):
+            return None
+        return ImageBlob.objects.filter(sha256=digest).values_list('name', flat=True).get()
+
+
+def acquire(content, extension, digest=None):
+    # Возвращает (хеш, имя файла) для content (django.core.files.File), увеличив число ссылок на 1.
+    # Файл записывается в хранилище, только если таких байтов там ещё нет.
+    digest = digest or file_digest(content)
+    name = _take(digest)
+    if name is not None:
+        return digest, name
+
+    # Запись файла — вне транзакции. Если файл с таким именем ещё не удалён после освобождения последней
+    # ссылки, хранилище выберет другое имя: в записи ImageBlob хранится именно оно.
+    storage = get_storage()
+    name = storage.save(blob_name(digest, extension), content)
+    try:
+        with transaction.atomic():
+            ImageBlob.objects.create(sha256=digest, name=name, size=content.size, refcount=1)
+    except IntegrityError:
+        # Те же байты одновременно записал другой процесс — пользуемся его файлом, свой удаляем
+        existing = _take(digest)
+        if existing is None:
+            raise
+        if existing != name:
+            storage.delete(name)
+        name = existing
+    return digest, name
+
+
+def is_blob_name(name):
+    return isinstance(name, str) and name.startswith(f'{BLOB_DIR}/')
+
+
+def take_name(name):
+    # Ссылка на файл по имени: клиент передал в data путь, полученный из API. Возвращает хеш файла
+    # или None, если это не файл хранилища по содержимому (или на него уже никто не ссылается)
+    if not is_blob_name(name):
+        return None
+    digest = os.path.basename(name)[:64]
+    if ImageBlob.objects.filter(sha256=digest, name=name).update(refcount=F('refcount') + 1):
+        return digest
+    return None
+
+
+def release(digests):
+    # Уменьшает число ссылок (digests могут повторяться — по одному на изображение) и удаляет записи
+    # без ссылок. Выполняется в транзакции изменения изображений; возвращает имена освободившихся файлов.
+    counts = Counter(digests)
+    if not counts:
+        return []
+    by_count = defaultdict(list)
+    for digest, count in counts.items():
+        by_count[count].append(digest)
+    with transaction.atomic():
+        for count, group in by_count.items():
+            ImageBlob.objects.filter(sha256__in=group).update(refcount=F('refcount') - count)
+        unused = dict(ImageBlob.objects.filter(sha256__in=counts, refcount__lte=0).values_list('sha256', 'name'))
+        if unused:
+            ImageBlob.objects.filter(sha256__in=unused, refcount__lte=0).delete()
+    return list(unused.values())
+
+
+def unreferenced(names):
+    # Из имён освобождённых файлов — те, что так и не получили новой записи ImageBlob
+    # (файл могли снова загрузить между освобождением и удалением)
+    taken = set(ImageBlob.objects.filter(name__in=names).values_list('name', flat=True))
+    return [name for name in names if name not in taken]
@@ -0,0 +1,135 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F, Max
+
+from .models import PerevalAdded, PerevalChange, PerevalChangeSequence
+
+# Журнал изменений для синхронизации мобильных клиентов. События пишутся в той же транзакции, что и само
+# изменение (обработчики сигналов в signals.py), поэтому журнал не расходится с данными. Клиент хранит
+# номер последнего полученного события (токен) и запрашивает только то, что изменилось после него.
+#
+# Номер события (seq) присваивается не при вставке, а при чтении ленты (assign_numbers): id выдаются
+# при вставке, и транзакция с меньшим id может зафиксироваться позже — клиент, уже получивший больший номер,
+# пропустил бы её событие. Номера присваиваются по одному процессу за раз и только зафиксированным событиям,
+# поэтому событие с меньшим seq никогда не становится видимым позже большего. Запись событий (submitData,
+# PATCH) при этом не ждёт общей блокировки: её берёт только чтение ленты, и только если есть новые события.
+
+# Ограничение размера страницы
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 2000
+
+# Сколько событий нумеруется одним запросом
+NUMBER_BATCH = 10000
+
+_batch = threading.local()  # События, отложенные внутри batched()
+
+
+def assign_numbers():
+    # Вызывается перед чтением ленты
+    if not PerevalChange.objects.filter(seq__isnull=True).exists():
+        return
+    with transaction.atomic():
+        # Строка счётчика блокируется до конца транзакции: следующий процесс увидит уже выданные номера
+        sequence = PerevalChangeSequence.objects.select_for_update().filter(id=1).first()
+        if sequence is None:
+            last_seq = PerevalChange.objects.aggregate(last=Max('seq'))['last'] or 0
+            sequence = PerevalChangeSequence.objects.create(id=1, last_seq=last_seq)
+        ids = list(PerevalChange.objects.filter(seq__isnull=True).order_by('id')
+                   .values_list('id', flat=True)[:NUMBER_BATCH])
+        if not ids:
+            return
+        # Номера возрастают вместе с id (пропуски допустимы); все больше уже выданных.
+        # Событие из этого диапазона, зафиксированное уже после выборки, тоже получит свободный номер
+        offset = sequence.last_seq + 1 - ids[0]
+        PerevalChange.objects.filter(seq__isnull=True, id__range=(ids[0], ids[-1])).update(seq=F('id') + offset)
+        sequence.last_seq = ids[-1] + offset
+        sequence.save(update_fields=['last_seq'])
+
+
+def record(pereval, kind, image_id=None):
+    PerevalChange.objects.create(pereval_id=pereval.id, user_id=pereval.user_id, kind=kind,
+                                 status=pereval.status, image_id=image_id)
+
+
+def record_many(pereval_ids, kind):
+    # Одно событие на перевал: один запрос на выборку и одна пакетная вставка
+    rows = PerevalAdded.objects.filter(id__in=list(pereval_ids)).order_by('id').values_list('id', 'user_id', 'status')
+    PerevalChange.objects.bulk_create([
+        PerevalChange(pereval_id=pereval_id, user_id=user_id, kind=kind, status=pereval_status)
+        for pereval_id, user_id, pereval_status in rows
+    ])
+
+
+def record_image_delete(pereval_id, image_id):
+    # Внутри batched() событие откладывается до конца блока
+    events = getattr(_batch, 'events', None)
+    if events is not None:
+        events.append((pereval_id, image_id))
+    else:
+        _write_image_deletes([(pereval_id, image_id)])
+
+
+def _write_image_deletes(events):
+    rows = PerevalAdded.objects.filter(id__in={pereval_id for pereval_id, _ in events}).values_list(
+        'id', 'user_id', 'status')
+    perevals = {pereval_id: (user_id, pereval_status) for pereval_id, user_id, pereval_status in rows}
+    PerevalChange.objects.bulk_create([
+        PerevalChange(pereval_id=pereval_id, user_id=perevals[pereval_id][0], kind='image_deleted',
+                      status=perevals[pereval_id][1], image_id=image_id)
+        for pereval_id, image_id in events if pereval_id in perevals
+    ])
+
+
+@contextmanager
+def batched():
+    # События удаления изображений внутри блока записываются одним запросом при выходе из него:
+    # число запросов при удалении изображений не зависит от их количества
+    if getattr(_batch, 'events', None) is not None:
+        yield
+        return
+    _batch.events = []
+    try:
+        yield
+        events = _batch.events
+    finally:
+        _batch.events = None
+    if events:
+        _write_image_deletes(events)
+
+
+def parse_token(value):
+    # Токен — номер последнего полученного события; пустой токен — синхронизация с начала
+    if not value:
+        return 0
+    token = int(value)
+    if token < 0:
+        raise ValueError(value)
+    return token
+
+
+def feed(since, user_id=None, limit=DEFAULT_LIMIT):
+    # Возвращает (события после since по возрастанию номера, есть ли ещё события)
+    assign_numbers()
+    queryset = PerevalChange.objects.filter(seq__gt=since)
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+    events = list(queryset.order_by('seq')[:limit + 1])
+    return events[:limit], len(events) > limit
+
+
+def collapse(events):
+    # Несколько событий одного перевала на странице сводятся к одной записи: клиенту нужно
+    # только итоговое состояние. Порядок — по последнему событию перевала.
+    entries = {}
+    for event in events:
+        entry = entries.pop(event.pereval_id, None) or {
+            'id': event.pereval_id, 'kinds': [], 'deleted_images': []}
+        entry['seq'] = event.seq
+        if event.kind not in entry['kinds']:
+            entry['kinds'].append(event.kind)
+        if event.kind == 'image_deleted' and event.image_id is not None:
+            entry['deleted_images'].append(event.image_id)
+        entries[event.pereval_id] = entry
+    return list(entries.values())
@@ -0,0 +1,204 @@
+import math
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+from .models import Level, PerevalAdded, PerevalCluster, PerevalClusterMember
+
+# Масштабы карты, для которых хранятся агрегаты (как у тайлов Web Mercator)
+MIN_ZOOM = 0
+MAX_ZOOM = 16
+MAX_MERCATOR_LATITUDE = 85.05112878
+
+# Перевалы с этими статусами на обзорную карту не попадают
+EXCLUDED_STATUSES = ('rejected',)
+
+# Категория сложности -> поле счётчика в PerevalCluster (порядок — по возрастанию сложности)
+DIFFICULTY_FIELDS = {
+    '': 'level_none',
+    '1А': 'level_1a',
+    '1Б': 'level_1b',
+    '2А': 'level_2a',
+    '2Б': 'level_2b',
+    '3А': 'level_3a',
+    '3Б': 'level_3b',
+}
+DIFFICULTY_ORDER = [value for value, _ in Level.CHOICE_LEVEL]
+
+# Ограничение на число условий в одном запросе выборки ячеек
+KEYS_PER_QUERY = 300
+
+
+def tile(latitude, longitude, zoom):
+    latitude = max(min(float(latitude), MAX_MERCATOR_LATITUDE), -MAX_MERCATOR_LATITUDE)
+    n = 2 ** zoom
+    x = int((float(longitude) + 180.0) / 360.0 * n)
+    lat_rad = math.radians(latitude)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def difficulty(level):
+    # Сложность перевала — максимальная из сезонных категорий
+    if level is None:
+        return ''
+    values = [level.winter, level.summer, level.autumn, level.spring]
+    return max((value or '' for value in values), key=DIFFICULTY_ORDER.index)
+
+
+def contribution(pereval):
+    # Что перевал должен вносить в агрегаты сейчас: (широта, долгота, сложность) или None
+    if pereval.status in EXCLUDED_STATUSES:
+        return None
+    return float(pereval.coords.latitude), float(pereval.coords.longitude), difficulty(pereval.level)
+
+
+def _member_contribution(member):
+    if member is None:
+        return None
+    return member.latitude, member.longitude, member.difficulty
+
+
+def _collect_deltas(changes):
+    # changes: список (старый вклад, новый вклад) -> изменения счётчиков по ячейкам всех масштабов
+    deltas = defaultdict(lambda: defaultdict(float))
+    for old, new in changes:
+        for sign, value in ((-1, old), (1, new)):
+            if value is None:
+                continue
+            latitude, longitude, level = value
+            for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+                delta = deltas[(zoom, *tile(latitude, longitude, zoom))]
+                delta['count'] += sign
+                delta['latitude_sum'] += sign * latitude
+                delta['longitude_sum'] += sign * longitude
+                delta[DIFFICULTY_FIELDS[level]] += sign
+    return deltas
+
+
+def _apply_deltas(deltas):
+    # Без чтения ячеек с блокировкой: недостающие ячейки создаются пустыми (конфликт с уже существующей
+    # пропускается), затем счётчики меняются выражениями F() — параллельные изменения складываются в самой БД.
+    # Ячейки с одинаковой разницей (обычно все масштабы одного перевала) обновляются одним запросом.
+    PerevalCluster.objects.bulk_create([
+        PerevalCluster(zoom=zoom, cell_x=x, cell_y=y) for zoom, x, y in deltas
+    ], batch_size=500, ignore_conflicts=True)
+
+    groups = defaultdict(list)
+    for key, delta in deltas.items():
+        groups[tuple(sorted(delta.items()))].append(key)
+    for delta, keys in groups.items():
+        values = {field: F(field) + (value if field.endswith('_sum') else int(value))
+                  for field, value in delta if value}
+        if not values:
+            continue
+        for start in range(0, len(keys), KEYS_PER_QUERY):
+            condition = Q()
+            for zoom, x, y in keys[start:start + KEYS_PER_QUERY]:
+                condition |= Q(zoom=zoom, cell_x=x, cell_y=y)
+            PerevalCluster.objects.filter(condition).update(**values)
+
+
+def _refresh(pereval_ids):
+    # Вклад, уже учтённый в агрегатах, блокируем: параллельное изменение того же перевала подождёт
+    members = {member.pereval_id: member
+               for member in PerevalClusterMember.objects.select_for_update().filter(pereval_id__in=pereval_ids)}
+    current = {
+        pereval.id: contribution(pereval)
+        for pereval in PerevalAdded.objects.select_related('coords', 'level').filter(id__in=pereval_ids)
+    }
+
+    changes = []
+    to_create, to_update, to_delete = [], [], []
+    for pereval_id in pereval_ids:
+        member = members.get(pereval_id)
+        old, new = _member_contribution(member), current.get(pereval_id)
+        if old == new:
+            continue
+        changes.append((old, new))
+        if new is None:
+            to_delete.append(pereval_id)
+        elif member is None:
+            to_create.append(PerevalClusterMember(pereval_id=pereval_id, latitude=new[0], longitude=new[1],
+                                                  difficulty=new[2]))
+        else:
+            member.latitude, member.longitude, member.difficulty = new
+            to_update.append(member)
+
+    if not changes:
+        return
+
+    _apply_deltas(_collect_deltas(changes))
+    if to_delete:
+        PerevalClusterMember.objects.filter(pereval_id__in=to_delete).delete()
+    if to_update:
+        PerevalClusterMember.objects.bulk_update(to_update, ['latitude', 'longitude', 'difficulty'])
+    if to_create:
+        PerevalClusterMember.objects.bulk_create(to_create)
+
+
+def refresh(pereval_ids):
+    # Приводит агрегаты в соответствие с текущим состоянием перевалов
+    pereval_ids = list(pereval_ids)
+    if not pereval_ids:
+        return
+
+    for attempt in range(3):
+        try:
+            with transaction.atomic():
+                _refresh(pereval_ids)
+            return
+        except IntegrityError:
+            # Вклад того же нового перевала одновременно записала другая транзакция — повторяем,
+            # теперь строка PerevalClusterMember уже существует
+            if attempt == 2:
+                raise
+
+
+def schedule(pereval_ids):
+    # Пересчёт после фиксации транзакции, изменившей перевалы: ячейки (в том числе ячейка масштаба 0,
+    # общая для всех перевалов) меняются в отдельной короткой транзакции, а не до конца запроса
+    pereval_ids = list(pereval_ids)
+    if pereval_ids:
+        transaction.on_commit(lambda: refresh(pereval_ids))
+
+
+def forget(pereval_ids):
+    # Перевалы удаляются: строки PerevalClusterMember удалятся каскадом вместе с ними, поэтому учтённый
+    # вклад читаем сейчас, а вычитаем из ячеек после фиксации удаления
+    members = PerevalClusterMember.objects.select_for_update().filter(pereval_id__in=list(pereval_ids))
+    changes = [(_member_contribution(member), None) for member in members]
+    if not changes:
+        return
+    deltas = _collect_deltas(changes)
+
+    def apply():
+        with transaction.atomic():
+            _apply_deltas(deltas)
+    transaction.on_commit(apply)
+
+
+def map_fields_changed(pereval):
+    # Изменились ли поля, от которых зависит вклад перевала в агрегаты (для перевала, загруженного
+    # не из БД, прежние значения неизвестны — считаем, что изменились)
+    loaded = getattr(pereval, '_loaded_map_fields', None)
+    current = (pereval.status, pereval.coords_id, pereval.level_id)
+    pereval._loaded_map_fields = current
+    return loaded != current
+
+
+def rebuild():
+    # Полный пересчёт агрегатов (для данных, созданных до появления кластеров)
+    with transaction.atomic():
+        PerevalCluster.objects.all().delete()
+        PerevalClusterMember.objects.all().delete()
+        ids = list(PerevalAdded.objects.values_list('id', flat=True))
+        for start in range(0, len(ids), 1000):
+            refresh(ids[start:start + 1000])
+
+
+def dominant_difficulty(cluster):
+    counts = [(getattr(cluster, field), level) for level, field in DIFFICULTY_FIELDS.items()]
+    count, level = max(counts, key=lambda item: (item[0], DIFFICULTY_ORDER.index(item[1])))
+    return level if count > 0 else None
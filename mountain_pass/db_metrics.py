@@ -0,0 +1,87 @@
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+# Счётчики работы с соединениями БД для GET /api/v1/metrics/db.
+# requests — обработанные запросы (каждый берёт соединение: постоянное, из пула или новое);
+# connects — открытые соединения; reconnects — повторные открытия в потоке, где соединение уже было
+# (истёк CONN_MAX_AGE, не прошла проверка CONN_HEALTH_CHECKS или соединение оборвалось).
+# В режиме пула сигнал connection_created отправляется при каждой выдаче соединения из пула: такие события
+# считаются в checkouts, а connects и reconnects берутся из статистики psycopg_pool (открытые и потерянные
+# соединения пула), которая также возвращается целиком (выдачи, ожидания и т. д.).
+
+_lock = threading.Lock()
+_counters = {'requests': 0, 'connects': 0, 'reconnects': 0, 'checkouts': 0}
+_connected = threading.local()  # Алиасы БД, к которым этот поток уже подключался
+
+
+def increment(name):
+    with _lock:
+        _counters[name] += 1
+
+
+def on_request_started(**kwargs):
+    increment('requests')
+
+
+def uses_pool(connection):
+    return bool(connection.settings_dict.get('OPTIONS', {}).get('pool'))
+
+
+def on_connection_created(sender, connection, **kwargs):
+    if uses_pool(connection):
+        increment('checkouts')
+        return
+    aliases = getattr(_connected, 'aliases', None)
+    if aliases is None:
+        aliases = _connected.aliases = set()
+    increment('connects')
+    if connection.alias in aliases:
+        increment('reconnects')
+    aliases.add(connection.alias)
+
+
+def reset():
+    with _lock:
+        for name in _counters:
+            _counters[name] = 0
+
+
+def pool_stats(connection):
+    # Статистика psycopg_pool (только в режиме pool); get_stats() не сбрасывает счётчики
+    pool = getattr(connection, 'pool', None) if uses_pool(connection) else None
+    if pool is None:
+        return None
+    stats = pool.get_stats()
+    return {
+        'size': stats.get('pool_size'),
+        'available': stats.get('pool_available'),
+        'checkouts': stats.get('requests_num', 0),
+        'waiting': stats.get('requests_waiting', 0),
+        'waits': stats.get('requests_queued', 0),
+        'wait_ms': stats.get('requests_wait_ms', 0),
+        'timeouts': stats.get('requests_errors', 0),
+        'connections_opened': stats.get('connections_num', 0),
+        'connections_lost': stats.get('connections_lost', 0),
+        'returned_bad': stats.get('returns_bad', 0),
+    }
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+    connection = connections['default']
+    pool = pool_stats(connection)
+    if pool is not None:
+        # Статистика пула не сбрасывается reset(): она накоплена с момента создания пула
+        counters['connects'] = pool['connections_opened']
+        counters['reconnects'] = pool['connections_lost']
+    return {
+        'mode': getattr(settings, 'DB_CONN_MODE', 'close'),
+        'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE'),
+        'health_checks': connection.settings_dict.get('CONN_HEALTH_CHECKS'),
+        **counters,
+        'reuse_ratio': round(1 - counters['connects'] / counters['requests'], 3) if counters['requests'] else None,
+        'pool': pool,
+    }
@@ -0,0 +1,146 @@
+import csv
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Level, PerevalAdded, PerevalImage
+
+# Выгрузка перевалов (GET /api/v1/export/passes и manage.py export_passes) в GeoJSON, CSV или NDJSON.
+# Записи читаются порциями через курсор на стороне сервера (QuerySet.iterator), связанные виды активности
+# и изображения подгружаются отдельным запросом на каждую порцию, а результат формируется по мере чтения —
+# расход памяти не зависит от числа строк. Данные пользователей (email, телефон) не выгружаются.
+
+FORMATS = {
+    'geojson': 'application/geo+json',
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Записей в одной порции чтения из БД
+CHUNK_SIZE = 2000
+
+# Сколько записей объединяется в один фрагмент ответа (меньше мелких записей в сокет и в gzip)
+ROWS_PER_WRITE = 200
+
+CSV_COLUMNS = [
+    'id', 'title', 'beauty_title', 'other_titles', 'connect', 'status', 'add_time',
+    'latitude', 'longitude', 'height', *(f'level_{season}' for season in Level.SEASONS),
+    'area_id', 'area', 'activities', 'images',
+]
+
+
+def get_queryset(statuses=('accepted',)):
+    return (PerevalAdded.objects
+            .filter(status__in=statuses)
+            .select_related('coords', 'level', 'area')
+            .prefetch_related('activities', Prefetch(
+                'pereval_images', queryset=PerevalImage.objects.filter(status='ready').exclude(data='')))
+            .order_by('id'))
+
+
+def make_row(pereval, build_url=None):
+    coords, level, area = pereval.coords, pereval.level, pereval.area
+    urls = [image.data.url for image in pereval.pereval_images.all()]
+    return {
+        'id': pereval.id,
+        'title': pereval.title,
+        'beauty_title': pereval.beauty_title,
+        'other_titles': pereval.other_titles,
+        'connect': pereval.connect,
+        'status': pereval.status,
+        'add_time': pereval.add_time,
+        'latitude': coords.latitude,
+        'longitude': coords.longitude,
+        'height': coords.height,
+        'level': {season: getattr(level, season) if level else '' for season in Level.SEASONS},
+        'area': {'id': area.id, 'title': area.title} if area else None,
+        'activities': [activity.title for activity in pereval.activities.all()],
+        'images': [build_url(url) for url in urls] if build_url else urls,
+    }
+
+
+def dumps(value):
+    return json.dumps(value, cls=JSONEncoder, ensure_ascii=False)
+
+
+def render_ndjson(rows):
+    for row in rows:
+        yield dumps(row) + '\n'
+
+
+def render_geojson(rows):
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ''
+    for row in rows:
+        properties = dict(row)
+        geometry = {'type': 'Point', 'coordinates': [properties.pop('longitude'), properties.pop('latitude')]}
+        yield separator + dumps({'type': 'Feature', 'id': row['id'], 'geometry': geometry, 'properties': properties})
+        separator = ',\n'
+    yield ']}\n'
+
+
+class Echo:
+    # csv.writer пишет строку в «файл», а мы сразу возвращаем её генератору
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        yield writer.writerow([
+            row['id'], row['title'], row['beauty_title'], row['other_titles'], row['connect'], row['status'],
+            row['add_time'].isoformat(), row['latitude'], row['longitude'], row['height'],
+            *(row['level'][season] for season in Level.SEASONS),
+            row['area']['id'] if row['area'] else '', row['area']['title'] if row['area'] else '',
+            ';'.join(row['activities']), ' '.join(row['images']),
+        ])
+
+
+RENDERERS = {
+    'geojson': render_geojson,
+    'csv': render_csv,
+    'ndjson': render_ndjson,
+}
+
+
+def batched(parts, size=ROWS_PER_WRITE):
+    buffer = []
+    for part in parts:
+        buffer.append(part)
+        if len(buffer) >= size:
+            yield ''.join(buffer).encode()
+            buffer = []
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31 — формат gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(export_format, queryset, build_url=None, compress=False, chunk_size=CHUNK_SIZE):
+    # Генератор фрагментов (bytes) готовой выгрузки
+    rows = (make_row(pereval, build_url) for pereval in queryset.iterator(chunk_size=chunk_size))
+    chunks = batched(RENDERERS[export_format](rows))
+    return gzipped(chunks) if compress else chunks
+
+
+async def aiterate(chunks):
+    # Под ASGI синхронный генератор StreamingHttpResponse был бы прочитан в память целиком,
+    # поэтому фрагменты берутся по одному в синхронном потоке (курсор БД остаётся в нём же)
+    get_next = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await get_next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
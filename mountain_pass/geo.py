@@ -0,0 +1,112 @@
+import math
+
+# Геохеш: координата кодируется строкой, у близких точек общий префикс.
+# По индексу на строке (B-tree) поиск по префиксу работает в любой СУБД, без PostGIS.
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+
+# Сколько ячеек геохеша допускаем при покрытии прямоугольника поиска
+MAX_COVER_CELLS = 32
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True  # Чётные биты кодируют долготу, нечётные — широту
+    while len(geohash) < precision:
+        if even:
+            middle = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= middle:
+                bits = (bits << 1) | 1
+                lon_range[0] = middle
+            else:
+                bits <<= 1
+                lon_range[1] = middle
+        else:
+            middle = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= middle:
+                bits = (bits << 1) | 1
+                lat_range[0] = middle
+            else:
+                bits <<= 1
+                lat_range[1] = middle
+        even = not even
+
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    # Размер ячейки геохеша заданной длины в градусах: (высота по широте, ширина по долготе)
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def _cells_count(min_lat, min_lon, max_lat, max_lon, precision):
+    height, width = cell_size(precision)
+    rows = math.floor((max_lat + 90) / height) - math.floor((min_lat + 90) / height) + 1
+    cols = math.floor((max_lon + 180) / width) - math.floor((min_lon + 180) / width) + 1
+    return rows * cols
+
+
+def cover_bbox(min_lat, min_lon, max_lat, max_lon, max_cells=MAX_COVER_CELLS):
+    # Набор префиксов геохеша, покрывающих прямоугольник. Берём самые длинные префиксы,
+    # при которых ячеек не больше max_cells: чем длиннее префикс, тем меньше лишних строк читается.
+    precision = 1
+    while precision < GEOHASH_PRECISION \
+            and _cells_count(min_lat, min_lon, max_lat, max_lon, precision + 1) <= max_cells:
+        precision += 1
+
+    if _cells_count(min_lat, min_lon, max_lat, max_lon, precision) > max_cells:
+        return []  # Прямоугольник слишком большой, фильтр по префиксу ничего не сократит
+
+    height, width = cell_size(precision)
+    prefixes = set()
+    row_start = math.floor((min_lat + 90) / height)
+    row_end = math.floor((max_lat + 90) / height)
+    col_start = math.floor((min_lon + 180) / width)
+    col_end = math.floor((max_lon + 180) / width)
+    for row in range(row_start, row_end + 1):
+        for col in range(col_start, col_end + 1):
+            # Кодируем центр ячейки, так не ошибаемся на границах
+            latitude = min(-90 + (row + 0.5) * height, 90)
+            longitude = min(-180 + (col + 0.5) * width, 180)
+            prefixes.add(encode(latitude, longitude, precision))
+    return sorted(prefixes)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def radius_bboxes(latitude, longitude, radius_km):
+    # Прямоугольники (min_lat, min_lon, max_lat, max_lon), гарантированно содержащие круг заданного радиуса.
+    # Круг, пересекающий антимеридиан (±180°), покрывается двумя прямоугольниками — по обе стороны от него.
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(latitude - delta_lat, -90), min(latitude + delta_lat, 90)
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6 or abs(latitude) + delta_lat >= 90:
+        # У полюса круг охватывает все долготы
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    delta_lon = math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat))
+    if delta_lon >= 180:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    min_lon, max_lon = longitude - delta_lon, longitude + delta_lon
+    if min_lon < -180:
+        return [(min_lat, min_lon + 360, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon - 360)]
+    return [(min_lat, min_lon, max_lat, max_lon)]
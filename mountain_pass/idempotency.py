@@ -0,0 +1,78 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+# Заголовок Idempotency-Key для submitData: клиент передаёт уникальный ключ (например, UUID) и повторяет запрос
+# с тем же ключом, если не дождался ответа. Ключ вставляется в начале той же транзакции, в которой создаётся
+# перевал, и вместе с ним сохраняется ответ. Параллельный повтор ждёт на уникальном индексе по ключу, пока первый
+# запрос не завершится, и получает его ответ; если первый запрос откатился, повтор выполняется заново.
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_ttl():
+    # Сколько секунд хранится ответ (по умолчанию сутки)
+    return getattr(settings, 'PEREVAL_IDEMPOTENCY_TTL', 24 * 3600)
+
+
+def fingerprint(path, data):
+    # По разобранным данным, а не телу запроса: форматирование JSON и порядок ключей не важны,
+    # а тело не приходится держать в памяти ещё раз (request.body)
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(f'{path}\n{payload}'.encode()).hexdigest()
+
+
+def _claim(key, request_fingerprint):
+    # Возвращает новую запись (запрос выполняется) или сохранённую запись с ответом
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(key=key, fingerprint=request_fingerprint,
+                                                 expires_at=now + timedelta(seconds=get_ttl())), True
+    except IntegrityError:
+        pass
+    record = IdempotencyKey.objects.get(key=key)
+    if record.expires_at <= now:
+        # Просроченный ключ ещё не удалён командой purge_idempotency_keys — используем его заново
+        record.delete()
+        return _claim(key, request_fingerprint)
+    return record, False
+
+
+def run(key, request_fingerprint, handler):
+    # handler() -> (код ответа, тело ответа). Возвращает (код, тело, повтор ли это сохранённого ответа).
+    # Ответы с ошибкой сервера (5xx) не сохраняются: транзакция откатывается, повтор выполнит запрос заново.
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f'{HEADER}: ожидается строка длиной от 1 до {MAX_KEY_LENGTH} символов')
+    with transaction.atomic():
+        record, created = _claim(key, request_fingerprint)
+        if not created:
+            if record.fingerprint != request_fingerprint:
+                raise IdempotencyError(f'{HEADER} уже использован с другими данными запроса', status_code=422)
+            return record.status_code, record.response, True
+
+        status_code, payload = handler()
+        if status_code >= 500:
+            transaction.set_rollback(True)
+            return status_code, payload, False
+        record.status_code, record.response = status_code, payload
+        record.save(update_fields=['status_code', 'response'])
+    return status_code, payload, False
+
+
+def purge(now=None):
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
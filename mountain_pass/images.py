@@ -0,0 +1,293 @@
+import base64
+import binascii
+import io
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from . import blobs, changes, response_cache, thumbnails
+from .models import PerevalImage, PerevalImagePayload
+
+logger = logging.getLogger(__name__)
+
+# Форматы, которые принимаются от клиентов, и расширения файлов для них
+ALLOWED_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+    'GIF': 'gif',
+}
+
+DATA_URI_RE = re.compile(r'^data:image/[\w.+-]+;base64,')
+BASE64_RE = re.compile(r'^[A-Za-z0-9+/\s]+={0,2}$')
+
+# Короче этого base64-строка не может быть изображением; так же отличаем её от пути к файлу
+MIN_BASE64_LENGTH = 64
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Имена файлов и хеши освобождаемых ImageBlob, удаление которых копится до конца batched_file_cleanup() в текущем потоке
+_cleanup_batch = threading.local()
+
+
+class ImageDecodeError(Exception):
+    pass
+
+
+def is_inline_payload(data):
+    # Изображение передано в теле запроса (data URI или голый base64), а не ссылкой на уже загруженный файл
+    if not isinstance(data, str):
+        return False
+    if DATA_URI_RE.match(data):
+        return True
+    return len(data) >= MIN_BASE64_LENGTH and BASE64_RE.match(data) is not None
+
+
+def decode_payload(data):
+    # Декодирует base64 и проверяет через Pillow, что это действительно изображение допустимого формата.
+    # Возвращает байты и расширение файла.
+    data = DATA_URI_RE.sub('', data, count=1)
+    try:
+        raw = base64.b64decode(data, validate=False)
+    except (binascii.Error, ValueError) as exc:
+        raise ImageDecodeError(f'Некорректный base64: {exc}')
+
+    max_bytes = getattr(settings, 'PEREVAL_IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+    if len(raw) > max_bytes:
+        raise ImageDecodeError(f'Изображение больше {max_bytes} байт')
+
+    try:
+        with Image.open(io.BytesIO(raw)) as img:
+            img.verify()
+            image_format = img.format
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as exc:
+        raise ImageDecodeError(f'Файл не является изображением: {exc}')
+
+    if image_format not in ALLOWED_FORMATS:
+        raise ImageDecodeError(f'Формат {image_format} не поддерживается')
+    return raw, ALLOWED_FORMATS[image_format]
+
+
+def read_payload(image_id):
+    return PerevalImagePayload.objects.filter(image_id=image_id).values_list('data', flat=True).first()
+
+
+def drop_payload(image_id):
+    PerevalImagePayload.objects.filter(image_id=image_id).delete()
+
+
+def mark_failed(image_id, pereval_id):
+    # Только из pending: изображение могли уже обработать (или заменить) параллельно
+    if PerevalImage.objects.filter(id=image_id, status='pending').update(status='failed', updated_at=timezone.now()):
+        response_cache.invalidate_perevals([pereval_id])
+        changes.record_many([pereval_id], 'updated')
+
+
+def process_image(image_id, payload=None):
+    # Выполняется в фоновом потоке: декодирование, проверка и запись файла в хранилище.
+    # payload=None — данные читаются из PerevalImagePayload (после перезапуска процесса)
+    close_old_connections()
+    try:
+        try:
+            image = PerevalImage.objects.get(id=image_id, status='pending')
+        except PerevalImage.DoesNotExist:
+            drop_payload(image_id)
+            return  # Запись удалили (или уже обработали), пока она ждала обработки
+
+        if payload is None:
+            payload = read_payload(image_id)
+        try:
+            if payload is None:
+                raise ImageDecodeError('данные изображения не сохранились')
+            raw, extension = decode_payload(payload)
+        except ImageDecodeError as exc:
+            logger.warning('Изображение %s не обработано: %s', image_id, exc)
+            mark_failed(image_id, image.pereval_id)
+            drop_payload(image_id)
+            return
+
+        # Одинаковые байты хранятся одним файлом: повторная загрузка того же фото только добавляет ссылку
+        digest, name = blobs.acquire(ContentFile(raw), extension)
+        if not PerevalImage.objects.filter(id=image_id, status='pending').update(
+                data=name, blob=digest, status='ready', updated_at=timezone.now()):
+            release_blob(digest)  # Запись удалили или обработали параллельно, пока файл записывался
+            drop_payload(image_id)
+            return
+        drop_payload(image_id)
+        image.data.name, image.blob_id, image.status = name, digest, 'ready'
+        thumbnails.generate_variants(image)
+        # update() не отправляет post_save: закешированные ответы с этим изображением сбрасываем
+        # и событие для журнала изменений записываем сами
+        response_cache.invalidate_perevals([image.pereval_id])
+        changes.record_many([image.pereval_id], 'updated')
+    except Exception:
+        # Данные остаются в БД: recover_pending() попробует ещё раз
+        logger.exception('Ошибка фоновой обработки изображения %s', image_id)
+    finally:
+        close_old_connections()
+
+
+def get_pending_timeout():
+    # Через сколько секунд изображение в pending считается потерянным (процесс перезапустился)
+    return getattr(settings, 'PEREVAL_IMAGE_PENDING_TIMEOUT', 600)
+
+
+def recover_pending(timeout=None, now=None):
+    # Изображения, застрявшие в pending дольше timeout секунд, обрабатываются заново из сохранённых данных;
+    # без данных или при повторной ошибке — помечаются failed. Возвращает (обработано, с ошибкой).
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=get_pending_timeout() if timeout is None else timeout)
+    ids = list(PerevalImage.objects.filter(status='pending', updated_at__lte=cutoff)
+               .order_by('id').values_list('id', flat=True))
+    for image_id in ids:
+        process_image(image_id)
+    # Повторная попытка тоже не удалась (ошибка хранилища и т. п.) — больше не ждём
+    for image_id, pereval_id in PerevalImage.objects.filter(id__in=ids, status='pending') \
+            .values_list('id', 'pereval_id'):
+        mark_failed(image_id, pereval_id)
+        drop_payload(image_id)
+    processed = PerevalImage.objects.filter(id__in=ids)
+    return processed.filter(status='ready').count(), processed.filter(status='failed').count()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'PEREVAL_IMAGE_WORKERS', 4),
+                thread_name_prefix='pereval-images',
+            )
+        return _executor
+
+
+def submit(image_id, payload=None):
+    # PEREVAL_IMAGE_WORKERS = 0 — обработка в текущем потоке (удобно для тестов и отладки)
+    if getattr(settings, 'PEREVAL_IMAGE_WORKERS', 4) == 0:
+        process_image(image_id, payload)
+    else:
+        get_executor().submit(process_image, image_id, payload)
+
+
+def schedule(pending):
+    # pending: список (изображение, base64). Данные всех изображений сохраняются одним запросом в транзакции
+    # изменения — их не нужно присылать заново, если процесс перезапустится до обработки. Отдельной записи
+    # на диск в запросе нет: данные фиксируются вместе с транзакцией.
+    # Обработка начинается только после фиксации транзакции, иначе поток может не увидеть запись.
+    if not pending:
+        return
+    PerevalImagePayload.objects.bulk_create(
+        [PerevalImagePayload(image_id=image.id, data=payload) for image, payload in pending],
+        update_conflicts=True, unique_fields=['image'], update_fields=['data'])
+    for image, payload in pending:
+        transaction.on_commit(lambda image_id=image.id, payload=payload: submit(image_id, payload))
+
+
+def build_image(pereval, image_data):
+    # Создаёт (без сохранения) запись изображения. Для base64 возвращает и данные для фоновой обработки.
+    # Файл загрузки (image_data['upload']) уже проверен и лежит в хранилище по содержимому.
+    upload = image_data.get('upload')
+    if upload is not None:
+        return PerevalImage(pereval=pereval, title=image_data['title'], data=upload.blob.name,
+                            blob_id=upload.blob_id, status='ready'), None
+    data = image_data['data']
+    if is_inline_payload(data):
+        return PerevalImage(pereval=pereval, title=image_data['title'], status='pending'), data
+    # Путь к общему файлу (pereval_blobs/...) — ещё одна ссылка на него
+    return PerevalImage(pereval=pereval, title=image_data['title'], data=data, blob_id=blobs.take_name(data),
+                        status='ready'), None
+
+
+def assign_data(image, data, upload=None):
+    # Замена файла у существующего изображения. Для base64 возвращает данные для фоновой обработки.
+    if upload is not None:
+        release_file(image)
+        image.data, image.blob_id, image.status = upload.blob.name, upload.blob_id, 'ready'
+        return None
+    if image.data and image.data.name == data:
+        return None  # Файл не меняется, ссылка на него остаётся прежней
+    release_file(image)
+    if is_inline_payload(data):
+        image.data = ''
+        image.status = 'pending'
+        return data
+    image.data = data
+    image.blob_id = blobs.take_name(data)
+    image.status = 'ready'
+    return None
+
+
+def delete_files(names):
+    # Удаляет оригиналы и их уменьшенные копии
+    storage = PerevalImage._meta.get_field('data').storage
+    for name in names:
+        storage.delete(name)
+        thumbnails.delete_variants(storage, name)
+
+
+def delete_unreferenced(names):
+    delete_files(blobs.unreferenced(names))
+
+
+def release_file(image):
+    # Изображение перестаёт ссылаться на свой файл (удалено или получило другой файл)
+    if image.blob_id:
+        release_blob(image.blob_id)
+        image.blob = None
+    elif image.data:
+        discard_file(image.data.name)
+
+
+def release_blob(digest):
+    # Число ссылок уменьшается в текущей транзакции, файл без ссылок удаляется после её фиксации.
+    # Внутри batched_file_cleanup() все ссылки освобождаются одним обработчиком в конце блока.
+    digests = getattr(_cleanup_batch, 'digests', None)
+    if digests is not None:
+        digests.append(digest)
+        return
+    names = blobs.release([digest])
+    if names:
+        transaction.on_commit(lambda: delete_unreferenced(names))
+
+
+def discard_file(name):
+    # Файл удаляется только после фиксации транзакции: при откате он ещё нужен.
+    # Внутри batched_file_cleanup() имена собираются и удаляются одним обработчиком.
+    # Общие файлы (pereval_blobs/...) удаляются только через счётчик ссылок (release_blob).
+    if blobs.is_blob_name(name):
+        return
+    names = getattr(_cleanup_batch, 'names', None)
+    if names is not None:
+        names.append(name)
+    else:
+        transaction.on_commit(lambda: delete_files([name]))
+
+
+@contextmanager
+def batched_file_cleanup():
+    if getattr(_cleanup_batch, 'names', None) is not None:
+        yield  # Уже внутри пакета — имена попадут во внешний
+        return
+
+    names = _cleanup_batch.names = []
+    digests = _cleanup_batch.digests = []
+    try:
+        yield
+    finally:
+        _cleanup_batch.names = _cleanup_batch.digests = None
+    # При исключении сюда не доходим: файлы удалённых (и откаченных) записей не трогаем
+    if names:
+        transaction.on_commit(lambda: delete_files(names))
+    released = blobs.release(digests)
+    if released:
+        transaction.on_commit(lambda: delete_unreferenced(released))
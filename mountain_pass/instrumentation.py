@@ -0,0 +1,275 @@
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from . import db_metrics
+
+logger = logging.getLogger('mountain_pass.performance')
+
+# Замеры на время обработки запроса: запросы к БД (число и время), время сериализаторов перевалов
+# и объём записанного в хранилище медиафайлов. Замер хранится в contextvars, поэтому виден и в потоках
+# sync_to_async асинхронных представлений. Фоновая обработка изображений к запросу не относится и не учитывается.
+_current = contextvars.ContextVar('pereval_request_stats', default=None)
+
+# Границы корзин гистограмм (секунды) и число запросов к БД
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.storage_bytes = 0
+        self._serializer_depth = 0  # Вложенные вызовы (список -> элементы) не считаем дважды
+
+    def as_dict(self, duration):
+        return {
+            'duration_ms': round(duration * 1000, 2),
+            'db_queries': self.db_queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'serializer_ms': round(self.serializer_time * 1000, 2),
+            'storage_bytes': self.storage_bytes,
+        }
+
+
+def current():
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    # Обёртка выполнения SQL (connection.execute_wrapper), установленная на все соединения
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def install_query_wrapper(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def on_connection_created(sender, connection, **kwargs):
+    install_query_wrapper(connection)
+
+
+@contextmanager
+def timed_serializer():
+    stats = _current.get()
+    if stats is None or stats._serializer_depth:
+        yield
+        return
+    stats._serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats._serializer_depth -= 1
+        stats.serializer_time += time.perf_counter() - started
+
+
+def record_storage_write(size):
+    stats = _current.get()
+    if stats is not None:
+        stats.storage_bytes += size
+    elif getattr(settings, 'PEREVAL_METRICS_ENABLED', False):
+        registry.observe_background_write(size)  # Фоновая обработка изображений
+
+
+class TimedSerializerMixin:
+    # Время проверки входных данных и формирования ответа (включая запросы к БД внутри них)
+    def run_validation(self, *args, **kwargs):
+        with timed_serializer():
+            return super().run_validation(*args, **kwargs)
+
+    def to_representation(self, instance):
+        with timed_serializer():
+            return super().to_representation(instance)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Последняя — +Inf
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+
+class Registry:
+    # Метрики процесса в формате Prometheus: гистограммы по маршруту и методу
+    HISTOGRAMS = {
+        'pereval_request_duration_seconds': ('Время обработки запроса', DURATION_BUCKETS),
+        'pereval_request_db_seconds': ('Время запросов к БД за запрос', DURATION_BUCKETS),
+        'pereval_request_db_queries': ('Число запросов к БД за запрос', QUERY_BUCKETS),
+        'pereval_request_serializer_seconds': ('Время сериализаторов перевалов за запрос', DURATION_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (метрика, маршрут, метод) -> Histogram
+        self.requests = {}  # (маршрут, метод, статус) -> число
+        self.storage_bytes = {}  # (маршрут, метод) -> байты
+        self.background_storage_bytes = 0
+
+    def observe(self, route, method, status_code, stats, duration):
+        values = {
+            'pereval_request_duration_seconds': duration,
+            'pereval_request_db_seconds': stats.db_time,
+            'pereval_request_db_queries': stats.db_queries,
+            'pereval_request_serializer_seconds': stats.serializer_time,
+        }
+        with self.lock:
+            for name, value in values.items():
+                key = (name, route, method)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(self.HISTOGRAMS[name][1])
+                self.histograms[key].observe(value)
+            key = (route, method, str(status_code))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.storage_bytes[(route, method)] = self.storage_bytes.get((route, method), 0) + stats.storage_bytes
+
+    def observe_background_write(self, size):
+        with self.lock:
+            self.background_storage_bytes += size
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.requests.clear()
+            self.storage_bytes.clear()
+            self.background_storage_bytes = 0
+
+    @staticmethod
+    def labels(**values):
+        escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                   for name, value in values.items())
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (help_text, buckets) in self.HISTOGRAMS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (metric, route, method), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip([*buckets, '+Inf'], histogram.counts):
+                        cumulative += count
+                        le = bound if bound == '+Inf' else repr(float(bound))
+                        lines.append(f'{name}_bucket{self.labels(route=route, method=method, le=le)} {cumulative}')
+                    lines.append(f'{name}_sum{self.labels(route=route, method=method)} {histogram.total}')
+                    lines.append(f'{name}_count{self.labels(route=route, method=method)} {cumulative}')
+
+            lines += ['# HELP pereval_requests_total Обработанные запросы', '# TYPE pereval_requests_total counter']
+            for (route, method, status_code), count in sorted(self.requests.items()):
+                lines.append(f'pereval_requests_total{self.labels(route=route, method=method, status=status_code)} '
+                             f'{count}')
+
+            lines += ['# HELP pereval_storage_written_bytes_total Байты, записанные в хранилище медиафайлов',
+                      '# TYPE pereval_storage_written_bytes_total counter']
+            for (route, method), count in sorted(self.storage_bytes.items()):
+                lines.append(f'pereval_storage_written_bytes_total{self.labels(route=route, method=method)} {count}')
+            lines += ['# HELP pereval_storage_background_written_bytes_total Байты, записанные фоновой обработкой',
+                      '# TYPE pereval_storage_background_written_bytes_total counter',
+                      f'pereval_storage_background_written_bytes_total {self.background_storage_bytes}']
+
+        # Счётчики соединений с БД (mountain_pass/db_metrics.py)
+        snapshot = db_metrics.snapshot()
+        for name in ('requests', 'connects', 'reconnects', 'checkouts'):
+            lines += [f'# TYPE pereval_db_{name}_total counter', f'pereval_db_{name}_total {snapshot[name]}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def server_timing(stats, duration):
+    return ', '.join([
+        f'db;dur={stats.db_time * 1000:.2f};desc="{stats.db_queries} queries"',
+        f'serializer;dur={stats.serializer_time * 1000:.2f}',
+        f'storage;desc="{stats.storage_bytes} bytes"',
+        f'total;dur={duration * 1000:.2f}',
+    ])
+
+
+class PerformanceMiddleware:
+    # Для каждого запроса к маршрутам проекта: заголовок Server-Timing, строка журнала в JSON
+    # (логгер mountain_pass.performance) и гистограммы для GET /metrics.
+    # У потоковых ответов учитывается время до начала передачи тела.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            stats = self.stop(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stats = self.stop(token)
+        return self.finish(request, response, stats)
+
+    @staticmethod
+    def start():
+        for connection in connections.all(initialized_only=True):
+            install_query_wrapper(connection)
+        return _current.set(RequestStats())
+
+    @staticmethod
+    def stop(token):
+        stats = _current.get()
+        _current.reset(token)
+        return stats
+
+    @staticmethod
+    def finish(request, response, stats):
+        match = getattr(request, 'resolver_match', None)
+        if match is None or match.route is None:
+            return response  # Неизвестные адреса не замеряем: иначе число маршрутов в метриках не ограничено
+        duration = time.perf_counter() - stats.started
+        route = '/' + match.route
+
+        response['Server-Timing'] = server_timing(stats, duration)
+        logger.info(json.dumps({
+            'method': request.method,
+            'route': route,
+            'status': response.status_code,
+            **stats.as_dict(duration),
+        }, ensure_ascii=False))
+        if getattr(settings, 'PEREVAL_METRICS_ENABLED', False):
+            registry.observe(route, request.method, response.status_code, stats, duration)
+        return response
+
@@ -0,0 +1,70 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from mountain_pass import benchmarks
+from mountain_pass.models import Level, User
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный прогон основных методов API на сгенерированных данных: пропускная способность, '
+            'задержки p50/p95/p99 и число запросов к БД по каждому методу (JSON). '
+            'С --baseline завершается с ошибкой при регрессии относительно эталона.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Число пользователей')
+        parser.add_argument('--passes', type=int, default=2000, help='Число перевалов')
+        parser.add_argument('--images-per-pass', type=int, default=2, help='Изображений на перевал')
+        parser.add_argument('--areas', type=int, default=40, help='Число районов')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на каждый метод')
+        parser.add_argument('--scenario', action='append', dest='scenarios', choices=benchmarks.SCENARIOS,
+                            help='Только указанные методы (можно несколько)')
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора данных')
+        parser.add_argument('--with-cache', action='store_true',
+                            help='Не отключать кеш ответов (по умолчанию измеряется работа с БД)')
+        parser.add_argument('--output', help='Записать результат в файл (его можно использовать как эталон)')
+        parser.add_argument('--baseline', help='Файл с результатом предыдущего прогона для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Допустимое ухудшение времени относительно эталона (доля, по умолчанию 0.2)')
+
+    def handle(self, *args, **options):
+        baseline = benchmarks.load_baseline(options['baseline']) if options['baseline'] else None
+        overrides = {'PEREVAL_IMAGE_WORKERS': 0}
+        if not options['with_cache']:
+            overrides['PEREVAL_RESPONSE_CACHE_TIMEOUT'] = 0
+
+        # Прогон идёт в отдельной временной БД (как у тестов), рабочие данные не затрагиваются
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(**overrides):
+                generator = benchmarks.DataGenerator(options['seed'])
+                benchmarks.seed(generator, users=options['users'], passes=options['passes'],
+                                images_per_pass=options['images_per_pass'], areas=options['areas'])
+                suite = benchmarks.Suite(generator, requests=options['requests'], users=options['users'],
+                                         images_per_pass=options['images_per_pass'])
+                results = suite.run(options['scenarios'] or benchmarks.SCENARIOS)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            # Кеши справочников ссылаются на строки удалённой временной БД
+            Level.objects.clear_cache()
+            User.objects.clear_cache()
+
+        report = {
+            'config': {key: options[key] for key in ('users', 'passes', 'images_per_pass', 'areas', 'requests',
+                                                     'seed', 'with_cache')},
+            'results': results,
+        }
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(content)
+        self.stdout.write(content)
+
+        regressions = benchmarks.compare(results, baseline, options['tolerance'])
+        if regressions:
+            raise CommandError('Регрессия производительности:\n' + '\n'.join(regressions))
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from mountain_pass.benchmarks import summarize
+from mountain_pass.models import PerevalAdded
+
+# Нагрузочное сравнение путей WSGI (синхронные представления DRF, pereval/urls.py) и ASGI
+# (асинхронные представления, pereval/urls_async.py). Запросы выполняются в процессе через обработчики
+# Django (WSGIHandler в пуле потоков и ASGIHandler в цикле asyncio) к текущей БД, без сетевого сервера:
+# сравнивается стоимость обработки запроса, а не HTTP-сервера.
+
+URLCONFS = {
+    'wsgi': 'pereval.urls',
+    'asgi': 'pereval.urls_async',
+}
+
+
+def split(total, parts):
+    return [total // parts + (1 if index < total % parts else 0) for index in range(parts)]
+
+
+def run_wsgi(paths, total, concurrency):
+    def worker(count):
+        client = Client()
+        latencies, errors = [], 0
+        try:
+            for index in range(count):
+                started = time.perf_counter()
+                response = client.get(paths[index % len(paths)])
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+        finally:
+            connections.close_all()  # У каждого потока своё соединение
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, split(total, concurrency)))
+    elapsed = time.perf_counter() - started
+    return summarize([value for latencies, _ in results for value in latencies],
+                     sum(errors for _, errors in results), elapsed)
+
+
+def run_asgi(paths, total, concurrency):
+    async def worker(count):
+        client = AsyncClient()
+        latencies, errors = [], 0
+        for index in range(count):
+            started = time.perf_counter()
+            response = await client.get(paths[index % len(paths)])
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code != 200
+        return latencies, errors
+
+    async def run():
+        return await asyncio.gather(*(worker(count) for count in split(total, concurrency)))
+
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    return summarize([value for latencies, _ in results for value in latencies],
+                     sum(errors for _, errors in results), elapsed)
+
+
+RUNNERS = {
+    'wsgi': run_wsgi,
+    'asgi': run_asgi,
+}
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность (запросов/с) и задержку p99 путей WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Число запросов на каждый режим')
+        parser.add_argument('--concurrency', type=int, default=20, help='Число одновременных клиентов')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Путь для запросов (можно несколько); по умолчанию — получение перевала '
+                                 'и список по email для первого перевала в БД')
+        parser.add_argument('--with-cache', action='store_true',
+                            help='Не отключать кеш ответов (по умолчанию измеряется работа с БД)')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def default_paths(self):
+        pereval = PerevalAdded.objects.select_related('user').order_by('id').first()
+        if pereval is None:
+            raise CommandError('В БД нет перевалов: укажите --path или добавьте данные')
+        return [
+            reverse('pereval_detail_update', kwargs={'id': pereval.id}),
+            reverse('submit_data_by_email') + f'?user__email={pereval.user.email}',
+        ]
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests и --concurrency должны быть больше нуля')
+        paths = options['paths'] or self.default_paths()
+        overrides = {} if options['with_cache'] else {'PEREVAL_RESPONSE_CACHE_TIMEOUT': 0}
+
+        results = {}
+        for mode, runner in RUNNERS.items():
+            with override_settings(ROOT_URLCONF=URLCONFS[mode], **overrides):
+                runner(paths, min(options['requests'], 20), options['concurrency'])  # Прогрев
+                results[mode] = runner(paths, options['requests'], options['concurrency'])
+        connections.close_all()
+
+        if options['json']:
+            self.stdout.write(json.dumps({'paths': paths, 'results': results}, ensure_ascii=False))
+            return
+
+        self.stdout.write(f'Пути: {", ".join(paths)}')
+        self.stdout.write(f'{"режим":<6} {"запросов/с":>11} {"p50, мс":>9} {"p99, мс":>9} {"ошибок":>7}')
+        for mode, result in results.items():
+            self.stdout.write(f'{mode:<6} {result["rps"]:>11} {result["p50_ms"]:>9} '
+                              f'{result["p99_ms"]:>9} {result["errors"]:>7}')
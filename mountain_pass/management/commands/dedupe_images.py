@@ -0,0 +1,58 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from mountain_pass import blobs, images
+from mountain_pass.models import ImageBlob, PerevalAdded, PerevalImage
+from mountain_pass.signals import perevals_changed
+
+
+class Command(BaseCommand):
+    help = ('Переносит файлы изображений, загруженные до хранения по содержимому, в pereval_blobs/: '
+            'одинаковые файлы остаются одной копией, старые файлы удаляются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Файлов в одной порции')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+        storage = blobs.get_storage()
+        legacy = (PerevalImage.objects.filter(blob__isnull=True, status='ready').exclude(data='')
+                  .order_by('data').values_list('data', flat=True).distinct())
+
+        moved = missing = 0
+        last = ''
+        while True:
+            names = list(legacy.filter(data__gt=last)[:options['batch_size']])
+            if not names:
+                break
+            last = names[-1]
+            pereval_ids = set()
+            for name in names:
+                if not storage.exists(name):
+                    missing += 1
+                    continue
+                extension = os.path.splitext(name)[1].lstrip('.').lower() or 'jpg'
+                with storage.open(name, 'rb') as content:
+                    digest, blob_name = blobs.acquire(content, extension)
+                with transaction.atomic():
+                    # acquire() добавил одну ссылку, а на старый файл могут ссылаться несколько изображений
+                    rows = PerevalImage.objects.filter(data=name, blob__isnull=True)
+                    pereval_ids.update(rows.values_list('pereval_id', flat=True))
+                    count = rows.update(data=blob_name, blob=digest)
+                    if count:
+                        ImageBlob.objects.filter(sha256=digest).update(refcount=F('refcount') + count - 1)
+                        transaction.on_commit(lambda name=name: images.delete_files([name]))
+                    else:
+                        images.release_blob(digest)
+                moved += 1
+            # Адреса изображений изменились: сбрасываем закешированные ответы и пишем события для синхронизации
+            if pereval_ids:
+                perevals_changed.send(sender=PerevalAdded, pereval_ids=sorted(pereval_ids))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: перенесено файлов {moved}, не найдено в хранилище {missing}, '
+            f'уникальных файлов {ImageBlob.objects.count()}'))
@@ -0,0 +1,44 @@
+import sys
+from urllib.parse import urljoin
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mountain_pass import export
+from mountain_pass.models import PerevalAdded
+
+
+class Command(BaseCommand):
+    help = 'Выгружает перевалы в GeoJSON, CSV или NDJSON (потоково, без загрузки всех записей в память)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(export.FORMATS), default='geojson', dest='export_format')
+        parser.add_argument('--output', default='-', help='Файл для записи; по умолчанию — стандартный вывод')
+        parser.add_argument('--status', default='accepted', help='Статусы через запятую (по умолчанию accepted)')
+        parser.add_argument('--gzip', action='store_true', help='Сжать результат (gzip)')
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE,
+                            help='Записей в одной порции чтения из БД')
+        parser.add_argument('--base-url', default='',
+                            help='Адрес сайта для абсолютных ссылок на изображения, например https://example.com')
+
+    def handle(self, *args, **options):
+        statuses = options['status'].split(',')
+        allowed = {value for value, _ in PerevalAdded.CHOICE_STATUS}
+        if not set(statuses) <= allowed:
+            raise CommandError(f'--status: допустимые значения {", ".join(sorted(allowed))}')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть больше нуля')
+
+        base_url = options['base_url']
+        chunks = export.stream(options['export_format'], export.get_queryset(statuses),
+                               build_url=(lambda url: urljoin(base_url, url)) if base_url else None,
+                               compress=options['gzip'], chunk_size=options['chunk_size'])
+
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+            else:
+                output.flush()
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mountain_pass import images
+
+
+class Command(BaseCommand):
+    help = ('Обрабатывает изображения, оставшиеся в статусе pending после перезапуска процесса, из сохранённых '
+            'в БД данных; изображения без данных помечаются failed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None,
+                            help='Через сколько секунд в pending изображение считается потерянным '
+                                 '(по умолчанию PEREVAL_IMAGE_PENDING_TIMEOUT)')
+
+    def handle(self, *args, **options):
+        if options['older_than'] is not None and options['older_than'] < 0:
+            raise CommandError('--older-than не может быть отрицательным')
+        processed, failed = images.recover_pending(options['older_than'])
+        self.stdout.write(self.style.SUCCESS(f'Готово: обработано изображений {processed}, с ошибкой {failed}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from mountain_pass import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Удаляет сохранённые ответы submitData с истёкшим сроком хранения ключа Idempotency-Key'
+
+    def handle(self, *args, **options):
+        count = idempotency.purge()
+        self.stdout.write(self.style.SUCCESS(f'Готово: удалено ключей {count}'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from mountain_pass import uploads
+
+
+class Command(BaseCommand):
+    help = ('Удаляет просроченные загрузки изображений (PEREVAL_UPLOAD_TTL): временные файлы незавершённых '
+            'и файлы завершённых, но не использованных в submitData')
+
+    def handle(self, *args, **options):
+        count = uploads.purge()
+        self.stdout.write(self.style.SUCCESS(f'Готово: удалено загрузок {count}'))
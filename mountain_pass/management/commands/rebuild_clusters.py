@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from mountain_pass import clusters
+from mountain_pass.models import PerevalCluster
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересчитывает агрегаты перевалов для обзорной карты (PerevalCluster)'
+
+    def handle(self, *args, **options):
+        clusters.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {PerevalCluster.objects.filter(count__gt=0).count()} непустых ячеек'))
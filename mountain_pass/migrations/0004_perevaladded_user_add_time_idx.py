@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0003_level_rename_img_path_perevalimage_data_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(fields=['user', 'add_time', 'id'], name='pereval_user_add_time_idx'),
+        ),
+    ]
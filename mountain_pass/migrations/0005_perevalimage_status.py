@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0004_perevaladded_user_add_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perevalimage',
+            name='status',
+            field=models.CharField(choices=[('pending', 'ожидает обработки'), ('ready', 'обработано'), ('failed', 'ошибка обработки')], default='ready', max_length=10, verbose_name='Статус обработки'),
+        ),
+        migrations.AlterField(
+            model_name='perevalimage',
+            name='data',
+            field=models.ImageField(blank=True, upload_to='pereval_images/%Y/%m/%d/'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:29
+
+from django.db import migrations, models
+
+from mountain_pass import geo
+
+
+def fill_geohash(apps, schema_editor):
+    Coords = apps.get_model('mountain_pass', 'Coords')
+    batch = []
+    for coords in Coords.objects.only('id', 'latitude', 'longitude').iterator(chunk_size=2000):
+        coords.geohash = geo.encode(coords.latitude, coords.longitude)
+        batch.append(coords)
+        if len(batch) >= 2000:
+            Coords.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        Coords.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0005_perevalimage_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coords',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
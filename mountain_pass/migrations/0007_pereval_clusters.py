@@ -0,0 +1,51 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0006_coords_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerevalClusterMember',
+            fields=[
+                ('pereval', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cluster_member', serialize=False, to='mountain_pass.perevaladded')),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('difficulty', models.CharField(blank=True, default='', max_length=2)),
+            ],
+            options={
+                'verbose_name': 'Перевал в кластере',
+                'verbose_name_plural': 'Перевалы в кластерах',
+            },
+        ),
+        migrations.CreateModel(
+            name='PerevalCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('cell_x', models.IntegerField()),
+                ('cell_y', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('latitude_sum', models.FloatField(default=0)),
+                ('longitude_sum', models.FloatField(default=0)),
+                ('level_none', models.IntegerField(default=0)),
+                ('level_1a', models.IntegerField(default=0)),
+                ('level_1b', models.IntegerField(default=0)),
+                ('level_2a', models.IntegerField(default=0)),
+                ('level_2b', models.IntegerField(default=0)),
+                ('level_3a', models.IntegerField(default=0)),
+                ('level_3b', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Кластер перевалов',
+                'verbose_name_plural': 'Кластеры перевалов',
+                'constraints': [models.UniqueConstraint(fields=('zoom', 'cell_x', 'cell_y'), name='pereval_cluster_cell_unique')],
+            },
+        ),
+    ]
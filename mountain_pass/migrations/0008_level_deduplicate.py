@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+SEASONS = ('winter', 'summer', 'autumn', 'spring')
+
+
+def deduplicate_levels(apps, schema_editor):
+    # Каждая комбинация сезонных категорий остаётся одной строкой (с минимальным id),
+    # перевалы перепривязываются к ней, дубликаты удаляются
+    Level = apps.get_model('mountain_pass', 'Level')
+    PerevalAdded = apps.get_model('mountain_pass', 'PerevalAdded')
+
+    for season in SEASONS:
+        Level.objects.filter(**{f'{season}__isnull': True}).update(**{season: ''})
+
+    canonical = {}
+    duplicates = {}
+    for values in Level.objects.order_by('id').values_list('id', *SEASONS).iterator(chunk_size=5000):
+        level_id, key = values[0], values[1:]
+        if key in canonical:
+            duplicates.setdefault(canonical[key], []).append(level_id)
+        else:
+            canonical[key] = level_id
+
+    for keep_id, duplicate_ids in duplicates.items():
+        for start in range(0, len(duplicate_ids), 5000):
+            chunk = duplicate_ids[start:start + 5000]
+            PerevalAdded.objects.filter(level_id__in=chunk).update(level_id=keep_id)
+            Level.objects.filter(id__in=chunk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0007_pereval_clusters'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_levels, migrations.RunPython.noop),
+    ]
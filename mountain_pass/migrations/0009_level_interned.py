@@ -0,0 +1,43 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0008_level_deduplicate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='level',
+            name='autumn',
+            field=models.CharField(blank=True, choices=[('', ''), ('1А', '1А'), ('1Б', '1Б'), ('2А', '2А'), ('2Б', '2Б'), ('3А', '3А'), ('3Б', '3Б')], default='', max_length=2, verbose_name='Осень'),
+        ),
+        migrations.AlterField(
+            model_name='level',
+            name='spring',
+            field=models.CharField(blank=True, choices=[('', ''), ('1А', '1А'), ('1Б', '1Б'), ('2А', '2А'), ('2Б', '2Б'), ('3А', '3А'), ('3Б', '3Б')], default='', max_length=2, verbose_name='Весна'),
+        ),
+        migrations.AlterField(
+            model_name='level',
+            name='summer',
+            field=models.CharField(blank=True, choices=[('', ''), ('1А', '1А'), ('1Б', '1Б'), ('2А', '2А'), ('2Б', '2Б'), ('3А', '3А'), ('3Б', '3Б')], default='', max_length=2, verbose_name='Лето'),
+        ),
+        migrations.AlterField(
+            model_name='level',
+            name='winter',
+            field=models.CharField(blank=True, choices=[('', ''), ('1А', '1А'), ('1Б', '1Б'), ('2А', '2А'), ('2Б', '2Б'), ('3А', '3А'), ('3Б', '3Б')], default='', max_length=2, verbose_name='Зима'),
+        ),
+        migrations.AlterField(
+            model_name='perevaladded',
+            name='level',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='mountain_pass.level'),
+        ),
+        migrations.AddConstraint(
+            model_name='level',
+            constraint=models.UniqueConstraint(fields=('winter', 'summer', 'autumn', 'spring'), name='level_seasons_unique'),
+        ),
+    ]
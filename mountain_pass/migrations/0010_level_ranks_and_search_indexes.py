@@ -0,0 +1,55 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:33
+
+from django.db import migrations, models
+
+
+RANKS = {'': 0, '1А': 1, '1Б': 2, '2А': 3, '2Б': 4, '3А': 5, '3Б': 6}
+SEASONS = ('winter', 'summer', 'autumn', 'spring')
+
+
+def fill_ranks(apps, schema_editor):
+    Level = apps.get_model('mountain_pass', 'Level')
+    levels = list(Level.objects.all())
+    for level in levels:
+        for season in SEASONS:
+            setattr(level, f'{season}_rank', RANKS.get(getattr(level, season) or '', 0))
+    Level.objects.bulk_update(levels, [f'{season}_rank' for season in SEASONS], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0009_level_interned'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='level',
+            name='autumn_rank',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='level',
+            name='spring_rank',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='level',
+            name='summer_rank',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='level',
+            name='winter_rank',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(fields=['status', 'level'], name='pereval_status_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(fields=['area', 'status'], name='pereval_area_status_idx'),
+        ),
+        migrations.RunPython(fill_ranks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_trigram_index(apps, schema_editor):
+    # На PostgreSQL поиск идёт через pg_trgm и GIN-индекс, на других СУБД — через таблицу триграмм
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS pereval_search_text_trgm_idx '
+        'ON mountain_pass_perevaladded USING gin (search_text gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS pereval_search_text_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0010_level_ranks_and_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perevaladded',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.CreateModel(
+            name='PerevalSearchTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('pereval', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_trigrams', to='mountain_pass.perevaladded')),
+            ],
+            options={
+                'verbose_name': 'Триграмма названия',
+                'verbose_name_plural': 'Триграммы названий',
+                'constraints': [models.UniqueConstraint(fields=('trigram', 'pereval'), name='pereval_trigram_unique')],
+            },
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+from mountain_pass import search
+
+
+def fill_search_text(apps, schema_editor):
+    PerevalAdded = apps.get_model('mountain_pass', 'PerevalAdded')
+    PerevalSearchTrigram = apps.get_model('mountain_pass', 'PerevalSearchTrigram')
+    use_trigram_table = schema_editor.connection.vendor != 'postgresql'
+
+    def flush(batch):
+        PerevalAdded.objects.bulk_update(batch, ['search_text'])
+        if use_trigram_table:
+            PerevalSearchTrigram.objects.bulk_create([
+                PerevalSearchTrigram(pereval_id=pereval.id, trigram=trigram)
+                for pereval in batch for trigram in search.trigrams(pereval.search_text)
+            ], batch_size=2000)
+
+    batch = []
+    for pereval in PerevalAdded.objects.only('id', 'title', 'beauty_title', 'other_titles').iterator(chunk_size=2000):
+        pereval.search_text = search.normalize(pereval.title, pereval.beauty_title, pereval.other_titles)
+        batch.append(pereval)
+        if len(batch) >= 2000:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0011_pereval_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+    ]
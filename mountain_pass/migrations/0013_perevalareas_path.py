@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:51
+
+from django.db import migrations, models
+
+from mountain_pass import areas
+
+
+def fill_paths(apps, schema_editor):
+    # Пути заполняются по уровням иерархии, начиная с корневых районов
+    PerevalAreas = apps.get_model('mountain_pass', 'PerevalAreas')
+    rows = list(PerevalAreas.objects.only('id', 'id_parent'))
+    children = {}
+    for area in rows:
+        children.setdefault(area.id_parent_id, []).append(area)
+
+    level, parent_paths = children.get(None, []), {None: ''}
+    while level:
+        for area in level:
+            area.path = areas.make_path(parent_paths[area.id_parent_id], area.id)
+            parent_paths[area.id] = area.path
+        PerevalAreas.objects.bulk_update(level, ['path'], batch_size=2000)
+        level = [child for area in level for child in children.get(area.id, [])]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0012_fill_search_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perevalareas',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0013_perevalareas_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perevaladded',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='perevaladded',
+            name='moderator',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='moderated_perevals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(condition=models.Q(('status', 'new')), fields=['add_time', 'id'], name='pereval_moderation_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perevaladded',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['moderator', 'claimed_at'], name='pereval_moderation_claimed_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:57
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_changes(apps, schema_editor):
+    # Время изменения существующих записей — время добавления; в журнал — событие created для каждого
+    # перевала, чтобы синхронизация с нулевого токена получила и записи, созданные до появления журнала
+    PerevalAdded = apps.get_model('mountain_pass', 'PerevalAdded')
+    PerevalImage = apps.get_model('mountain_pass', 'PerevalImage')
+    PerevalChange = apps.get_model('mountain_pass', 'PerevalChange')
+    PerevalAdded.objects.update(updated_at=F('add_time'))
+    PerevalImage.objects.update(updated_at=F('date_added'))
+
+    batch = []
+    rows = PerevalAdded.objects.order_by('id').values_list('id', 'user_id', 'status', 'add_time')
+    for pereval_id, user_id, status, add_time in rows.iterator(chunk_size=2000):
+        batch.append(PerevalChange(pereval_id=pereval_id, user_id=user_id, kind='created', status=status,
+                                   created_at=add_time))
+        if len(batch) >= 2000:
+            PerevalChange.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PerevalChange.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0014_moderation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perevaladded',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='perevalimage',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.CreateModel(
+            name='PerevalChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('pereval_id', models.BigIntegerField()),
+                ('user_id', models.BigIntegerField(null=True)),
+                ('kind', models.CharField(choices=[('created', 'создан'), ('updated', 'изменён'), ('status', 'изменён статус модерации'), ('deleted', 'удалён'), ('image_deleted', 'удалено изображение')], max_length=20)),
+                ('status', models.CharField(blank=True, default='', max_length=30)),
+                ('image_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Изменение перевала',
+                'verbose_name_plural': 'Изменения перевалов',
+                'indexes': [models.Index(fields=['user_id', 'id'], name='pereval_change_user_idx')],
+            },
+        ),
+        migrations.RunPython(fill_changes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:06
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0016_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер, байт')),
+                ('offset', models.PositiveBigIntegerField(default=0, verbose_name='Получено, байт')),
+                ('status', models.CharField(choices=[('open', 'загружается'), ('complete', 'загружено'), ('used', 'использовано')], default='open', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('blob', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='uploads', to='mountain_pass.imageblob')),
+            ],
+            options={
+                'verbose_name': 'Загрузка изображения',
+                'verbose_name_plural': 'Загрузки изображений',
+            },
+        ),
+    ]
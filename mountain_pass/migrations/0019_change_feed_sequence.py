@@ -0,0 +1,52 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:27
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_events(apps, schema_editor):
+    # Уже выданные клиентам токены — номера id: у существующих событий seq = id
+    PerevalChange = apps.get_model('mountain_pass', 'PerevalChange')
+    PerevalChangeSequence = apps.get_model('mountain_pass', 'PerevalChangeSequence')
+    PerevalChange.objects.update(seq=F('id'))
+    last_seq = PerevalChange.objects.aggregate(last=Max('id'))['last'] or 0
+    PerevalChangeSequence.objects.create(id=1, last_seq=last_seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0018_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerevalChangeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_seq', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Номер журнала изменений',
+                'verbose_name_plural': 'Номер журнала изменений',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='perevalchange',
+            name='pereval_change_user_idx',
+        ),
+        migrations.AddField(
+            model_name='perevalchange',
+            name='seq',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.RunPython(number_existing_events, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='perevalchange',
+            index=models.Index(fields=['user_id', 'seq'], name='pereval_change_user_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perevalchange',
+            index=models.Index(condition=models.Q(('seq__isnull', True)), fields=['id'], name='pereval_change_unsequenced_idx'),
+        ),
+    ]
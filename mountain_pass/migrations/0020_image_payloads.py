@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0019_change_feed_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerevalImagePayload',
+            fields=[
+                ('image', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payload', serialize=False, to='mountain_pass.perevalimage')),
+                ('data', models.TextField()),
+            ],
+            options={
+                'verbose_name': 'Данные необработанного изображения',
+                'verbose_name_plural': 'Данные необработанных изображений',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0020_image_payloads'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='perevalareas',
+            name='path',
+            field=models.TextField(blank=True, db_index=True, default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mountain_pass', '0021_area_path_text'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='coords',
+            name='longitude',
+            field=models.DecimalField(decimal_places=8, max_digits=11),
+        ),
+    ]
@@ -1,8 +1,114 @@
-from django.db import models
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q, Value
+from django.db.models.functions import Concat, Substr
+from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
+from django.utils import timezone
+from django_cleanup import cleanup
+
+from . import areas, geo, search
 
 
 # Create your models here.
+
+class UserManager(models.Manager):
+    # Отправитель определяется по email. Соответствие email -> пользователь кешируется в памяти процесса
+    # на PEREVAL_USER_CACHE_TTL секунд, чтобы повторные отправки не искали пользователя в БД.
+    # Кеш сбрасывается при изменении и удалении пользователя (см. signals.py).
+    FIELDS = ('id', 'email', 'fam', 'name', 'otc', 'phone', 'is_active')
+
+    _cache = OrderedDict()  # email -> (истекает, значения FIELDS)
+    _cache_lock = threading.Lock()
+
+    @staticmethod
+    def cache_ttl():
+        return getattr(settings, 'PEREVAL_USER_CACHE_TTL', 300)
+
+    @staticmethod
+    def cache_size():
+        return getattr(settings, 'PEREVAL_USER_CACHE_SIZE', 10000)
+
+    def clear_cache(self):
+        with self._cache_lock:
+            UserManager._cache = OrderedDict()
+
+    def forget(self, user):
+        # Удаляем и запись под текущим email, и записи с тем же id (если email изменился)
+        with self._cache_lock:
+            for email, (_, values) in list(UserManager._cache.items()):
+                if email == user.email or values[0] == user.pk:
+                    del UserManager._cache[email]
+
+    def _remember(self, users):
+        # Как и в справочнике Level, в кеш попадают только зафиксированные строки
+        rows = [tuple(getattr(user, field) for field in self.FIELDS) for user in users]
+        if not rows or not self.cache_ttl():
+            return
+
+        def update_cache():
+            expires = time.monotonic() + self.cache_ttl()
+            with self._cache_lock:
+                cache = UserManager._cache
+                for values in rows:
+                    cache.pop(values[1], None)
+                    cache[values[1]] = (expires, values)
+                while len(cache) > self.cache_size():
+                    cache.popitem(last=False)  # Вытесняем самые старые записи
+        transaction.on_commit(update_cache, using=self.db)
+
+    def _cached(self, emails):
+        now = time.monotonic()
+        found, missing = {}, set()
+        with self._cache_lock:
+            for email in set(emails):
+                entry = UserManager._cache.get(email)
+                if entry is not None and entry[0] > now:
+                    found[email] = self.model.from_db(self.db, self.FIELDS, entry[1])
+                else:
+                    missing.add(email)
+        return found, missing
+
+    def resolve_many(self, emails):
+        # Возвращает {email: User} для существующих пользователей: из кеша или одним запросом к БД
+        found, missing = self._cached(emails)
+        if missing:
+            loaded = list(self.get_queryset().filter(email__in=missing).only(*self.FIELDS))
+            self._remember(loaded)
+            found.update((user.email, user) for user in loaded)
+        return found
+
+    async def aresolve_many(self, emails):
+        found, missing = self._cached(emails)
+        if missing:
+            loaded = [user async for user in self.get_queryset().filter(email__in=missing).only(*self.FIELDS)]
+            await sync_to_async(self._remember)(loaded)  # on_commit обращается к соединению с БД
+            found.update((user.email, user) for user in loaded)
+        return found
+
+    def resolve(self, email):
+        return self.resolve_many([email]).get(email)
+
+    def get_or_create_from(self, data, user=None):
+        # user — пользователь, уже найденный при валидации; иначе ищем или создаём.
+        # Одновременные первые отправки с одного email безопасны: при нарушении уникальности
+        # get_or_create откатывает свою точку сохранения и читает созданную другим запросом строку.
+        if user is not None:
+            return user
+        user, _ = self.get_or_create(email=data['email'], defaults={
+            'fam': data['fam'],
+            'name': data['name'],
+            'otc': data.get('otc'),
+            'phone': data.get('phone'),
+        })
+        return user
+
 class User(models.Model):
     email = models.EmailField(unique=True)
     fam = models.CharField(max_length=255, verbose_name='Фамилия')
@@ -26,6 +132,8 @@ class User(models.Model):
 
     is_active = models.BooleanField(default=True)
 
+    objects = UserManager()
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name']
 
@@ -39,8 +147,12 @@ class User(models.Model):
 
 class Coords(models.Model):
     latitude = models.DecimalField(decimal_places=8, max_digits=10)
-    longitude = models.DecimalField(decimal_places=8, max_digits=10)
+    # Долгота до ±180: три цифры до запятой
+    longitude = models.DecimalField(decimal_places=8, max_digits=11)
     height = models.IntegerField(null=True)
+    # Геохеш координат: индекс по нему используется для поиска по области (см. mountain_pass/geo.py)
+    geohash = models.CharField(max_length=geo.GEOHASH_PRECISION, blank=True, default='', db_index=True,
+                               editable=False)
 
     class Meta:
         verbose_name = "Координаты"
@@ -49,6 +161,86 @@ class Coords(models.Model):
     def __str__(self):
         return f"{self.latitude}, {self.longitude}, {self.height}"
 
+    def update_geohash(self):
+        # bulk_create не вызывает save(), поэтому при пакетной вставке метод вызывается явно
+        self.geohash = geo.encode(self.latitude, self.longitude)
+
+    def save(self, *args, **kwargs):
+        self.update_geohash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
+
+class LevelManager(models.Manager):
+    # Level — справочник значений: каждая комбинация сезонных категорий хранится одной строкой.
+    # Соответствие комбинация -> id кешируется в памяти процесса (не более 7^4 записей).
+    # Справочник загружается лениво, при первом обращении, а не при запуске процесса.
+    _cache = {}
+    _cache_lock = threading.Lock()
+    _warmed = False
+    _generation = 0  # Увеличивается при каждом сбросе кеша
+
+    @staticmethod
+    def make_key(data):
+        return tuple(data.get(season) or '' for season in Level.SEASONS)
+
+    def clear_cache(self):
+        with self._cache_lock:
+            LevelManager._cache = {}
+            LevelManager._warmed = False
+            LevelManager._generation += 1
+
+    def _remember(self, rows, warmed=False):
+        # В кеш попадают только зафиксированные строки: после отката транзакции id были бы недействительны,
+        # поэтому и признак загрузки всего справочника (warmed) выставляется только после фиксации.
+        # Строки, прочитанные до сброса кеша, в кеш не попадают.
+        generation = LevelManager._generation
+
+        def update_cache():
+            with self._cache_lock:
+                if LevelManager._generation != generation:
+                    return
+                LevelManager._cache.update(rows)
+                if warmed:
+                    LevelManager._warmed = True
+        transaction.on_commit(update_cache, using=self.db)
+
+    def warm_cache(self):
+        # Весь справочник загружается одним запросом при первом обращении
+        rows = {self.make_key({season: values[i] for i, season in enumerate(Level.SEASONS)}): values[-1]
+                for values in self.get_queryset().values_list(*Level.SEASONS, 'id')}
+        self._remember(rows, warmed=True)
+        return rows
+
+    def intern_many(self, items):
+        # Возвращает экземпляры Level для списка словарей с сезонными категориями.
+        # Отсутствующие комбинации создаются одним bulk_create; запросов к БД не больше трёх.
+        keys = [self.make_key(item) for item in items]
+        cache = LevelManager._cache
+        known = {key: cache[key] for key in set(keys) if key in cache}
+        missing = set(keys) - known.keys()
+        if missing and not LevelManager._warmed:
+            known.update(self.warm_cache())
+            missing -= known.keys()
+
+        if missing:
+            condition = Q()
+            for key in missing:
+                condition |= Q(**dict(zip(Level.SEASONS, key)))
+            # ignore_conflicts: ту же комбинацию могла одновременно создать другая транзакция
+            self.bulk_create([Level.from_key(key) for key in missing], ignore_conflicts=True)
+            found = {self.make_key({season: values[i] for i, season in enumerate(Level.SEASONS)}): values[-1]
+                     for values in self.get_queryset().filter(condition).values_list(*Level.SEASONS, 'id')}
+            self._remember(found)
+            known.update(found)
+
+        return [Level.from_key(key, id=known[key]) for key in keys]
+
+    def intern(self, **data):
+        return self.intern_many([data])[0]
+
 
 class Level(models.Model):
     CHOICE_LEVEL = [
@@ -60,23 +252,62 @@ class Level(models.Model):
         ('3А', '3А'),
         ('3Б', '3Б'),
     ]
+    SEASONS = ('winter', 'summer', 'autumn', 'spring')
 
     winter = models.CharField(max_length=2, choices=CHOICE_LEVEL, default='',
-                              blank=True, null=True, verbose_name='Зима')
+                              blank=True, verbose_name='Зима')
     summer = models.CharField(max_length=2, choices=CHOICE_LEVEL, default='',
-                              blank=True, null=True, verbose_name='Лето')
+                              blank=True, verbose_name='Лето')
     autumn = models.CharField(max_length=2, choices=CHOICE_LEVEL, default='',
-                              blank=True, null=True, verbose_name='Осень')
+                              blank=True, verbose_name='Осень')
     spring = models.CharField(max_length=2, choices=CHOICE_LEVEL, default='',
-                              blank=True, null=True, verbose_name='Весна')
+                              blank=True, verbose_name='Весна')
+
+    # Порядковые номера категорий (0 — не указана, 1 — 1А, ..., 6 — 3Б): по ним фильтр
+    # "не сложнее 1Б" превращается в сравнение чисел по индексу
+    winter_rank = models.PositiveSmallIntegerField(default=0, editable=False, db_index=True)
+    summer_rank = models.PositiveSmallIntegerField(default=0, editable=False, db_index=True)
+    autumn_rank = models.PositiveSmallIntegerField(default=0, editable=False, db_index=True)
+    spring_rank = models.PositiveSmallIntegerField(default=0, editable=False, db_index=True)
+
+    # Строки справочника общие для многих перевалов: их не изменяют, а перевалу назначают другую строку
+    objects = LevelManager()
 
     class Meta:
         verbose_name = "Уровень сложности"
         verbose_name_plural = "Уровни сложности"
+        constraints = [
+            models.UniqueConstraint(fields=['winter', 'summer', 'autumn', 'spring'], name='level_seasons_unique'),
+        ]
 
     def __str__(self):
         return f'{self.winter}, {self.summer}, {self.autumn}, {self.spring}'
 
+    @classmethod
+    def rank(cls, value):
+        return [choice for choice, _ in cls.CHOICE_LEVEL].index(value or '')
+
+    @classmethod
+    def from_key(cls, key, **kwargs):
+        level = cls(**dict(zip(cls.SEASONS, key)), **kwargs)
+        level.fill_ranks()
+        return level
+
+    def fill_ranks(self):
+        for season in self.SEASONS:
+            setattr(self, f'{season}_rank', self.rank(getattr(self, season)))
+
+    def save(self, *args, **kwargs):
+        self.fill_ranks()
+        super().save(*args, **kwargs)
+
+class PerevalAddedQuerySet(models.QuerySet):
+    def with_related(self):
+        # Подгружаем всё, что нужно PerevalDetailSerializer, за фиксированное число запросов:
+        # пользователь, координаты и уровень через JOIN, изображения одним дополнительным запросом
+        return self.select_related('user', 'coords', 'level').prefetch_related('pereval_images')
+
+
 class PerevalAdded(models.Model):
     CHOICE_STATUS = [
         ("new", 'новый'),
@@ -87,7 +318,8 @@ class PerevalAdded(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     coords = models.OneToOneField(Coords, on_delete=models.CASCADE)
-    level = models.ForeignKey(Level, on_delete=models.CASCADE, blank=True, null=True)
+    # PROTECT: строка Level общая для многих перевалов, её удаление не должно удалять перевалы
+    level = models.ForeignKey(Level, on_delete=models.PROTECT, blank=True, null=True)
 
     beauty_title = models.CharField(max_length=255, blank=True, null=True)
     title = models.CharField(max_length=255)
@@ -107,32 +339,201 @@ class PerevalAdded(models.Model):
     # Но в итоговом JSON теле запроса с информацией о перевале этих данных нет...
     activities = models.ManyToManyField('SprActivitiesTypes', blank=True)
 
+    # Нормализованные названия для поиска (см. mountain_pass/search.py)
+    search_text = models.TextField(blank=True, default='', editable=False)
+
+    # Модерация (см. mountain_pass/moderation.py): кто и когда взял запись в работу
+    moderator = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+                                  related_name='moderated_perevals')
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    # Время последнего изменения (QuerySet.update и bulk_update задают его явно)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = PerevalAddedQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Перевал"
         verbose_name_plural = "Перевалы"
+        indexes = [
+            # Keyset-пагинация списка перевалов пользователя по (add_time, id)
+            models.Index(fields=['user', 'add_time', 'id'], name='pereval_user_add_time_idx'),
+            # Поиск по статусу вместе со сложностью или районом (api/v1/passes)
+            models.Index(fields=['status', 'level'], name='pereval_status_level_idx'),
+            models.Index(fields=['area', 'status'], name='pereval_area_status_idx'),
+            # Очередь модерации: частичные индексы только по записям new и pending, а не по всей таблице
+            models.Index(fields=['add_time', 'id'], condition=Q(status='new'), name='pereval_moderation_queue_idx'),
+            models.Index(fields=['moderator', 'claimed_at'], condition=Q(status='pending'),
+                         name='pereval_moderation_claimed_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Статус на момент загрузки: по нему журнал изменений отличает смену статуса от редактирования
+        instance._loaded_status = instance.__dict__.get('status')
+        # Поля, от которых зависит вклад перевала в агрегаты обзорной карты (см. clusters.map_fields_changed)
+        instance._loaded_map_fields = tuple(instance.__dict__.get(field)
+                                            for field in ('status', 'coords_id', 'level_id'))
+        return instance
+
+    def update_search_text(self):
+        # bulk_create не вызывает save(), поэтому при пакетной вставке метод вызывается явно.
+        # Возвращает True, если текст изменился и перевал нужно переиндексировать.
+        search_text = search.normalize(self.title, self.beauty_title, self.other_titles)
+        changed = search_text != self.search_text
+        self.search_text = search_text
+        return changed
+
+    def save(self, *args, **kwargs):
+        changed = self.update_search_text()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            if {'title', 'beauty_title', 'other_titles'} & set(update_fields):
+                kwargs['update_fields'] = set(update_fields) | {'search_text'}
+            else:
+                changed = False  # Названия не сохраняются — и индекс поиска не трогаем
+        self._search_text_changed = changed
+        super().save(*args, **kwargs)
+
+
+class PerevalSearchTrigram(models.Model):
+    # Триграммы названий перевала — индекс для нечёткого поиска на СУБД без pg_trgm
+    pereval = models.ForeignKey(PerevalAdded, on_delete=models.CASCADE, related_name='search_trigrams')
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        verbose_name = "Триграмма названия"
+        verbose_name_plural = "Триграммы названий"
+        constraints = [
+            models.UniqueConstraint(fields=['trigram', 'pereval'], name='pereval_trigram_unique'),
+        ]
+
+
+class ImageBlob(models.Model):
+    # Файл изображения, хранящийся по содержимому: одинаковые байты записываются один раз,
+    # а изображения перевалов ссылаются на него. refcount — число ссылающихся PerevalImage,
+    # файл удаляется вместе с последней ссылкой (см. mountain_pass/blobs.py)
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=100, unique=True, verbose_name='Файл')
+    size = models.PositiveBigIntegerField(verbose_name='Размер, байт')
+    refcount = models.IntegerField(default=0, verbose_name='Число ссылок')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Файл изображения"
+        verbose_name_plural = "Файлы изображений"
+
+    def __str__(self):
+        return self.name
+
 
+class ImageUpload(models.Model):
+    # Возобновляемая загрузка изображения по частям (см. mountain_pass/uploads.py). Пока загрузка идёт,
+    # байты лежат во временном файле в PEREVAL_UPLOAD_DIR, offset — сколько байт от начала уже получено.
+    # После завершения файл переносится в хранилище по содержимому (blob), а изображение в submitData
+    # ссылается на загрузку как upload:<id> и забирает её ссылку на файл себе.
+    CHOICE_STATUS = [
+        ("open", 'загружается'),
+        ("complete", 'загружено'),
+        ("used", 'использовано'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    size = models.PositiveBigIntegerField(verbose_name='Размер, байт')
+    offset = models.PositiveBigIntegerField(default=0, verbose_name='Получено, байт')
+    status = models.CharField(max_length=10, choices=CHOICE_STATUS, default="open")
+    blob = models.ForeignKey(ImageBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='uploads')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Загрузка изображения"
+        verbose_name_plural = "Загрузки изображений"
+
+    def __str__(self):
+        return str(self.id)
+
+
+# Файлы изображений удаляются пакетно в mountain_pass/images.py (discard_file, release_blob), а не django_cleanup
+@cleanup.ignore
 class PerevalImage(models.Model):
+    # Изображение, переданное в теле запроса (base64), сначала сохраняется со статусом "pending",
+    # а декодирование, проверка и запись файла выполняются в фоне (см. mountain_pass/images.py)
+    CHOICE_STATUS = [
+        ("pending", 'ожидает обработки'),
+        ("ready", 'обработано'),
+        ("failed", 'ошибка обработки'),
+    ]
+
     pereval = models.ForeignKey(PerevalAdded, on_delete=models.CASCADE,
                                 related_name='pereval_images', verbose_name='Изображения')
     date_added = models.DateTimeField(auto_now_add=True)
-    data = models.ImageField(upload_to='pereval_images/%Y/%m/%d/')
+    data = models.ImageField(upload_to='pereval_images/%Y/%m/%d/', blank=True)
+    # Файл, загруженный через API, хранится по содержимому; у ссылок на уже существующие файлы — пусто
+    blob = models.ForeignKey(ImageBlob, on_delete=models.PROTECT, null=True, blank=True, editable=False,
+                             related_name='images')
     title = models.CharField(max_length=255, verbose_name='Название изображения')
+    status = models.CharField(max_length=10, choices=CHOICE_STATUS, default="ready",
+                              verbose_name='Статус обработки')
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Изображение"
         verbose_name_plural = "Изображения"
 
     def __str__(self):
-        return self.img_path.name
+        return self.data.name
+
+
+class PerevalImagePayload(models.Model):
+    # Данные (base64) изображения, ожидающего фоновой обработки. Пишутся в той же транзакции, что и изображение
+    # (одним запросом на все изображения запроса), и удаляются после обработки: если процесс перезапустится
+    # раньше, изображение обработает команда process_pending_images (см. mountain_pass/images.py)
+    image = models.OneToOneField(PerevalImage, on_delete=models.CASCADE, primary_key=True, related_name='payload')
+    data = models.TextField()
+
+    class Meta:
+        verbose_name = "Данные необработанного изображения"
+        verbose_name_plural = "Данные необработанных изображений"
+
+
+class PerevalAreasManager(models.Manager):
+    # Дерево районов целиком кешируется в памяти процесса на PEREVAL_AREA_TREE_TTL секунд:
+    # районы меняются редко (вручную), а дерево нужно почти каждому запросу по району.
+    # Кеш сбрасывается при изменении и удалении района (см. signals.py).
+    _tree = None  # (истекает, areas.AreaTree)
+    _lock = threading.Lock()
+
+    @staticmethod
+    def cache_ttl():
+        return getattr(settings, 'PEREVAL_AREA_TREE_TTL', 300)
+
+    def clear_cache(self):
+        with self._lock:
+            PerevalAreasManager._tree = None
+
+    def tree(self):
+        cached = PerevalAreasManager._tree
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        tree = areas.AreaTree(self.get_queryset().values_list('id', 'title', 'id_parent', 'path'))
+        with self._lock:
+            PerevalAreasManager._tree = (time.monotonic() + self.cache_ttl(), tree)
+        return tree
 
 
 class PerevalAreas(models.Model):
     title = models.CharField(max_length=255)
     id_parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True)
+    # Материализованный путь «id предков/id/» (см. mountain_pass/areas.py); поддерживается в save().
+    # TextField: длина пути растёт с глубиной дерева и не ограничивается
+    path = models.TextField(blank=True, default='', db_index=True, editable=False)
+
+    objects = PerevalAreasManager()
 
     class Meta:
         verbose_name = "Район перевала"
@@ -141,6 +542,39 @@ class PerevalAreas(models.Model):
     def __str__(self):
         return self.title
 
+    def parent_path(self):
+        if self.id_parent_id is None:
+            return ''
+        return PerevalAreas.objects.filter(pk=self.id_parent_id).values_list('path', flat=True).get()
+
+    def current_path(self):
+        # Путь, сохранённый в БД (до переноса района)
+        if self.pk is None:
+            return None
+        return PerevalAreas.objects.filter(pk=self.pk).values_list('path', flat=True).first()
+
+    def clean(self):
+        old_path = self.current_path()
+        if old_path and self.id_parent_id is not None and self.parent_path().startswith(old_path):
+            raise ValidationError({'id_parent': 'Район нельзя перенести в него самого или в его подрайон.'})
+
+    def save(self, *args, **kwargs):
+        old_path = self.current_path()
+        parent_path = self.parent_path()
+        if old_path and parent_path.startswith(old_path):
+            raise ValueError('Район нельзя перенести в него самого или в его подрайон.')
+
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            # Id нового района известен только после вставки, поэтому путь записывается отдельным UPDATE
+            self.path = areas.make_path(parent_path, self.pk)
+            if old_path and old_path != self.path:
+                # Перенос: путь меняется у района и у всех подрайонов одним запросом
+                PerevalAreas.objects.filter(path__startswith=old_path).update(path=Concat(
+                    Value(self.path), Substr('path', len(old_path) + 1), output_field=models.TextField()))
+            elif old_path != self.path:
+                PerevalAreas.objects.filter(pk=self.pk).update(path=self.path)
+
 
 class SprActivitiesTypes(models.Model):
     title = models.CharField(max_length=255)
@@ -151,3 +585,111 @@ class SprActivitiesTypes(models.Model):
 
     def __str__(self):
         return self.title
+
+
+
+class PerevalCluster(models.Model):
+    # Агрегат перевалов в ячейке сетки карты (тайлы Web Mercator) для заданного масштаба.
+    # Поддерживается инкрементально при создании, изменении и смене статуса перевалов (см. mountain_pass/clusters.py)
+    zoom = models.PositiveSmallIntegerField()
+    cell_x = models.IntegerField()
+    cell_y = models.IntegerField()
+    count = models.IntegerField(default=0)
+    latitude_sum = models.FloatField(default=0)
+    longitude_sum = models.FloatField(default=0)
+
+    # Число перевалов по категории сложности (максимальной из сезонных)
+    level_none = models.IntegerField(default=0)
+    level_1a = models.IntegerField(default=0)
+    level_1b = models.IntegerField(default=0)
+    level_2a = models.IntegerField(default=0)
+    level_2b = models.IntegerField(default=0)
+    level_3a = models.IntegerField(default=0)
+    level_3b = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Кластер перевалов"
+        verbose_name_plural = "Кластеры перевалов"
+        constraints = [
+            models.UniqueConstraint(fields=['zoom', 'cell_x', 'cell_y'], name='pereval_cluster_cell_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.zoom}/{self.cell_x}/{self.cell_y}: {self.count}'
+
+
+class PerevalClusterMember(models.Model):
+    # Вклад перевала, уже учтённый в PerevalCluster: по нему вычисляется разница при изменении перевала
+    pereval = models.OneToOneField(PerevalAdded, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='cluster_member')
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    difficulty = models.CharField(max_length=2, blank=True, default='')
+
+    class Meta:
+        verbose_name = "Перевал в кластере"
+        verbose_name_plural = "Перевалы в кластерах"
+
+
+class PerevalChange(models.Model):
+    # Журнал изменений перевалов для инкрементальной синхронизации (GET /api/v1/changes?since=<токен>,
+    # см. mountain_pass/changes.py). id — номер вставки, seq — номер события в ленте: он присваивается уже
+    # после фиксации транзакции события, поэтому события становятся видны в порядке seq.
+    # Перевал хранится без внешнего ключа, чтобы событие удаления пережило сам перевал.
+    CHOICE_KIND = [
+        ("created", 'создан'),
+        ("updated", 'изменён'),
+        ("status", 'изменён статус модерации'),
+        ("deleted", 'удалён'),
+        ("image_deleted", 'удалено изображение'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    pereval_id = models.BigIntegerField()
+    user_id = models.BigIntegerField(null=True)
+    kind = models.CharField(max_length=20, choices=CHOICE_KIND)
+    status = models.CharField(max_length=30, blank=True, default='')  # Статус перевала после события
+    image_id = models.BigIntegerField(null=True, blank=True)
+    seq = models.BigIntegerField(null=True, blank=True, unique=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Изменение перевала"
+        verbose_name_plural = "Изменения перевалов"
+        indexes = [
+            # Изменения перевалов одного пользователя после заданного номера
+            models.Index(fields=['user_id', 'seq'], name='pereval_change_user_seq_idx'),
+            # События, которым ещё не присвоен номер
+            models.Index(fields=['id'], condition=Q(seq__isnull=True), name='pereval_change_unsequenced_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.seq or "-"}: {self.kind} {self.pereval_id}'
+
+
+class PerevalChangeSequence(models.Model):
+    # Последний присвоенный номер события журнала (одна строка). Блокировка этой строки не даёт двум
+    # процессам присваивать номера одновременно (см. changes.assign_numbers)
+    last_seq = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Номер журнала изменений"
+        verbose_name_plural = "Номер журнала изменений"
+
+
+class IdempotencyKey(models.Model):
+    # Результат запроса submitData с заголовком Idempotency-Key (см. mountain_pass/idempotency.py):
+    # повтор запроса с тем же ключом получает сохранённый ответ, а не создаёт перевал ещё раз
+    key = models.CharField(max_length=255, unique=True)
+    fingerprint = models.CharField(max_length=64)  # SHA-256 адреса и данных запроса
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,91 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import PerevalAdded
+from .signals import perevals_changed
+
+# Очередь модерации. Модератор забирает пачку записей со статусом new (claim): они переходят в pending
+# и закрепляются за ним, после чего он принимает или отклоняет их (decide) либо возвращает в очередь (release).
+# Выборка из очереди идёт по частичному индексу (status = 'new'), изменения — одним UPDATE на пачку.
+
+# Ограничение размера пачки за один запрос
+MAX_CLAIM = 100
+
+# Сколько раз повторить выборку, если записи перехватили другие модераторы (без SKIP LOCKED)
+CLAIM_ATTEMPTS = 3
+
+DECISIONS = ('accepted', 'rejected')
+
+
+def queue():
+    return PerevalAdded.objects.filter(status='new').order_by('add_time', 'id')
+
+
+def claim(moderator, limit):
+    limit = max(1, min(limit, MAX_CLAIM))
+    if connection.features.has_select_for_update_skip_locked:
+        ids = _claim_skip_locked(moderator, limit)
+    else:
+        ids = _claim_optimistic(moderator, limit)
+    # Сигнал — после фиксации захвата: обработчики (кластеры, кеш ответов) не удлиняют блокировку строк очереди
+    if ids:
+        perevals_changed.send(sender=PerevalAdded, pereval_ids=ids, kind='status')
+    return ids
+
+
+def _claim_skip_locked(moderator, limit):
+    # PostgreSQL: строки, которые сейчас забирает другой модератор, пропускаются без ожидания,
+    # поэтому параллельные модераторы получают разные записи и не блокируют друг друга
+    with transaction.atomic():
+        ids = list(queue().select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+        now = timezone.now()
+        PerevalAdded.objects.filter(id__in=ids).update(status='pending', moderator=moderator, claimed_at=now,
+                                                       updated_at=now)
+    return ids
+
+
+def _claim_optimistic(moderator, limit):
+    # Без SKIP LOCKED (SQLite и др.): UPDATE с условием status = 'new' забирает только ещё свободные записи,
+    # а захваченные этим вызовом узнаются по отметке времени захвата
+    ids = []
+    for _ in range(CLAIM_ATTEMPTS):
+        candidates = list(queue().values_list('id', flat=True)[:limit - len(ids)])
+        if not candidates:
+            break
+        claimed_at = timezone.now()
+        with transaction.atomic():
+            PerevalAdded.objects.filter(id__in=candidates, status='new').update(
+                status='pending', moderator=moderator, claimed_at=claimed_at, updated_at=claimed_at)
+            ids += PerevalAdded.objects.filter(id__in=candidates, status='pending', moderator=moderator,
+                                               claimed_at=claimed_at).values_list('id', flat=True)
+        if len(ids) >= limit:
+            break
+    return ids
+
+
+def _transition(moderator, ids, values):
+    # Меняются только записи, закреплённые за этим модератором; возвращает id изменённых
+    with transaction.atomic():
+        queryset = PerevalAdded.objects.filter(id__in=ids, status='pending', moderator=moderator)
+        changed = list(queryset.select_for_update().values_list('id', flat=True))
+        PerevalAdded.objects.filter(id__in=changed).update(**values, updated_at=timezone.now())
+    if changed:
+        perevals_changed.send(sender=PerevalAdded, pereval_ids=changed, kind='status')
+    return changed
+
+
+def decide(moderator, ids, status):
+    if status not in DECISIONS:
+        raise ValueError(f'Недопустимое решение: {status}')
+    return _transition(moderator, ids, {'status': status})
+
+
+def release(moderator, ids=None):
+    # Возврат записей в очередь; без ids — всех записей модератора
+    if ids is None:
+        ids = PerevalAdded.objects.filter(status='pending', moderator=moderator).values_list('id', flat=True)
+    return _transition(moderator, list(ids), {'status': 'new', 'moderator': None, 'claimed_at': None})
+
+
+def claimed(moderator):
+    return PerevalAdded.objects.with_related().filter(status='pending', moderator=moderator).order_by('claimed_at', 'id')
@@ -0,0 +1,74 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+
+
+# Keyset-пагинация по (add_time, id): следующая страница выбирается условием
+# "(add_time, id) > (курсор)", а не OFFSET, поэтому её стоимость не растёт с номером страницы.
+class KeysetPagination(BasePagination):
+    ordering = ('add_time', 'id')
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    default_limit = 100
+    max_limit = 1000
+
+    def __init__(self):
+        self.next_cursor = None
+
+    @staticmethod
+    def encode_cursor(pereval):
+        position = json.dumps([pereval.add_time.isoformat(), pereval.id])
+        return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            add_time, pereval_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            add_time = parse_datetime(add_time)
+            if add_time is None or not isinstance(pereval_id, int):
+                raise ValueError
+        except (ValueError, TypeError):
+            raise ValidationError({'cursor': 'Некорректный курсор.'})
+        return add_time, pereval_id
+
+    def get_limit(self, request):
+        return self.parse_limit(request.query_params)
+
+    def parse_limit(self, params):
+        try:
+            limit = int(params.get(self.limit_query_param, self.default_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается целое число.'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Значение должно быть больше нуля.'})
+        return min(limit, self.max_limit)
+
+    def page_queryset(self, queryset, params):
+        # Запрос страницы (ещё не выполненный). Берём на одну запись больше, чтобы понять, есть ли следующая
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            add_time, pereval_id = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(add_time__gt=add_time) | Q(add_time=add_time, id__gt=pereval_id))
+
+        self.limit = self.parse_limit(params)
+        return queryset[:self.limit + 1]
+
+    def close_page(self, rows):
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            self.next_cursor = self.encode_cursor(rows[-1])
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.close_page(list(self.page_queryset(queryset, request.query_params)))
+
+    async def apaginate_queryset(self, queryset, params):
+        # Для асинхронных представлений (mountain_pass/async_views.py)
+        return self.close_page([row async for row in self.page_queryset(queryset, params)])
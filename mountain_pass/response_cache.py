@@ -0,0 +1,139 @@
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+# Кеш сериализованных ответов GET /submitData/<id> и GET /submitData/?user__email=<email>.
+# Хранилище — кеш Django (CACHES[PEREVAL_CACHE_ALIAS]): память процесса, файлы или Redis.
+# Ответ по перевалу хранится под ключом с его id; ответы списка пользователя — под ключом с «версией»
+# email пользователя, которая меняется при любом изменении его перевалов (старые записи просто истекают).
+# Сброс выполняется обработчиками сигналов моделей (см. signals.py).
+
+
+def get_cache():
+    return caches[getattr(settings, 'PEREVAL_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'PEREVAL_RESPONSE_CACHE_TIMEOUT', 3600)
+
+
+def detail_key(pereval_id):
+    return f'pereval:detail:{pereval_id}'
+
+
+def _digest(value):
+    return hashlib.sha1(value.encode()).hexdigest()
+
+
+def email_version_key(email):
+    # email хешируется: в ключах memcached/Redis нежелательны произвольные символы
+    return f'pereval:email:{_digest(email)}:version'
+
+
+def _list_key(email, version, params):
+    return f'pereval:email:{_digest(email)}:{version}:{_digest(json.dumps(sorted(params.items())))}'
+
+
+def list_key(email, params):
+    # Версия создаётся при первом обращении; add() не перезапишет версию,
+    # одновременно созданную другим запросом
+    cache = get_cache()
+    version_key = email_version_key(email)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, None)
+        version = cache.get(version_key)
+    return _list_key(email, version, params)
+
+
+async def alist_key(email, params):
+    cache = get_cache()
+    version_key = email_version_key(email)
+    version = await cache.aget(version_key)
+    if version is None:
+        await cache.aadd(version_key, uuid.uuid4().hex, None)
+        version = await cache.aget(version_key)
+    return _list_key(email, version, params)
+
+
+def make_etag(payload):
+    content = json.dumps(payload, cls=JSONEncoder, ensure_ascii=False, sort_keys=True)
+    return '"' + _digest(content) + '"'
+
+
+def get(key):
+    # Возвращает (etag, payload) или None
+    if not get_timeout():
+        return None
+    return get_cache().get(key)
+
+
+async def aget(key):
+    if not get_timeout():
+        return None
+    return await get_cache().aget(key)
+
+
+def store(key, payload):
+    etag = make_etag(payload)
+    if get_timeout():
+        get_cache().set(key, (etag, payload), get_timeout())
+    return etag
+
+
+async def astore(key, payload):
+    etag = make_etag(payload)
+    if get_timeout():
+        await get_cache().aset(key, (etag, payload), get_timeout())
+    return etag
+
+
+def not_modified(request, etag):
+    # Клиент прислал ETag текущей версии ответа — тело можно не отправлять
+    if_none_match = request.headers.get('If-None-Match', '')
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return etag in tags or '*' in tags
+
+
+def add_etag(response, etag):
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'  # Клиент может хранить ответ, но перед использованием проверяет ETag
+    return response
+
+
+def respond(request, payload, etag):
+    if not_modified(request, etag):
+        return add_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+    return add_etag(Response(payload, status=status.HTTP_200_OK), etag)
+
+
+def invalidate(pereval_ids=(), emails=()):
+    keys = [detail_key(pereval_id) for pereval_id in pereval_ids]
+    keys += [email_version_key(email) for email in set(emails)]
+    if not keys:
+        return
+
+    def delete_keys():
+        get_cache().delete_many(keys)
+
+    # Сразу — чтобы этот же запрос и поток не увидели старый ответ; после фиксации — чтобы ответ,
+    # закешированный параллельным запросом по ещё не изменённым данным, тоже был сброшен
+    delete_keys()
+    transaction.on_commit(delete_keys)
+
+
+def invalidate_perevals(pereval_ids):
+    from .models import PerevalAdded
+
+    pereval_ids = list(pereval_ids)
+    if not pereval_ids:
+        return
+    emails = PerevalAdded.objects.filter(id__in=pereval_ids).values_list('user__email', flat=True)
+    invalidate(pereval_ids, emails)
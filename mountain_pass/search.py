@@ -0,0 +1,129 @@
+import re
+
+from django.db import connection
+from django.db.models import Count
+
+# Поиск перевалов по названию с учётом опечаток и транслитерации.
+# Названия приводятся к общему виду (нижний регистр, отброшенные окончания, латиница) и хранятся
+# в PerevalAdded.search_text. На PostgreSQL поиск идёт через pg_trgm (GIN-индекс), на остальных СУБД —
+# через таблицу триграмм PerevalSearchTrigram, ранжирование при этом считается на Python.
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+
+# Окончания прилагательных и существительных: "Дятлова", "Дятлову" и "Дятлов" дают одну основу.
+# Отсортированы по убыванию длины, чтобы сначала отбрасывалось самое длинное подходящее.
+ENDINGS = sorted([
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее', 'ой', 'ей', 'ий', 'ый',
+    'ую', 'юю', 'ых', 'их', 'ым', 'им', 'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем',
+    'а', 'я', 'ы', 'и', 'у', 'ю', 'е', 'о',
+], key=len, reverse=True)
+MIN_STEM_LENGTH = 4
+
+WORD_RE = re.compile(r'\w+')
+
+# Минимальная похожесть (0..1), при которой перевал попадает в результаты
+SIMILARITY_THRESHOLD = 0.3
+# Сколько кандидатов из таблицы триграмм ранжируется на Python
+CANDIDATES_LIMIT = 500
+
+
+def stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def normalize(*texts):
+    words = []
+    for text in texts:
+        for word in WORD_RE.findall((text or '').lower()):
+            words.append(''.join(TRANSLIT.get(char, char) for char in stem(word)))
+    return ' '.join(words)
+
+
+def trigrams(text):
+    # Как в pg_trgm: каждое слово дополняется двумя пробелами в начале и одним в конце
+    result = set()
+    for word in text.split():
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def word_similarity(query, text):
+    # Похожесть запроса на лучшее совпадающее слово или последовательность слов текста
+    query_trigrams = trigrams(query)
+    if not query_trigrams:
+        return 0.0
+    words = text.split()
+    best = 0.0
+    for start in range(len(words)):
+        for end in range(start + 1, min(start + len(query.split()) + 1, len(words)) + 1):
+            fragment = trigrams(' '.join(words[start:end]))
+            best = max(best, len(query_trigrams & fragment) / len(query_trigrams | fragment))
+    return best
+
+
+def uses_pg_trgm():
+    return connection.vendor == 'postgresql'
+
+
+def index_trigrams(perevals, created=False):
+    # Индексация перевалов в таблице триграмм (используется только без pg_trgm).
+    # search_text берётся из переданных объектов; у только что созданных перевалов старых строк нет.
+    from .models import PerevalSearchTrigram
+
+    perevals = list(perevals)
+    if uses_pg_trgm() or not perevals:
+        return
+    if not created:
+        PerevalSearchTrigram.objects.filter(pereval_id__in=[pereval.id for pereval in perevals]).delete()
+    PerevalSearchTrigram.objects.bulk_create([
+        PerevalSearchTrigram(pereval_id=pereval.id, trigram=trigram)
+        for pereval in perevals
+        for trigram in trigrams(pereval.search_text)
+    ], batch_size=2000)
+
+
+def rebuild_trigrams(pereval_ids, created=False):
+    # То же по списку id (пакетные изменения, когда объектов под рукой нет)
+    from .models import PerevalAdded
+
+    pereval_ids = list(pereval_ids)
+    if uses_pg_trgm() or not pereval_ids:
+        return
+    index_trigrams(PerevalAdded.objects.filter(id__in=pereval_ids).only('id', 'search_text'), created=created)
+
+
+def search(query, limit=20):
+    # Возвращает список (перевал, похожесть), отсортированный по убыванию похожести
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    from .models import PerevalAdded, PerevalSearchTrigram
+
+    normalized = normalize(query)
+    if not normalized:
+        return []
+
+    queryset = PerevalAdded.objects.select_related('coords', 'level')
+    if uses_pg_trgm():
+        perevals = queryset.filter(search_text__trigram_word_similar=normalized).annotate(
+            similarity=TrigramWordSimilarity(normalized, 'search_text')).order_by('-similarity', 'id')[:limit]
+        return [(pereval, pereval.similarity) for pereval in perevals]
+
+    # Кандидаты — перевалы с наибольшим числом общих с запросом триграмм (по индексу на trigram)
+    candidates = PerevalSearchTrigram.objects.filter(trigram__in=trigrams(normalized)) \
+        .values('pereval_id').annotate(hits=Count('id')).order_by('-hits')[:CANDIDATES_LIMIT]
+    ranked = []
+    for pereval in queryset.filter(id__in=[candidate['pereval_id'] for candidate in candidates]):
+        similarity = word_similarity(normalized, pereval.search_text)
+        if similarity >= SIMILARITY_THRESHOLD:
+            ranked.append((pereval, similarity))
+    ranked.sort(key=lambda item: (-item[1], item[0].id))
+    return ranked[:limit]
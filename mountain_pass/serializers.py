@@ -1,11 +1,25 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import User, Coords, Level, PerevalAdded, PerevalImage
+from . import changes, images, thumbnails, uploads
+from .instrumentation import TimedSerializerMixin
+from .signals import perevals_changed
+from .models import User, Coords, ImageUpload, Level, PerevalAdded, PerevalImage
+
+
+class PerevalNotEditable(Exception):
+    # Статус перевала сменился (например, модератор взял запись в работу) после проверки во view
+    pass
 
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['email', 'fam', 'name', 'otc', 'phone']
+        # Существующий email обрабатывается в to_internal_value, поэтому повторная проверка
+        # уникальности (лишний запрос к БД) не нужна
+        extra_kwargs = {'email': {'validators': []}}
 
     def to_internal_value(self, data):
         # Проверяем, существует ли пользователь с данным email
@@ -13,20 +27,27 @@ class UserSerializer(serializers.ModelSerializer):
         if not email:
             raise serializers.ValidationError({"email": "Это поле обязательно."})
 
-        # Пытаемся найти пользователя с этим email
-        try:
-            user = User.objects.get(email=email)
-        except User.DoesNotExist:
+        # Пытаемся найти пользователя с этим email (кеш или один запрос).
+        # При пакетной отправке пользователи загружены заранее одним запросом (context['known_users'])
+        known_users = self.context.get('known_users')
+        if known_users is not None:
+            user = known_users.get(email)
+        else:
+            user = User.objects.resolve(email)
+
+        if user is None:
             # Если пользователь не найден, возвращаем данные для создания нового
             return super().to_internal_value(data)
 
-        # Если пользователь найден, возвращаем его
+        # Если пользователь найден, возвращаем его; найденный экземпляр ('instance') используется
+        # при создании перевала, повторно пользователь в БД не ищется
         return {
             'email': user.email,
             'fam': user.fam,
             'name': user.name,
             'otc': user.otc,
             'phone': user.phone,
+            'instance': user,
         }
 
 
@@ -40,23 +61,128 @@ class LevelSerializer(serializers.ModelSerializer):
     class Meta:
         model = Level
         fields = ['winter', 'summer', 'autumn', 'spring']
+        # null допускается для совместимости с клиентами и сохраняется как ''
+        extra_kwargs = {season: {'allow_null': True} for season in Level.SEASONS}
+        # Уникальность комбинации обеспечивает Level.objects.intern, а не проверка при валидации
+        validators = []
+
+
+def consume_uploads(images_data):
+    # Изображения из загрузок (upload:<id>, найдены при валидации) забирают их ссылки на файлы
+    try:
+        uploads.consume([image_data['upload'] for image_data in images_data if 'upload' in image_data])
+    except uploads.UploadError as exc:
+        raise serializers.ValidationError({'images': str(exc)})
 
 
 class PerevalImageSerializer(serializers.ModelSerializer):
+    # id передаётся при редактировании существующего изображения в PATCH
+    id = serializers.IntegerField(required=False)
     data = serializers.CharField(write_only=True)
 
     class Meta:
         model = PerevalImage
-        fields = ['id', 'data', 'title']        # Добавьте поле id для удаления
+        fields = ['id', 'data', 'title', 'status']        # Добавьте поле id для удаления
+        read_only_fields = ['status']
+
+    def validate_data(self, value):
+        # upload:<id> — файл, загруженный по частям (api/v1/uploads); наличие загрузки проверяет PerevalAddedSerializer
+        if uploads.is_reference(value):
+            try:
+                uploads.parse_reference(value)
+            except ValueError:
+                raise serializers.ValidationError('Некорректный id загрузки.')
+            return value
+        # Размер base64 проверяем сразу (дёшево), содержимое — уже в фоновой обработке
+        max_bytes = getattr(settings, 'PEREVAL_IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+        if images.is_inline_payload(value) and len(value) * 3 // 4 > max_bytes:
+            raise serializers.ValidationError(f'Изображение больше {max_bytes} байт.')
+        return value
 
     def to_representation(self, img_data):
         # Здесь мы определяем, как будет выглядеть объект при сериализации
         representation = super().to_representation(img_data)
-        representation['data'] = img_data.data.url  # Получаем URL для изображения
+        # Получаем URL для изображения (пока изображение обрабатывается, файла ещё нет)
+        representation['data'] = img_data.data.url if img_data.data else None
+        # Уменьшенные копии (128/512/1600 px, WebP) для списков и карт
+        representation['thumbnails'] = thumbnails.variant_urls(img_data)
         return representation
 
-
-class PerevalAddedSerializer(serializers.ModelSerializer):
+    def update(self, image, validated_data):
+        validated_data.pop('id', None)
+        data = validated_data.pop('data', None)
+        upload = validated_data.pop('upload', None)
+        payload = images.assign_data(image, data, upload) if data is not None else None
+        image = super().update(image, validated_data)
+        if payload is not None:
+            images.schedule([(image, payload)])
+        return image
+
+
+class PerevalAddedListSerializer(serializers.ListSerializer):
+    # Пакетное создание перевалов (api/v1/submitData/bulk).
+    # Пользователи, координаты, уровни, перевалы и изображения записываются через bulk_create,
+    # поэтому число запросов к БД не зависит от размера пакета.
+    def create(self, validated_data):
+        with transaction.atomic():
+            # Пользователи: найденные при валидации берутся как есть, для новых — один INSERT
+            # (дубликаты по email убираются)
+            users_data = {item['user']['email']: item['user'] for item in validated_data}
+            users = {email: user_data['instance'] for email, user_data in users_data.items()
+                     if user_data.get('instance') is not None}
+            new_users = [
+                User(
+                    email=email,
+                    fam=user_data['fam'],
+                    name=user_data['name'],
+                    otc=user_data.get('otc'),
+                    phone=user_data.get('phone'),
+                )
+                for email, user_data in users_data.items() if email not in users
+            ]
+            if new_users:
+                # ignore_conflicts защищает от гонки с параллельной отправкой того же email,
+                # поэтому id новых пользователей перечитываем отдельным запросом
+                User.objects.bulk_create(new_users, ignore_conflicts=True)
+                users.update({
+                    user.email: user
+                    for user in User.objects.filter(email__in=[user.email for user in new_users])
+                })
+
+            coords_list = [Coords(**item['coords']) for item in validated_data]
+            for coords in coords_list:
+                coords.update_geohash()
+            coords_list = Coords.objects.bulk_create(coords_list)
+            levels = Level.objects.intern_many([item['level'] for item in validated_data])
+
+            perevals = []
+            for item, coords, level in zip(validated_data, coords_list, levels):
+                pereval_data = {
+                    key: value for key, value in item.items()
+                    if key not in ('user', 'coords', 'level', 'images', 'images_to_delete')
+                }
+                pereval = PerevalAdded(user=users[item['user']['email']], coords=coords, level=level, **pereval_data)
+                pereval.update_search_text()
+                perevals.append(pereval)
+            perevals = PerevalAdded.objects.bulk_create(perevals)
+
+            consume_uploads(image_data for item in validated_data for image_data in item['images'])
+            built_images = [
+                images.build_image(pereval, image_data)
+                for item, pereval in zip(validated_data, perevals)
+                for image_data in item['images']
+            ]
+            PerevalImage.objects.bulk_create([image for image, _ in built_images])
+            # base64-изображения декодируются и записываются в фоне после фиксации транзакции
+            images.schedule([(image, payload) for image, payload in built_images if payload is not None])
+
+            # bulk_create не отправляет post_save — сообщаем о новых перевалах явно
+            perevals_changed.send(sender=PerevalAdded, pereval_ids=[pereval.id for pereval in perevals], created=True)
+
+        return perevals
+
+
+class PerevalAddedSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer()
     coords = CoordsSerializer()
     level = LevelSerializer()
@@ -66,6 +192,7 @@ class PerevalAddedSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = PerevalAdded
+        list_serializer_class = PerevalAddedListSerializer
         # fields = '__all__'
         fields = [
             'beauty_title',
@@ -94,74 +221,137 @@ class PerevalAddedSerializer(serializers.ModelSerializer):
     #
     #     return data
 
+    def validate_images(self, value):
+        # Изображения upload:<id> должны ссылаться на завершённые и ещё не использованные загрузки.
+        # Загрузки ищутся одним запросом; views заранее загружают их в context['known_uploads'],
+        # тогда проверка к БД не обращается.
+        references = [(image_data, uploads.parse_reference(image_data['data'])) for image_data in value
+                      if uploads.is_reference(image_data.get('data'))]
+        if not references:
+            return value
+        ids = [upload_id for _, upload_id in references]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError('Одна загрузка может быть использована только в одном изображении.')
+        known = self.context.get('known_uploads')
+        found = known if known is not None else uploads.completed(ids)
+        missing = [str(upload_id) for upload_id in ids if upload_id not in found]
+        if missing:
+            raise serializers.ValidationError(f'Загрузки {", ".join(missing)} не найдены или не завершены.')
+        for image_data, upload_id in references:
+            image_data['upload'] = found[upload_id]
+        return value
+
     def create(self, validated_data):
         user_data = validated_data.pop('user')
         coords_data = validated_data.pop('coords')
         level_data = validated_data.pop('level')
         images_data = validated_data.pop('images')
 
-        # Добавляем пользователя, если его нет
-        user, created = User.objects.get_or_create(
-            email=user_data['email'],
-            defaults={
-                'fam': user_data['fam'],
-                'name': user_data['name'],
-                'otc': user_data.get('otc'),
-                'phone': user_data.get('phone'),
-            }
-        )
+        # Одна транзакция: изображения из загрузок забирают ссылки на файлы только вместе с созданием перевала
+        with transaction.atomic():
+            # Добавляем пользователя, если его нет (найденный при валидации используется как есть)
+            user = User.objects.get_or_create_from(user_data, user_data.get('instance'))
 
-        # Добавляем координаты
-        coords = Coords.objects.create(**coords_data)
+            # Добавляем координаты
+            coords = Coords.objects.create(**coords_data)
 
-        # Добавляем уровни сложности
-        level = Level.objects.create(**level_data)
+            # Уровень сложности берём из справочника (новая строка создаётся только для новой комбинации)
+            level = Level.objects.intern(**level_data)
 
-         # Добавление записи Перевала
-        pereval_added = PerevalAdded.objects.create(user=user, coords=coords, level=level, **validated_data)
+            # Добавление записи Перевала
+            pereval_added = PerevalAdded.objects.create(user=user, coords=coords, level=level, **validated_data)
 
-        # Обработка изображений
-        for image_data in images_data:
-            PerevalImage.objects.create(pereval=pereval_added, data=image_data['data'], title=image_data['title'])
+            # Обработка изображений: base64 декодируется и записывается в фоне после фиксации транзакции
+            consume_uploads(images_data)
+            pending = []
+            for image_data in images_data:
+                image, payload = images.build_image(pereval_added, image_data)
+                image.save()
+                if payload is not None:
+                    pending.append((image, payload))
+            images.schedule(pending)
 
         return pereval_added
 
     def update(self, pereval, validated_data):
         coords_data = validated_data.pop('coords', None)
         level_data = validated_data.pop('level', None)
-        images_data = validated_data.pop('images', None)
-
-        pereval.beauty_title = validated_data.get('beauty_title', pereval.beauty_title)
-        pereval.title = validated_data.get('title', pereval.title)
-        pereval.other_titles = validated_data.get('other_titles', pereval.other_titles)
-        pereval.connect = validated_data.get('connect', pereval.connect)
-
-        CoordsSerializer().update(pereval.coords, coords_data)
-        LevelSerializer().update(pereval.level, level_data)
+        images_data = validated_data.pop('images', None) or []
+        images_to_delete = set(validated_data.pop('images_to_delete', []))
+
+        # Всё редактирование — одна транзакция; файлы удалённых и заменённых изображений
+        # удаляются одним обработчиком после её фиксации, события журнала изменений пишутся одной вставкой
+        with transaction.atomic(), images.batched_file_cleanup(), changes.batched():
+            # Статус проверяем ещё раз под блокировкой строки: до конца транзакции модератор её не захватит
+            locked_status = PerevalAdded.objects.select_for_update().filter(id=pereval.id) \
+                .values_list('status', flat=True).first()
+            if locked_status != 'new':
+                raise PerevalNotEditable()
+
+            pereval.beauty_title = validated_data.get('beauty_title', pereval.beauty_title)
+            pereval.title = validated_data.get('title', pereval.title)
+            pereval.other_titles = validated_data.get('other_titles', pereval.other_titles)
+            pereval.connect = validated_data.get('connect', pereval.connect)
+
+            if coords_data is not None:
+                CoordsSerializer().update(pereval.coords, coords_data)
+            # Строка Level общая для многих перевалов: не изменяем её, а назначаем перевалу другую
+            if level_data is not None:
+                current_level = {season: getattr(pereval.level, season) for season in Level.SEASONS} \
+                    if pereval.level else {}
+                pereval.level = Level.objects.intern(**{**current_level, **level_data})
+
+            self.update_images(pereval, images_data, images_to_delete)
+
+            # Сохраняем только редактируемые поля: статус и модератор остаются такими, как в БД
+            pereval.save(update_fields=['beauty_title', 'title', 'other_titles', 'connect', 'level', 'updated_at'])
+        return pereval
 
+    def update_images(self, pereval, images_data, images_to_delete):
+        # Изменения изображений выполняются над множествами: один запрос на выборку изменяемых
+        # (только изображения этого перевала), один bulk_update, один bulk_create и одно удаление
+        referenced_ids = {image_data['id'] for image_data in images_data if image_data.get('id')}
+        existing = pereval.pereval_images.in_bulk(referenced_ids - images_to_delete) if referenced_ids else {}
+        foreign_ids = referenced_ids - images_to_delete - existing.keys()
+        if foreign_ids:
+            raise serializers.ValidationError(
+                {'images': f'Изображения {sorted(foreign_ids)} не найдены у этого перевала.'})
+
+        consume_uploads(image_data for image_data in images_data if image_data.get('id') not in images_to_delete)
+        changed, created, payloads = [], [], []
         for image_data in images_data:
-            image_id = image_data.get('id', None)
+            image_id = image_data.get('id')
+            if image_id in images_to_delete:
+                continue
             if image_id:
-                image_pereval = PerevalImage.objects.get(id=image_id)
-                PerevalImageSerializer().update(image_pereval, image_data)
+                image = existing[image_id]
+                image.title = image_data.get('title', image.title)
+                payload = images.assign_data(image, image_data['data'], image_data.get('upload')) \
+                    if 'data' in image_data else None
+                changed.append(image)
             else:
-                PerevalImage.objects.create(pereval=pereval, **image_data)
-
-        # Удаление изображений, если указаны идентификаторы
-        images_to_delete = validated_data.pop('images_to_delete', [])
+                if 'data' not in image_data or 'title' not in image_data:
+                    raise serializers.ValidationError({'images': 'Для нового изображения нужны поля data и title.'})
+                image, payload = images.build_image(pereval, image_data)
+                created.append(image)
+            if payload is not None:
+                payloads.append((image, payload))
+
+        if changed:
+            now = timezone.now()
+            for image in changed:
+                image.updated_at = now  # bulk_update не заполняет auto_now
+            PerevalImage.objects.bulk_update(changed, ['title', 'data', 'blob', 'status', 'updated_at'])
+        if created:
+            PerevalImage.objects.bulk_create(created)
+        images.schedule(payloads)
+
+        # Удаляем только изображения этого перевала; чужие и несуществующие id игнорируются
         if images_to_delete:
-            for image_id in images_to_delete:
-                try:
-                    image = PerevalImage.objects.get(id=image_id)
-                    image.delete()
-                except PerevalImage.DoesNotExist:
-                    continue  # Игнорируем, если изображение не найдено
-
-        pereval.save()  # Сохраняем изменения в PerevalAdded
-        return pereval
+            pereval.pereval_images.filter(id__in=images_to_delete).delete()
 
 
-class PerevalDetailSerializer(serializers.ModelSerializer):
+class PerevalDetailSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer()
     coords = CoordsSerializer()
     level = LevelSerializer()
@@ -182,3 +372,37 @@ class PerevalDetailSerializer(serializers.ModelSerializer):
             'images',
             'status'  # Также добавим статус модерации
         ]
+
+
+class PerevalModerationSerializer(PerevalDetailSerializer):
+    # Запись в очереди модерации: с id и временем, когда модератор взял её в работу
+    class Meta(PerevalDetailSerializer.Meta):
+        fields = ['id', *PerevalDetailSerializer.Meta.fields, 'claimed_at']
+
+
+class PerevalChangeSerializer(PerevalDetailSerializer):
+    # Перевал в ленте изменений: с id и временем последнего изменения
+    class Meta(PerevalDetailSerializer.Meta):
+        fields = ['id', *PerevalDetailSerializer.Meta.fields, 'updated_at']
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    # reference — значение поля data изображения в submitData после завершения загрузки
+    reference = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImageUpload
+        fields = ['id', 'size', 'offset', 'status', 'expires_at', 'reference']
+
+    def get_reference(self, upload):
+        return uploads.reference(upload) if upload.status == 'complete' else None
+
+
+class PerevalMapSerializer(serializers.ModelSerializer):
+    # Облегчённое представление перевала для карты: без пользователя и изображений
+    coords = CoordsSerializer()
+    level = LevelSerializer()
+
+    class Meta:
+        model = PerevalAdded
+        fields = ['id', 'title', 'beauty_title', 'status', 'coords', 'level']
@@ -0,0 +1,177 @@
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from . import changes, clusters, db_metrics, images, instrumentation, response_cache, search
+from .models import Coords, Level, PerevalAdded, PerevalAreas, PerevalImage, User
+
+# Отправляется при пакетных изменениях перевалов, которые обходят post_save (bulk_create, QuerySet.update).
+# Аргументы: pereval_ids — id созданных или изменённых перевалов, created — перевалы только что созданы,
+# kind — вид события для журнала изменений (updated или status, по умолчанию updated).
+perevals_changed = Signal()
+
+
+@receiver(post_delete, sender=PerevalImage)
+def delete_image_files(sender, instance, **kwargs):
+    # PerevalImage исключён из django_cleanup: оригинал и уменьшенные копии удаляем сами,
+    # после фиксации транзакции и (внутри images.batched_file_cleanup) одним обработчиком на всю операцию.
+    # Общий файл (ImageBlob) удаляется только вместе с последней ссылкой на него.
+    images.release_file(instance)
+
+
+# Поддержка агрегатов для обзорной карты (mountain_pass/clusters.py): пересчёт — после фиксации транзакции
+@receiver(post_save, sender=PerevalAdded)
+def refresh_clusters_on_pereval_save(sender, instance, raw=False, **kwargs):
+    # Правка описания, фото или контактов на карту не влияет
+    if not raw and clusters.map_fields_changed(instance):
+        clusters.schedule([instance.id])
+
+
+@receiver(pre_delete, sender=PerevalAdded)
+def refresh_clusters_on_pereval_delete(sender, instance, **kwargs):
+    clusters.forget([instance.id])
+
+
+@receiver(post_save, sender=Coords)
+@receiver(post_save, sender=Level)
+def refresh_clusters_on_related_save(sender, instance, created=False, raw=False, **kwargs):
+    # Новые координаты и уровни ещё не привязаны к перевалу, учитывать нечего
+    if created or raw:
+        return
+    if sender is Coords:
+        pereval_ids = PerevalAdded.objects.filter(coords=instance).values_list('id', flat=True)
+    else:
+        pereval_ids = PerevalAdded.objects.filter(level=instance).values_list('id', flat=True)
+    clusters.schedule(pereval_ids)
+
+
+@receiver(post_save, sender=Level)
+@receiver(post_delete, sender=Level)
+def clear_level_cache(sender, **kwargs):
+    # Строки справочника меняются только вручную (например, в админке) — просто сбрасываем кеш
+    Level.objects.clear_cache()
+
+
+@receiver(post_save, sender=PerevalAreas)
+@receiver(post_delete, sender=PerevalAreas)
+def clear_area_tree_cache(sender, **kwargs):
+    # Сразу и после фиксации: дерево, загруженное параллельным запросом до фиксации, тоже устареет
+    PerevalAreas.objects.clear_cache()
+    transaction.on_commit(PerevalAreas.objects.clear_cache)
+
+
+@receiver(perevals_changed)
+def refresh_clusters_on_batch_change(sender, pereval_ids, **kwargs):
+    clusters.schedule(pereval_ids)
+
+
+# Таблица триграмм для нечёткого поиска по названию (на СУБД без pg_trgm)
+@receiver(post_save, sender=PerevalAdded)
+def reindex_search_on_pereval_save(sender, instance, created=False, raw=False, **kwargs):
+    # Только если нормализованные названия изменились (см. PerevalAdded.save); правка статуса, описания
+    # или контактов индекс не трогает
+    if not raw and getattr(instance, '_search_text_changed', True):
+        search.index_trigrams([instance], created=created)
+
+
+@receiver(perevals_changed)
+def reindex_search_on_batch_change(sender, pereval_ids, created=False, **kwargs):
+    # Пакетные правки (QuerySet.update, bulk_update) названий не меняют — индексируем только новые перевалы
+    if created:
+        search.rebuild_trigrams(pereval_ids, created=True)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    User.objects.forget(instance)
+
+
+# Сброс кеша ответов API (mountain_pass/response_cache.py)
+@receiver(post_save, sender=PerevalAdded)
+@receiver(post_delete, sender=PerevalAdded)
+def invalidate_responses_on_pereval_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # После удаления перевала найти email запросом по нему уже нельзя, поэтому берём пользователя напрямую
+    try:
+        emails = [instance.user.email]
+    except User.DoesNotExist:
+        emails = []
+    response_cache.invalidate([instance.id], emails)
+
+
+@receiver(post_save, sender=PerevalImage)
+@receiver(post_delete, sender=PerevalImage)
+def invalidate_responses_on_image_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    pereval = instance.pereval if PerevalImage.pereval.is_cached(instance) else None
+    if pereval is not None and PerevalAdded.user.is_cached(pereval):
+        response_cache.invalidate([pereval.id], [pereval.user.email])
+    else:
+        response_cache.invalidate_perevals([instance.pereval_id])
+
+
+@receiver(post_save, sender=Coords)
+@receiver(post_save, sender=Level)
+@receiver(post_save, sender=User)
+def invalidate_responses_on_related_save(sender, instance, created=False, raw=False, **kwargs):
+    if created or raw:
+        return
+    lookup = {Coords: 'coords', Level: 'level', User: 'user'}[sender]
+    response_cache.invalidate_perevals(
+        PerevalAdded.objects.filter(**{lookup: instance}).values_list('id', flat=True))
+
+
+@receiver(perevals_changed)
+def invalidate_responses_on_batch_change(sender, pereval_ids, **kwargs):
+    # Только что созданные перевалы ещё не закешированы, но списки их пользователей устарели
+    response_cache.invalidate_perevals(pereval_ids)
+
+
+# Журнал изменений для синхронизации клиентов (mountain_pass/changes.py)
+@receiver(post_save, sender=PerevalAdded)
+def record_pereval_change(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        kind = 'created'
+    elif getattr(instance, '_loaded_status', None) not in (None, instance.status):
+        kind = 'status'
+    else:
+        kind = 'updated'
+    changes.record(instance, kind)
+    instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=PerevalAdded)
+def record_pereval_delete(sender, instance, **kwargs):
+    changes.record(instance, 'deleted')
+
+
+@receiver(post_save, sender=PerevalImage)
+def record_image_change(sender, instance, created=False, raw=False, **kwargs):
+    # Новые изображения сохраняются вместе с перевалом, событие которого уже записано
+    if not created and not raw:
+        changes.record_many([instance.pereval_id], 'updated')
+
+
+@receiver(post_delete, sender=PerevalImage)
+def record_image_delete(sender, instance, **kwargs):
+    changes.record_image_delete(instance.pereval_id, instance.id)
+
+
+@receiver(perevals_changed)
+def record_batch_change(sender, pereval_ids, created=False, kind='updated', **kwargs):
+    changes.record_many(pereval_ids, 'created' if created else kind)
+
+
+# Счётчики соединений с БД (mountain_pass/db_metrics.py)
+request_started.connect(db_metrics.on_request_started, dispatch_uid='db_metrics_request_started')
+connection_created.connect(db_metrics.on_connection_created, dispatch_uid='db_metrics_connection_created')
+
+# Подсчёт запросов к БД в замерах запроса (mountain_pass/instrumentation.py)
+connection_created.connect(instrumentation.on_connection_created, dispatch_uid='instrumentation_connection_created')
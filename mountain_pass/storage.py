@@ -0,0 +1,15 @@
+from django.core.files.storage import FileSystemStorage
+
+from . import instrumentation
+
+
+class InstrumentedStorageMixin:
+    # Учитывает объём записанных файлов в замерах запроса (mountain_pass/instrumentation.py)
+    def _save(self, name, content):
+        name = super()._save(name, content)
+        instrumentation.record_storage_write(content.size or 0)
+        return name
+
+
+class InstrumentedFileSystemStorage(InstrumentedStorageMixin, FileSystemStorage):
+    pass
@@ -1,8 +1,39 @@
-from django.test import TestCase
-from .models import User, Coords, Level, PerevalAdded, PerevalImage
+import asyncio
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from . import (benchmarks, changes, clusters, db_metrics, geo, idempotency, images, instrumentation, moderation,
+               response_cache, search, thumbnails, uploads)
+from .models import (User, Coords, IdempotencyKey, ImageBlob, ImageUpload, Level, PerevalAdded, PerevalAreas,
+                     PerevalChange, PerevalCluster, PerevalClusterMember, PerevalImage,
+                     PerevalImagePayload, SprActivitiesTypes)
+from .pagination import KeysetPagination
+from .serializers import PerevalAddedSerializer, PerevalNotEditable
+from .views import PerevalFilterView
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
 from django.urls import reverse
+from PIL import Image as PILImage
 
 # Create your tests here.
 
@@ -138,3 +169,1766 @@ class APITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         self.assertEqual(response.data['data']['title'], 'Тестовый перевал')
+
+
+class PerevalBulkCreateTest(TestCase):
+    client_class = APIClient
+
+    def make_item(self, email, title):
+        return {
+            'title': title,
+            'user': {'email': email, 'fam': 'Петров', 'name': 'Пётр'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5, 'height': 3000},
+            'level': {'winter': '', 'summer': '1А', 'autumn': '1А', 'spring': ''},
+            'images': [{"data": "path/to/image1.jpg", "title": "Седловина"}]
+        }
+
+    def test_bulk_create_json_array(self):
+        url = reverse('submit_data_bulk')
+        items = [
+            self.make_item('bulk@example.com', 'Перевал 1'),
+            self.make_item('bulk@example.com', 'Перевал 2'),
+            {'title': 'Без координат'},
+        ]
+
+        response = self.client.post(url, items, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertIsNotNone(response.data['results'][0]['id'])
+        self.assertIn('errors', response.data['results'][2])
+        self.assertEqual(User.objects.filter(email='bulk@example.com').count(), 1)
+        self.assertEqual(PerevalImage.objects.count(), 2)
+
+    def test_bulk_create_query_count_does_not_depend_on_batch_size(self):
+        url = reverse('submit_data_bulk')
+        items = [self.make_item(f'user{i}@example.com', f'Перевал {i}') for i in range(20)]
+        # Справочник уровней уже загружен, как в работающем процессе (кеш заполняется после фиксации):
+        # сравниваются только запросы самой пакетной вставки
+        self.addCleanup(Level.objects.clear_cache)
+        self.addCleanup(User.objects.clear_cache)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, [self.make_item('warm@example.com', 'Перевал')], format='json')
+
+        with CaptureQueriesContext(connection) as small_batch:
+            self.client.post(url, items[:2], format='json')
+        with CaptureQueriesContext(connection) as large_batch:
+            self.client.post(url, items[2:], format='json')
+
+        self.assertEqual(len(small_batch), len(large_batch))
+
+    def test_bulk_create_ndjson(self):
+        url = reverse('submit_data_bulk')
+        body = '\n'.join(json.dumps(self.make_item('nd@example.com', f'Перевал {i}')) for i in range(3))
+
+        response = self.client.post(url, body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(PerevalAdded.objects.filter(user__email='nd@example.com').count(), 3)
+
+
+class PerevalReadQueriesTest(TestCase):
+    client_class = APIClient
+
+    def create_perevals(self, user, count):
+        for i in range(count):
+            pereval = PerevalAdded.objects.create(
+                user=user,
+                coords=Coords.objects.create(latitude=43.1, longitude=42.5, height=3000),
+                level=Level.objects.intern(summer='1А'),
+                title=f'Перевал {i}'
+            )
+            PerevalImage.objects.create(pereval=pereval, data='path/to/image.jpg', title='Седловина')
+            PerevalImage.objects.create(pereval=pereval, data='path/to/image2.jpg', title='Подъём')
+
+    def test_list_by_email_query_count_is_constant(self):
+        few = User.objects.create(email='few@example.com', fam='Иванов', name='Иван')
+        many = User.objects.create(email='many@example.com', fam='Петров', name='Пётр')
+        self.create_perevals(few, 1)
+        self.create_perevals(many, 30)
+        url = reverse('submit_data_by_email')
+
+        # Один запрос на перевалы вместе с user/coords/level и один на изображения
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'user__email': few.email})
+        self.assertEqual(len(response.data['data']), 1)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'user__email': many.email})
+        self.assertEqual(len(response.data['data']), 30)
+
+    def test_detail_query_count(self):
+        user = User.objects.create(email='detail@example.com', fam='Иванов', name='Иван')
+        self.create_perevals(user, 1)
+        pereval = PerevalAdded.objects.get()
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('pereval_detail_update', kwargs={'id': pereval.id}))
+        self.assertEqual(len(response.data['data']['images']), 2)
+
+
+class PerevalListPaginationTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.user = User.objects.create(email='pages@example.com', fam='Иванов', name='Иван')
+        for i in range(5):
+            PerevalAdded.objects.create(
+                user=self.user,
+                coords=Coords.objects.create(latitude=43.1, longitude=42.5),
+                title=f'Перевал {i}'
+            )
+        self.url = reverse('submit_data_by_email')
+
+    def test_keyset_pages_cover_all_records(self):
+        titles = []
+        params = {'user__email': self.user.email, 'limit': 2}
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            titles += [item['title'] for item in response.data['data']]
+            if response.data['next'] is None:
+                break
+            params['cursor'] = response.data['next']
+
+        self.assertEqual(titles, [f'Перевал {i}' for i in range(5)])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'user__email': self.user.email, 'cursor': 'не курсор'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_streaming_response(self):
+        response = self.client.get(self.url, {'user__email': self.user.email, 'stream': 1})
+
+        self.assertTrue(response.streaming)
+        payload = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(payload['status'], 200)
+        self.assertEqual(len(payload['data']), 5)
+
+    def test_streaming_response_not_found(self):
+        response = self.client.get(self.url, {'user__email': 'nobody@example.com', 'stream': 1})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(PEREVAL_IMAGE_WORKERS=0, MEDIA_ROOT=tempfile.mkdtemp())
+class PerevalImageIngestionTest(TestCase):
+    client_class = APIClient
+
+    def tearDown(self):
+        # Выполненные on_commit-обработчики заполнили кеш справочника Level строками, которые будут откачены
+        Level.objects.clear_cache()
+
+    @staticmethod
+    def make_png_base64(size=(32, 32)):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', size, color='blue').save(buffer, format='PNG')
+        return base64.b64encode(buffer.getvalue()).decode()
+
+    def submit(self, image_data):
+        data = {
+            'title': 'Перевал с фото',
+            'user': {'email': 'photo@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': [{'data': image_data, 'title': 'Седловина'}]
+        }
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('submit_data'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # До фоновой обработки запись изображения есть, а файла ещё нет
+        image = PerevalImage.objects.get()
+        self.assertEqual(image.status, 'pending')
+        self.assertFalse(image.data)
+
+        for callback in callbacks:
+            callback()
+        image.refresh_from_db()
+        return image
+
+    def test_base64_image_is_processed_after_commit(self):
+        image = self.submit('data:image/png;base64,' + self.make_png_base64())
+
+        self.assertEqual(image.status, 'ready')
+        self.assertTrue(image.data.name.endswith('.png'))
+        self.assertTrue(image.data.storage.exists(image.data.name))
+        # Уменьшенные копии создаются сразу после обработки и лежат рядом с оригиналом
+        for size in thumbnails.VARIANT_SIZES:
+            self.assertTrue(image.data.storage.exists(thumbnails.variant_name(image.data.name, size)))
+
+    def test_invalid_image_is_marked_failed(self):
+        image = self.submit(base64.b64encode(b'not an image' * 10).decode())
+
+        self.assertEqual(image.status, 'failed')
+
+    def test_decompression_bomb_is_decode_error(self):
+        # DecompressionBombError — не OSError: без отдельной обработки запрос завершился бы ошибкой 500
+        self.addCleanup(setattr, PILImage, 'MAX_IMAGE_PIXELS', PILImage.MAX_IMAGE_PIXELS)
+        PILImage.MAX_IMAGE_PIXELS = 100
+        with self.assertRaises(images.ImageDecodeError):
+            images.decode_payload(self.make_png_base64())
+
+    def test_pending_image_recovered_after_restart(self):
+        data = {
+            'title': 'Перевал с фото',
+            'user': {'email': 'photo@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': [{'data': self.make_png_base64(), 'title': 'Седловина'},
+                       {'data': self.make_png_base64((16, 16)), 'title': 'Спуск'}]
+        }
+        # Процесс перезапустился до фоновой обработки: обработчики после фиксации не выполнились
+        with self.captureOnCommitCallbacks(), CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('submit_data'), data, format='json')
+        # Данные всех изображений запроса сохраняются одной вставкой
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'perevalimagepayload' in query['sql'].lower()]), 1)
+        first, second = PerevalImage.objects.order_by('id')
+        self.assertTrue(PerevalImagePayload.objects.filter(image=first).exists())
+        images.drop_payload(second.id)  # Данные второго изображения потеряны
+
+        self.assertEqual(images.recover_pending(timeout=0), (1, 1))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, second.status), ('ready', 'failed'))
+        self.assertTrue(first.data.storage.exists(first.data.name))
+        self.assertFalse(PerevalImagePayload.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PerevalImageUpdateTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        user = User.objects.create(email='images@example.com', fam='Иванов', name='Иван')
+        self.pereval = PerevalAdded.objects.create(
+            user=user, title='Перевал', coords=Coords.objects.create(latitude=43.1, longitude=42.5))
+        self.other = PerevalAdded.objects.create(
+            user=user, title='Другой', coords=Coords.objects.create(latitude=43.2, longitude=42.6))
+        self.url = reverse('pereval_detail_update', kwargs={'id': self.pereval.id})
+
+    def add_images(self, pereval, count):
+        images = []
+        for index in range(count):
+            image = PerevalImage(pereval=pereval, title=f'Фото {index}')
+            image.data.save(f'photo_{index}.jpg', ContentFile(b'jpeg'), save=False)
+            images.append(image)
+        return PerevalImage.objects.bulk_create(images)
+
+    def patch(self, images, images_to_delete):
+        return self.client.patch(self.url, {'images': images, 'images_to_delete': images_to_delete}, format='json')
+
+    def count_patch_queries(self, count):
+        images = self.add_images(self.pereval, count * 2)
+        payload = [{'id': image.id, 'title': 'Новое название'} for image in images[:count]]
+        payload += [{'data': f'pereval_images/new_{index}.jpg', 'title': 'Новое'} for index in range(count)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch(payload, [image.id for image in images[count:]])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        PerevalImage.objects.filter(pereval=self.pereval).delete()
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_image_count(self):
+        self.assertEqual(self.count_patch_queries(2), self.count_patch_queries(20))
+
+    def test_updates_creates_and_deletes(self):
+        kept, replaced, deleted = self.add_images(self.pereval, 3)
+        storage = kept.data.storage
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.patch([
+                {'id': kept.id, 'title': 'Седловина'},
+                {'id': replaced.id, 'data': 'pereval_images/replaced.jpg'},
+                {'data': 'pereval_images/added.jpg', 'title': 'Вершина'},
+            ], [deleted.id])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        images = {image.id: image for image in PerevalImage.objects.filter(pereval=self.pereval)}
+        self.assertEqual(images[kept.id].title, 'Седловина')
+        self.assertEqual(images[replaced.id].data.name, 'pereval_images/replaced.jpg')
+        self.assertNotIn(deleted.id, images)
+        self.assertEqual(len(images), 3)
+        # Файлы удалённого и заменённого изображений удалены после фиксации, остальные на месте
+        self.assertFalse(storage.exists(deleted.data.name))
+        self.assertFalse(storage.exists(replaced.data.name))
+        self.assertTrue(storage.exists(kept.data.name))
+
+    def test_foreign_images_are_rejected(self):
+        foreign, = self.add_images(self.other, 1)
+
+        response = self.patch([{'id': foreign.id, 'title': 'Чужое'}], [])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Удаление чужого изображения по id игнорируется
+        response = self.patch([], [foreign.id])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.title, 'Фото 0')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PerevalImageThumbnailTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(email='thumb@example.com', fam='Иванов', name='Иван')
+        pereval = PerevalAdded.objects.create(
+            user=user, coords=Coords.objects.create(latitude=43.1, longitude=42.5), title='Перевал')
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (2000, 1000), color='green').save(buffer, format='JPEG')
+        self.image = PerevalImage(pereval=pereval, title='Седловина')
+        self.image.data.save('original.jpg', ContentFile(buffer.getvalue()))
+
+    def tearDown(self):
+        # Сведения о созданных копиях хранятся в кеше Django
+        response_cache.get_cache().clear()
+
+    def test_thumbnail_is_generated_lazily(self):
+        name = thumbnails.variant_name(self.image.data.name, 512)
+        self.assertFalse(self.image.data.storage.exists(name))
+
+        response = self.client.get(reverse('pereval_image_thumbnail', kwargs={'id': self.image.id, 'size': 512}))
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(response['Location'], self.image.data.storage.url(name))
+        with PILImage.open(self.image.data.storage.open(name)) as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+            self.assertEqual(thumbnail.size, (512, 256))
+
+        # В выдаче перевала готовая копия ссылается прямо на файл
+        response = self.client.get(reverse('pereval_detail_update', kwargs={'id': self.image.pereval_id}))
+        self.assertEqual(response.data['data']['images'][0]['thumbnails']['512'], self.image.data.storage.url(name))
+
+    def test_unknown_size(self):
+        response = self.client.get(reverse('pereval_image_thumbnail', kwargs={'id': self.image.id, 'size': 100}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_decompression_bomb_is_thumbnail_error(self):
+        # Изображение больше допустимого числа пикселей: Pillow бросает DecompressionBombError (не OSError)
+        self.addCleanup(setattr, PILImage, 'MAX_IMAGE_PIXELS', PILImage.MAX_IMAGE_PIXELS)
+        PILImage.MAX_IMAGE_PIXELS = 100_000
+        with self.assertRaises(thumbnails.ThumbnailError):
+            thumbnails.get_or_create_variant(self.image, 128)
+
+
+class GeoSearchTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(email='geo@example.com', fam='Иванов', name='Иван')
+        places = {
+            'Эльбрус': (43.3499, 42.4453),
+            'Домбай': (43.2906, 41.6272),
+            'Казбек': (42.6996, 44.5186),
+            'Белуха': (49.8067, 86.5900),
+        }
+        for title, (latitude, longitude) in places.items():
+            PerevalAdded.objects.create(
+                user=user, title=title,
+                coords=Coords.objects.create(latitude=latitude, longitude=longitude))
+        self.url = reverse('pereval_geo_search')
+
+    def test_geohash_encode(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(Coords.objects.get(latitude='43.34990000').geohash, geo.encode(43.3499, 42.4453))
+
+    def test_bbox_cover_contains_points(self):
+        bbox = (42.0, 41.0, 44.0, 45.0)
+        prefixes = geo.cover_bbox(*bbox)
+        self.assertTrue(0 < len(prefixes) <= geo.MAX_COVER_CELLS)
+        for latitude in (42.0, 42.7, 43.99):
+            for longitude in (41.0, 43.3, 44.99):
+                self.assertTrue(any(geo.encode(latitude, longitude).startswith(p) for p in prefixes))
+
+    def test_bbox_search(self):
+        response = self.client.get(self.url, {'bbox': '41,42,45,44'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(item['title'] for item in response.data['data']), ['Домбай', 'Казбек', 'Эльбрус'])
+
+    def test_radius_search(self):
+        response = self.client.get(self.url, {'lat': 43.35, 'lon': 42.44, 'radius': 100})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['title'] for item in response.data['data']], ['Эльбрус', 'Домбай'])
+        self.assertLess(response.data['data'][0]['distance_km'], 1)
+
+        # Кандидаты отбираются в БД по приближённому расстоянию, с ограничением по limit
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'lat': 43.35, 'lon': 42.44, 'radius': 100, 'limit': 1})
+        self.assertEqual([item['title'] for item in response.data['data']], ['Эльбрус'])
+        self.assertIn('LIMIT 2', queries.captured_queries[-1]['sql'])
+
+    def test_radius_search_across_antimeridian(self):
+        user = User.objects.get()
+        for title, longitude in [('Западный', -179.9), ('Восточный', 179.3), ('Восточный 2', 179.0),
+                                 ('Дальний', -175.0)]:
+            PerevalAdded.objects.create(user=user, title=title,
+                                        coords=Coords.objects.create(latitude=65.0, longitude=longitude))
+
+        # Круг делится антимеридианом на два прямоугольника
+        east, west = geo.radius_bboxes(65.0, 179.95, 50)
+        self.assertEqual((east[3], west[1]), (180.0, -180.0))
+        self.assertTrue(east[1] < 179.0 and -179.9 < west[3] < -175.0)
+
+        response = self.client.get(self.url, {'lat': 65.0, 'lon': 179.95, 'radius': 50})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['title'] for item in response.data['data']], ['Западный', 'Восточный', 'Восточный 2'])
+
+        # Отбор кандидатов в БД тоже считает расстояние через антимеридиан
+        response = self.client.get(self.url, {'lat': 65.0, 'lon': 179.95, 'radius': 50, 'limit': 1})
+        self.assertEqual([item['title'] for item in response.data['data']], ['Западный'])
+
+    def test_radius_is_capped(self):
+        response = self.client.get(self.url, {'lat': 43.35, 'lon': 42.44, 'radius': 5000})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_missing_area(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PerevalClusterTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.user = User.objects.create(email='map@example.com', fam='Иванов', name='Иван')
+
+    def tearDown(self):
+        # Выполненные on_commit-обработчики заполнили кеши справочников строками, которые будут откачены
+        User.objects.clear_cache()
+        Level.objects.clear_cache()
+
+    def create_pereval(self, latitude, longitude, **level):
+        return PerevalAdded.objects.create(
+            user=self.user, title='Перевал',
+            coords=Coords.objects.create(latitude=latitude, longitude=longitude),
+            level=Level.objects.intern(**level))
+
+    def world(self):
+        return PerevalCluster.objects.get(zoom=0)
+
+    def test_aggregates_follow_pereval_changes(self):
+        # Агрегаты пересчитываются после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.create_pereval(43.35, 42.45, summer='1Б')
+            self.create_pereval(43.29, 41.63, summer='2А', winter='3А')
+        self.assertEqual(self.world().count, 2)
+        self.assertEqual(self.world().level_3a, 1)
+
+        # Отклонённые перевалы на карте не учитываются
+        first.status = 'rejected'
+        with self.captureOnCommitCallbacks(execute=True):
+            first.save()
+        self.assertEqual(self.world().count, 1)
+        self.assertEqual(self.world().level_1b, 0)
+
+        # Изменение координат переносит перевал в другую ячейку
+        first.status = 'accepted'
+        with self.captureOnCommitCallbacks(execute=True):
+            first.save()
+            first.coords.latitude, first.coords.longitude = -33.9, 18.4
+            first.coords.save()
+        self.assertEqual(PerevalCluster.objects.get(zoom=1, cell_x=1, cell_y=1).count, 1)
+        self.assertEqual(PerevalCluster.objects.get(zoom=1, cell_x=1, cell_y=0).count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.world().count, 1)
+
+        # Инкрементальные агрегаты совпадают с полным пересчётом
+        incremental = list(PerevalCluster.objects.filter(count__gt=0).order_by('zoom', 'cell_x', 'cell_y')
+                           .values_list('zoom', 'cell_x', 'cell_y', 'count', 'level_3a'))
+        clusters.rebuild()
+        rebuilt = list(PerevalCluster.objects.order_by('zoom', 'cell_x', 'cell_y')
+                       .values_list('zoom', 'cell_x', 'cell_y', 'count', 'level_3a'))
+        self.assertEqual(incremental, rebuilt)
+
+    def test_unrelated_edit_skips_refresh(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            pereval_id = self.create_pereval(43.35, 42.45, summer='1Б').id
+        # Помечаем учтённый вклад: пересчёт вернул бы настоящие координаты
+        PerevalClusterMember.objects.filter(pereval_id=pereval_id).update(latitude=0)
+
+        # Правка названия не меняет ни координат, ни сложности, ни статуса — агрегаты не пересчитываются
+        pereval = PerevalAdded.objects.get(id=pereval_id)
+        pereval.title = 'Новое название'
+        with self.captureOnCommitCallbacks(execute=True):
+            pereval.save()
+        self.assertEqual(PerevalClusterMember.objects.get(pereval_id=pereval_id).latitude, 0)
+
+        pereval.status = 'accepted'
+        with self.captureOnCommitCallbacks(execute=True):
+            pereval.save()
+        self.assertEqual(PerevalClusterMember.objects.get(pereval_id=pereval_id).latitude, 43.35)
+
+    def test_bulk_submit_updates_aggregates(self):
+        item = {
+            'title': 'Перевал',
+            'user': {'email': 'map@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': []
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('submit_data_bulk'), [item] * 3, format='json')
+
+        self.assertEqual(self.world().count, 3)
+        self.assertEqual(self.world().level_1a, 3)
+
+    def test_cluster_endpoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_pereval(43.35, 42.45, summer='1Б')
+            self.create_pereval(43.29, 41.63, summer='1Б')
+            self.create_pereval(49.80, 86.59, summer='3Б')
+
+        response = self.client.get(reverse('pereval_clusters'), {'zoom': 5, 'bbox': '40,40,90,50'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cells = sorted(response.data['data'], key=lambda cell: -cell['count'])
+        self.assertEqual([cell['count'] for cell in cells], [2, 1])
+        self.assertEqual(cells[0]['difficulty'], '1Б')
+        self.assertAlmostEqual(cells[0]['latitude'], 43.32)
+
+
+class LevelInternTest(TestCase):
+    client_class = APIClient
+
+    def tearDown(self):
+        Level.objects.clear_cache()
+
+    def submit(self, title, level):
+        return self.client.post(reverse('submit_data'), {
+            'title': title,
+            'user': {'email': 'level@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': level,
+            'images': []
+        }, format='json')
+
+    def test_same_combination_shares_row(self):
+        self.submit('Перевал 1', {'summer': '1А', 'winter': None})
+        self.submit('Перевал 2', {'summer': '1А', 'winter': ''})
+        self.submit('Перевал 3', {'summer': '2Б'})
+
+        self.assertEqual(Level.objects.count(), 2)
+        first, second, third = PerevalAdded.objects.order_by('id')
+        self.assertEqual(first.level_id, second.level_id)
+        self.assertNotEqual(first.level_id, third.level_id)
+
+    def test_patch_reassigns_level(self):
+        self.submit('Перевал 1', {'summer': '1А'})
+        self.submit('Перевал 2', {'summer': '1А'})
+        first, second = PerevalAdded.objects.order_by('id')
+
+        url = reverse('pereval_detail_update', kwargs={'id': first.id})
+        response = self.client.patch(url, {'level': {'winter': '3Б'}, 'images': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.level.winter, first.level.summer), ('3Б', '1А'))
+        # Общая строка второго перевала не изменилась
+        self.assertEqual((second.level.winter, second.level.summer), ('', '1А'))
+
+    def test_cache_avoids_queries_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            level = Level.objects.intern(summer='1Б')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Level.objects.intern(summer='1Б').id, level.id)
+
+    def test_cache_is_marked_warm_only_after_commit(self):
+        manager = type(Level.objects)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Level.objects.intern(summer='2А')
+        # Транзакция ещё не зафиксирована (или будет откачена): справочник не считается загруженным
+        self.assertFalse(manager._warmed)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(manager._warmed)
+
+        # Кеш сбросили между чтением справочника и фиксацией: прочитанные строки могли устареть
+        Level.objects.clear_cache()
+        with self.captureOnCommitCallbacks() as callbacks:
+            Level.objects.intern(summer='2А')
+        Level.objects.clear_cache()
+        for callback in callbacks:
+            callback()
+        self.assertEqual((manager._warmed, manager._cache), (False, {}))
+
+
+class UserResolveTest(TestCase):
+    client_class = APIClient
+
+    def tearDown(self):
+        User.objects.clear_cache()
+        Level.objects.clear_cache()
+
+    def submit(self):
+        return self.client.post(reverse('submit_data'), {
+            'title': 'Перевал',
+            'user': {'email': 'repeat@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': []
+        }, format='json')
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.submit().status_code, status.HTTP_200_OK)
+        return [query['sql'] for query in queries if 'FROM "mountain_pass_user"' in query['sql']]
+
+    def test_user_looked_up_once_then_cached(self):
+        User.objects.create(email='repeat@example.com', fam='Иванов', name='Иван')
+
+        self.assertEqual(len(self.user_queries()), 1)
+        # Повторная отправка берёт пользователя из кеша
+        self.assertEqual(self.user_queries(), [])
+        self.assertEqual(PerevalAdded.objects.filter(user__email='repeat@example.com').count(), 2)
+
+    def test_new_user_created_once(self):
+        self.user_queries()
+        self.user_queries()
+        self.assertEqual(User.objects.filter(email='repeat@example.com').count(), 1)
+
+    def test_cache_invalidated_on_change(self):
+        user = User.objects.create(email='repeat@example.com', fam='Иванов', name='Иван')
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.resolve('repeat@example.com')
+
+        user.fam = 'Петров'
+        user.save()
+        self.assertEqual(User.objects.resolve('repeat@example.com').fam, 'Петров')
+
+        user.delete()
+        self.assertIsNone(User.objects.resolve('repeat@example.com'))
+
+    @override_settings(PEREVAL_USER_CACHE_TTL=0)
+    def test_cache_disabled(self):
+        User.objects.create(email='repeat@example.com', fam='Иванов', name='Иван')
+        self.user_queries()
+        self.assertEqual(len(self.user_queries()), 1)
+
+
+class ResponseCacheTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.user = User.objects.create(email='cache@example.com', fam='Иванов', name='Иван')
+        self.pereval = PerevalAdded.objects.create(
+            user=self.user, title='Перевал', coords=Coords.objects.create(latitude=43.1, longitude=42.5),
+            level=Level.objects.intern(summer='1А'))
+        PerevalImage.objects.create(pereval=self.pereval, data='path/to/image.jpg', title='Седловина')
+        self.detail_url = reverse('pereval_detail_update', kwargs={'id': self.pereval.id})
+        self.list_url = reverse('submit_data_by_email')
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+
+    def test_detail_cached_and_invalidated_on_patch(self):
+        first = self.client.get(self.detail_url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.detail_url)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+        response = self.client.patch(self.detail_url, {'title': 'Новое название', 'images': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        third = self.client.get(self.detail_url)
+        self.assertEqual(third.data['data']['title'], 'Новое название')
+        self.assertNotEqual(third['ETag'], first['ETag'])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        etag = self.client.get(self.list_url, {'user__email': self.user.email})['ETag']
+        response = self.client.get(self.list_url, {'user__email': self.user.email}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_invalidated_on_status_and_image_change(self):
+        def statuses():
+            response = self.client.get(self.list_url, {'user__email': self.user.email})
+            return [(item['status'], len(item['images'])) for item in response.data['data']]
+
+        self.assertEqual(statuses(), [('new', 1)])
+        with self.assertNumQueries(0):
+            statuses()
+
+        self.pereval.status = 'accepted'
+        self.pereval.save()
+        self.assertEqual(statuses(), [('accepted', 1)])
+
+        PerevalImage.objects.create(pereval_id=self.pereval.id, data='path/to/image2.jpg', title='Подъём')
+        self.assertEqual(statuses(), [('accepted', 2)])
+
+    def test_not_found_is_not_cached(self):
+        url = reverse('pereval_detail_update', kwargs={'id': self.pereval.id + 100})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(response_cache.get(response_cache.detail_key(self.pereval.id + 100)))
+
+
+@override_settings(ROOT_URLCONF='pereval.urls_async')
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+
+    def tearDown(self):
+        response_cache.get_cache().clear()
+        User.objects.clear_cache()
+
+    def submit_data(self, email='async@example.com'):
+        return {
+            'title': 'Перевал',
+            'user': {'email': email, 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': [{'data': 'path/to/image.jpg', 'title': 'Седловина'}]
+        }
+
+    async def test_submit_get_patch_and_list(self):
+        response = await self.async_client.post(reverse('submit_data'), self.submit_data(),
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        pereval_id = response.json()['id']
+
+        url = reverse('pereval_detail_update', kwargs={'id': pereval_id})
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['images'][0]['title'], 'Седловина')
+        response = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        response = await self.async_client.patch(url, {'title': 'Новое название', 'images': []},
+                                                 content_type='application/json')
+        self.assertEqual(response.json()['state'], 1)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.json()['data']['title'], 'Новое название')
+
+        list_url = reverse('submit_data_by_email')
+        response = await self.async_client.get(list_url, {'user__email': 'async@example.com'})
+        self.assertEqual([item['title'] for item in response.json()['data']], ['Новое название'])
+        response = await self.async_client.get(list_url, {'user__email': 'async@example.com', 'limit': 1})
+        self.assertIsNone(response.json()['next'])
+        response = await self.async_client.get(list_url, {'user__email': 'async@example.com', 'stream': 1})
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(json.loads(content)['data']), 1)
+
+    async def test_errors_match_sync_views(self):
+        data = self.submit_data()
+        del data['coords']
+        response = await self.async_client.post(reverse('submit_data'), data, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('coords', response.json()['errors'])
+
+        response = await self.async_client.get(reverse('pereval_detail_update', kwargs={'id': 999}))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse('submit_data_by_email'), {'user__email': 'none@example.com'})
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse('submit_data_by_email'),
+                                               {'user__email': 'none@example.com', 'cursor': 'bad'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_serialization_runs_outside_event_loop(self):
+        # Проверка уменьшенных копий обращается к кешу и хранилищу: в цикле событий она бы его блокировала
+        pereval = PerevalAdded.objects.create(
+            user=User.objects.create(email='async@example.com', fam='Иванов', name='Иван'),
+            coords=Coords.objects.create(latitude=43.1, longitude=42.5), title='Перевал')
+        image = PerevalImage(pereval=pereval, title='Седловина')
+        image.data.save('original.png', ContentFile(base64.b64decode(PerevalImageIngestionTest.make_png_base64())))
+
+        in_event_loop = []
+        original = thumbnails.existing_variants
+
+        def existing_variants(storage, names):
+            try:
+                asyncio.get_running_loop()
+                in_event_loop.append(True)
+            except RuntimeError:
+                in_event_loop.append(False)
+            return original(storage, names)
+
+        self.addCleanup(setattr, thumbnails, 'existing_variants', original)
+        thumbnails.existing_variants = existing_variants
+
+        async_to_sync(self.async_client.get)(reverse('pereval_detail_update', kwargs={'id': pereval.id}))
+        response = async_to_sync(self.async_client.get)(reverse('submit_data_by_email'),
+                                                        {'user__email': 'async@example.com', 'stream': 1})
+
+        async def read(content):
+            return b''.join([chunk async for chunk in content])
+
+        self.assertEqual(len(json.loads(async_to_sync(read)(response.streaming_content))['data']), 1)
+        self.assertEqual(in_event_loop, [False, False])
+
+
+class DatabaseMetricsTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        db_metrics.reset()
+
+    def test_counts_requests_and_reconnects(self):
+        # Первое подключение потока — не переподключение, повторное (например, после проверки соединения) — да
+        connection_created.send(sender=connection.__class__, connection=connection)
+        connection_created.send(sender=connection.__class__, connection=connection)
+
+        with override_settings(PEREVAL_METRICS_ENABLED=True):
+            response = self.client.get(reverse('db_metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        self.assertEqual(data['requests'], 1)
+        self.assertEqual(data['connects'], 2)
+        self.assertGreaterEqual(data['reconnects'], 1)
+        self.assertEqual(data['checkouts'], 0)
+        self.assertIsNone(data['pool'])
+
+    def test_pool_checkouts_are_not_connects(self):
+        pooled = SimpleNamespace(alias='default', settings_dict={'OPTIONS': {'pool': {'max_size': 4}}})
+        db_metrics.on_connection_created(sender=connection.__class__, connection=pooled)
+        db_metrics.on_connection_created(sender=connection.__class__, connection=pooled)
+
+        data = db_metrics.snapshot()
+        self.assertEqual((data['checkouts'], data['connects'], data['reconnects']), (2, 0, 0))
+
+    @override_settings(PEREVAL_METRICS_ENABLED=False)
+    def test_staff_only_when_metrics_disabled(self):
+        self.assertEqual(self.client.get(reverse('db_metrics')).status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(get_user_model().objects.create(username='admin', is_staff=True))
+        self.assertEqual(self.client.get(reverse('db_metrics')).status_code, status.HTTP_200_OK)
+
+
+@override_settings(PEREVAL_RESPONSE_CACHE_TIMEOUT=0, MEDIA_ROOT=tempfile.mkdtemp())
+class InstrumentationTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        instrumentation.registry.reset()
+
+    def tearDown(self):
+        instrumentation.registry.reset()
+        Level.objects.clear_cache()
+        User.objects.clear_cache()
+
+    def submit(self):
+        data = {
+            'title': 'Перевал',
+            'user': {'email': 'timing@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': [{'data': 'path/to/image.jpg', 'title': 'Седловина'}]
+        }
+        return self.client.post(reverse('submit_data'), data, format='json')
+
+    def test_server_timing_and_log_line(self):
+        with self.assertLogs('mountain_pass.performance', 'INFO') as logs:
+            response = self.submit()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['route'], '/api/v1/submitData')
+        self.assertEqual(record['method'], 'POST')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['db_queries'], 0)
+        self.assertGreater(record['serializer_ms'], 0)
+
+        timing = response['Server-Timing']
+        self.assertIn(f'db;dur={record["db_ms"]:.2f};desc="{record["db_queries"]} queries"', timing)
+        self.assertIn('serializer;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_storage_writes_are_counted(self):
+        token = instrumentation._current.set(instrumentation.RequestStats())
+        try:
+            default_storage.save('instrumentation/test.bin', ContentFile(b'x' * 100))
+            self.assertEqual(instrumentation.current().storage_bytes, 100)
+        finally:
+            instrumentation._current.reset(token)
+
+    def test_metrics_endpoint(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_404_NOT_FOUND)
+
+        with override_settings(PEREVAL_METRICS_ENABLED=True):
+            pereval_id = self.submit().data['id']
+            self.client.get(reverse('pereval_detail_update', kwargs={'id': pereval_id}))
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('pereval_request_duration_seconds_bucket'
+                      '{route="/api/v1/submitData/<int:id>",method="GET",le="+Inf"} 1', text)
+        self.assertIn('pereval_requests_total{route="/api/v1/submitData",method="POST",status="200"} 1', text)
+        self.assertIn('pereval_db_requests_total', text)
+
+
+@override_settings(PEREVAL_RESPONSE_CACHE_TIMEOUT=0)
+class BenchmarkSuiteTest(TestCase):
+    def tearDown(self):
+        Level.objects.clear_cache()
+        User.objects.clear_cache()
+
+    def test_suite_reports_every_scenario(self):
+        generator = benchmarks.DataGenerator(seed=3)
+        benchmarks.seed(generator, users=5, passes=30, images_per_pass=1, areas=3)
+        self.assertEqual(PerevalAdded.objects.count(), 30)
+        self.assertEqual(PerevalAreas.objects.count(), 3)
+
+        results = benchmarks.Suite(generator, requests=3, users=5, images_per_pass=1).run()
+        self.assertEqual(set(results), set(benchmarks.SCENARIOS))
+        for result in results.values():
+            self.assertEqual(result['errors'], 0)
+            self.assertEqual(result['requests'], 3)
+            self.assertIn('p99_ms', result)
+            self.assertIn('queries_max', result)
+        self.assertEqual(results['detail']['queries_max'], 2)
+
+    def test_compare_with_baseline(self):
+        baseline = {'detail': {'p99_ms': 10.0, 'rps': 100.0, 'queries_max': 2}}
+        self.assertEqual(benchmarks.compare({'detail': {'p99_ms': 11.0, 'rps': 95.0, 'queries_max': 2}},
+                                            baseline, 0.2), [])
+        regressions = benchmarks.compare({'detail': {'p99_ms': 15.0, 'rps': 60.0, 'queries_max': 3}},
+                                         baseline, 0.2)
+        self.assertEqual(len(regressions), 3)
+
+
+class PerevalFilterTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(email='filter@example.com', fam='Иванов', name='Иван')
+        self.area = PerevalAreas.objects.create(title='Кавказ')
+        self.skis = SprActivitiesTypes.objects.create(title='Лыжи')
+        passes = [
+            ('Лёгкий зимний', 'accepted', {'winter': '1А'}, self.area),
+            ('Средний зимний', 'accepted', {'winter': '1Б', 'summer': '1А'}, None),
+            ('Сложный зимний', 'accepted', {'winter': '3А'}, self.area),
+            ('Летний', 'accepted', {'summer': '1А'}, self.area),
+            ('Новый лёгкий', 'new', {'winter': '1А'}, self.area),
+        ]
+        for title, pereval_status, level, area in passes:
+            pereval = PerevalAdded.objects.create(
+                user=user, title=title, status=pereval_status, area=area,
+                coords=Coords.objects.create(latitude=43.1, longitude=42.5),
+                level=Level.objects.intern(**level))
+            if area is not None:
+                pereval.activities.add(self.skis)
+        self.url = reverse('pereval_filter')
+
+    def titles(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(item['title'] for item in response.data['data'])
+
+    def test_level_range_in_season(self):
+        params = {'status': 'accepted', 'season': 'winter', 'max_level': '1Б'}
+        self.assertEqual(self.titles(params), ['Лёгкий зимний', 'Средний зимний'])
+
+        params = {'season': 'winter', 'min_level': '1Б'}
+        self.assertEqual(self.titles(params), ['Сложный зимний', 'Средний зимний'])
+
+    def test_area_and_activities(self):
+        params = {'area': self.area.id, 'activities': str(self.skis.id), 'status': 'accepted'}
+        self.assertEqual(self.titles(params), ['Летний', 'Лёгкий зимний', 'Сложный зимний'])
+
+    def test_invalid_level(self):
+        response = self.client.get(self.url, {'season': 'winter', 'max_level': '5Х'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_plan_uses_indexes(self):
+        # Таблица перевалов читается по индексу, рассчитанному на этот фильтр.
+        # На маленькой тестовой таблице PostgreSQL всё равно выбрал бы Seq Scan, поэтому запрещаем его;
+        # но тогда он может взять и любой другой индекс — проверяем имя нужного.
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        queries = [
+            ({'status': 'accepted', 'season': 'winter', 'max_level': '1Б'}, 'pereval_status_level_idx'),
+            ({'status': 'accepted', 'area': str(self.area.id)}, 'pereval_area_status_idx'),
+            # Без статуса: перевалы подходящих уровней — по индексу внешнего ключа level
+            ({'season': 'summer', 'min_level': '1А'}, 'mountain_pass_perevaladded_level_id_'),
+        ]
+        for params, index in queries:
+            queryset = PerevalFilterView().get_queryset(QueryDict(urlencode(params)))
+            plan = queryset.order_by(*KeysetPagination.ordering).explain()
+            self.assertIn(index, plan)
+            # PostgreSQL: "Seq Scan on ...", SQLite: "SCAN ..."
+            self.assertNotRegex(plan, r'Seq Scan on mountain_pass_perevaladded|SCAN (TABLE )?mountain_pass_perevaladded')
+
+
+class PerevalAreaTreeTest(TestCase):
+    def setUp(self):
+        PerevalAreas.objects.clear_cache()
+        self.caucasus = PerevalAreas.objects.create(title='Кавказ')
+        self.elbrus = PerevalAreas.objects.create(title='Приэльбрусье', id_parent=self.caucasus)
+        self.adyl_su = PerevalAreas.objects.create(title='Адыл-Су', id_parent=self.elbrus)
+        self.altai = PerevalAreas.objects.create(title='Алтай')
+
+        user = User.objects.create(email='areas@example.com', fam='Иванов', name='Иван')
+        for title, area in [('Джанкуат', self.adyl_su), ('Донгуз-Орун', self.elbrus), ('Кара-Тюрек', self.altai)]:
+            PerevalAdded.objects.create(user=user, title=title, status='accepted', area=area,
+                                        coords=Coords.objects.create(latitude=43.1, longitude=42.5))
+
+    def tearDown(self):
+        PerevalAreas.objects.clear_cache()
+
+    def passes(self, area):
+        response = self.client.get(reverse('pereval_area_passes', kwargs={'id': area.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(item['title'] for item in response.data['data'])
+
+    def test_paths_are_maintained(self):
+        self.adyl_su.refresh_from_db()
+        self.assertEqual(self.adyl_su.path, f'{self.caucasus.id}/{self.elbrus.id}/{self.adyl_su.id}/')
+
+        # Перенос района меняет пути всех его подрайонов
+        self.elbrus.id_parent = self.altai
+        self.elbrus.save()
+        self.adyl_su.refresh_from_db()
+        self.assertEqual(self.adyl_su.path, f'{self.altai.id}/{self.elbrus.id}/{self.adyl_su.id}/')
+        self.assertEqual(self.passes(self.altai), ['Джанкуат', 'Донгуз-Орун', 'Кара-Тюрек'])
+        self.assertEqual(self.passes(self.caucasus), [])
+
+    def test_deep_tree_path_is_not_truncated(self):
+        # Путь растёт с глубиной: 100 уровней — заметно больше прежнего ограничения в 255 символов
+        area = self.adyl_su
+        for level in range(100):
+            area = PerevalAreas.objects.create(title=f'Район {level}', id_parent=area)
+        area.refresh_from_db()
+        self.assertGreater(len(area.path), 255)
+
+        self.elbrus.id_parent = self.altai
+        self.elbrus.save()
+        area.refresh_from_db()
+        self.assertTrue(area.path.startswith(f'{self.altai.id}/{self.elbrus.id}/{self.adyl_su.id}/'))
+        self.assertEqual(PerevalAreas.objects.tree().ancestors(area.id)[:2], [self.altai.id, self.elbrus.id])
+
+    def test_move_into_own_subtree_is_rejected(self):
+        self.caucasus.id_parent = self.adyl_su
+        with self.assertRaises(ValueError):
+            self.caucasus.save()
+
+    def test_tree(self):
+        response = self.client.get(reverse('pereval_area_tree'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([node['title'] for node in response.data['data']], ['Алтай', 'Кавказ'])
+        caucasus = response.data['data'][1]
+        self.assertEqual(caucasus['children'][0]['title'], 'Приэльбрусье')
+        self.assertEqual(caucasus['children'][0]['children'][0]['title'], 'Адыл-Су')
+
+        # Новый район сбрасывает кеш дерева
+        PerevalAreas.objects.create(title='Цей', id_parent=self.caucasus)
+        response = self.client.get(reverse('pereval_area_tree'), {'root': self.caucasus.id})
+        self.assertEqual([node['title'] for node in response.data['data'][0]['children']], ['Приэльбрусье', 'Цей'])
+
+        response = self.client.get(reverse('pereval_area_tree'), {'root': 0})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_subtree_passes_in_one_query(self):
+        PerevalAreas.objects.tree()  # Дерево уже в кеше
+        with self.assertNumQueries(1):
+            self.assertEqual(self.passes(self.caucasus), ['Джанкуат', 'Донгуз-Орун'])
+        self.assertEqual(self.passes(self.adyl_su), ['Джанкуат'])
+
+        response = self.client.get(reverse('pereval_area_passes', kwargs={'id': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+
+class ModerationQueueTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        user = User.objects.create(email='queue@example.com', fam='Иванов', name='Иван')
+        self.ids = [
+            PerevalAdded.objects.create(user=user, title=f'Перевал {index}',
+                                        coords=Coords.objects.create(latitude=43.1, longitude=42.5)).id
+            for index in range(5)
+        ]
+        staff = get_user_model().objects
+        self.first = staff.create_user('first', is_staff=True)
+        self.second = staff.create_user('second', is_staff=True)
+
+    def claim(self, moderator, limit):
+        self.client.force_authenticate(moderator)
+        response = self.client.post(reverse('moderation_claim'), {'limit': limit}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data['data']]
+
+    def test_claims_do_not_overlap(self):
+        self.assertEqual(self.claim(self.first, 3), self.ids[:3])
+        self.assertEqual(self.claim(self.second, 10), self.ids[3:])
+        # Новых записей не осталось: в ответе только уже взятые модератором
+        self.assertEqual(self.claim(self.first, 3), self.ids[:3])
+        self.assertEqual(set(PerevalAdded.objects.values_list('status', flat=True)), {'pending'})
+        self.assertEqual(PerevalAdded.objects.filter(moderator=self.second).count(), 2)
+
+    def test_decide_and_release(self):
+        self.claim(self.second, 1)
+        mine = self.claim(self.first, 3)
+
+        response = self.client.post(reverse('moderation_decide'),
+                                    {'ids': [mine[0], mine[1], self.ids[0]], 'status': 'rejected'}, format='json')
+        self.assertEqual(response.data['updated'], [mine[0], mine[1]])
+        self.assertEqual(response.data['skipped'], [self.ids[0]])  # Запись другого модератора
+        self.assertEqual(PerevalAdded.objects.filter(status='rejected').count(), 2)
+
+        response = self.client.post(reverse('moderation_release'), {}, format='json')
+        self.assertEqual(response.data['updated'], [mine[2]])
+        pereval = PerevalAdded.objects.get(id=mine[2])
+        self.assertEqual((pereval.status, pereval.moderator, pereval.claimed_at), ('new', None, None))
+
+        response = self.client.post(reverse('moderation_decide'), {'ids': mine, 'status': 'new'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_optimistic_claim_skips_taken_records(self):
+        # Путь без SKIP LOCKED: запись, которую перехватили между выборкой и UPDATE, не достаётся второй раз
+        PerevalAdded.objects.filter(id=self.ids[0]).update(status='pending', moderator=self.second)
+        self.assertEqual(moderation._claim_optimistic(self.first, 2), self.ids[1:3])
+
+    def test_edit_does_not_overwrite_claim(self):
+        # Редактирование прочитало запись до захвата модератором: сохранение не должно вернуть статус new
+        stale = PerevalAdded.objects.select_related('coords', 'level').get(id=self.ids[0])
+        self.claim(self.first, 1)
+        serializer = PerevalAddedSerializer(stale, data={'title': 'Правка'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        with self.assertRaises(PerevalNotEditable):
+            serializer.save()
+
+        pereval = PerevalAdded.objects.get(id=self.ids[0])
+        self.assertEqual((pereval.status, pereval.moderator, pereval.title), ('pending', self.first, 'Перевал 0'))
+
+    def test_requires_staff(self):
+        self.client.force_authenticate(get_user_model().objects.create_user('visitor'))
+        response = self.client.post(reverse('moderation_claim'), {'limit': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(PerevalAdded.objects.filter(status='pending').exists())
+
+
+class AdminChangelistTest(TestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', password='admin'))
+        self.area = PerevalAreas.objects.create(title='Кавказ')
+
+    def add_perevals(self, count):
+        for index in range(count):
+            user = User.objects.create(email=f'admin{PerevalAdded.objects.count()}@example.com',
+                                       fam='Иванов', name='Иван')
+            pereval = PerevalAdded.objects.create(user=user, title=f'Перевал {index}', area=self.area,
+                                                  coords=Coords.objects.create(latitude=43.1, longitude=42.5),
+                                                  level=Level.objects.intern(summer='1А'))
+            PerevalImage.objects.create(pereval=pereval, title='Седловина', data='pereval_images/a.jpg')
+
+    def changelist_queries(self, model, params=None):
+        url = reverse(f'admin:mountain_pass_{model}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response
+
+    def test_changelists_do_not_query_per_row(self):
+        # Число запросов не зависит от числа строк на странице
+        self.add_perevals(2)
+        counts = [self.changelist_queries(model)[0] for model in ('perevaladded', 'perevalimage')]
+        self.add_perevals(5)
+        self.assertEqual([self.changelist_queries(model)[0] for model in ('perevaladded', 'perevalimage')], counts)
+
+    def test_filters_search_and_thumbnails(self):
+        self.add_perevals(2)
+        pereval = PerevalAdded.objects.order_by('id').first()
+        _, response = self.changelist_queries('perevaladded', {'status__exact': 'new', 'area__id__exact': self.area.id,
+                                                               'q': pereval.user.email})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+        response = self.client.get(reverse('admin:mountain_pass_perevaladded_change', args=[pereval.id]))
+        self.assertContains(response, reverse('pereval_image_thumbnail', kwargs={
+            'id': pereval.pereval_images.get().id, 'size': thumbnails.VARIANT_SIZES[0]}))
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_image_file_is_read_only(self):
+        # Замена файла в админке не меняла бы ImageBlob и число ссылок на него
+        self.add_perevals(1)
+        image = PerevalImage.objects.get()
+        url = reverse('admin:mountain_pass_perevalimage_change', args=[image.id])
+        response = self.client.post(url, {
+            'pereval': image.pereval_id, 'title': 'Новое название', 'status': 'ready',
+            'data': ContentFile(base64.b64decode(PerevalImageIngestionTest.make_png_base64()), name='other.png'),
+        })
+        self.assertEqual(response.status_code, 302)
+        image.refresh_from_db()
+        self.assertEqual((image.title, image.data.name), ('Новое название', 'pereval_images/a.jpg'))
+        self.assertEqual(self.client.get(reverse('admin:mountain_pass_perevalimage_add')).status_code, 403)
+
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(email='export@example.com', fam='Иванов', name='Иван', phone='+7 900')
+        area = PerevalAreas.objects.create(title='Кавказ')
+        skis = SprActivitiesTypes.objects.create(title='Лыжи')
+        for title, pereval_status in [('Джанкуат', 'accepted'), ('Донгуз-Орун', 'accepted'), ('Новый', 'new')]:
+            pereval = PerevalAdded.objects.create(user=user, title=title, status=pereval_status, area=area,
+                                                  coords=Coords.objects.create(latitude=43.1, longitude=42.5,
+                                                                               height=3200),
+                                                  level=Level.objects.intern(summer='1Б'))
+            pereval.activities.add(skis)
+            PerevalImage.objects.create(pereval=pereval, title='Седловина', data=f'pereval_images/{pereval.id}.jpg')
+        self.url = reverse('export_passes')
+
+    def download(self, params, queries=None):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as captured:
+            content = b''.join(response.streaming_content)
+        if queries is not None:
+            # Перевалы со связанными строками, виды активности и изображения — по запросу на порцию
+            self.assertEqual(len(captured), queries)
+        return content
+
+    def test_geojson(self):
+        data = json.loads(self.download({}, queries=3))
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual([feature['properties']['title'] for feature in data['features']],
+                         ['Джанкуат', 'Донгуз-Орун'])
+        feature = data['features'][0]
+        self.assertEqual(feature['geometry'], {'type': 'Point', 'coordinates': [42.5, 43.1]})
+        self.assertEqual(feature['properties']['level']['summer'], '1Б')
+        self.assertEqual(feature['properties']['area']['title'], 'Кавказ')
+        self.assertEqual(feature['properties']['activities'], ['Лыжи'])
+        self.assertTrue(feature['properties']['images'][0].startswith('http://testserver/media/'))
+        self.assertNotIn('user', feature['properties'])
+
+    def test_csv_and_gzipped_ndjson(self):
+        # Перевалы не только со статусом accepted выгружаются только для персонала
+        response = self.client.get(self.url, {'format': 'csv', 'status': 'accepted,new'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_login(get_user_model().objects.create_user('exporter', is_staff=True))
+
+        rows = list(csv.DictReader(io.StringIO(self.download({'format': 'csv', 'status': 'accepted,new'}).decode())))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['level_summer'], '1Б')
+        self.assertEqual(rows[0]['activities'], 'Лыжи')
+
+        content = gzip.decompress(self.download({'format': 'ndjson', 'gzip': '1'}))
+        self.assertEqual([json.loads(line)['title'] for line in content.decode().splitlines()],
+                         ['Джанкуат', 'Донгуз-Орун'])
+
+        response = self.client.get(self.url, {'format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as file:
+            call_command('export_passes', format='ndjson', output=file.name, chunk_size=1,
+                         base_url='https://example.com')
+            lines = open(file.name, encoding='utf-8').read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(json.loads(lines[0])['images'][0].startswith('https://example.com/media/'))
+
+    async def test_asgi_streaming(self):
+        response = await self.async_client.get(self.url, {'format': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.decode().splitlines()), 2)
+
+
+@override_settings(PEREVAL_RESPONSE_CACHE_TIMEOUT=0)
+class ChangeFeedTest(TestCase):
+    client_class = APIClient
+
+    def tearDown(self):
+        User.objects.clear_cache()
+        Level.objects.clear_cache()
+
+    def submit(self, email='sync@example.com', title='Перевал'):
+        data = {
+            'title': title,
+            'user': {'email': email, 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': [{'data': 'path/to/image.jpg', 'title': 'Седловина'}]
+        }
+        return self.client.post(reverse('submit_data'), data, format='json').data['id']
+
+    def sync(self, since='', email='sync@example.com', **params):
+        response = self.client.get(reverse('pereval_changes'), {'since': since, 'user__email': email, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_sync_returns_only_deltas(self):
+        first = self.submit(title='Первый')
+        second = self.submit(title='Второй')
+        self.submit(email='other@example.com')
+
+        page = self.sync()
+        self.assertEqual([entry['id'] for entry in page['data']], [first, second])
+        self.assertEqual(page['data'][0]['data']['title'], 'Первый')
+        token = page['next']
+        self.assertEqual(self.sync(token)['data'], [])
+
+        # Изменилась только вторая запись — только она и приходит
+        url = reverse('pereval_detail_update', kwargs={'id': second})
+        image_id = PerevalImage.objects.get(pereval_id=second).id
+        self.client.patch(url, {'title': 'Второй, изменён', 'images_to_delete': [image_id]}, format='json')
+        page = self.sync(token)
+        self.assertEqual(len(page['data']), 1)
+        entry = page['data'][0]
+        self.assertEqual((entry['id'], entry['data']['title']), (second, 'Второй, изменён'))
+        self.assertEqual(entry['deleted_images'], [image_id])
+        token = page['next']
+
+        moderation.claim(get_user_model().objects.create_user('moderator', is_staff=True), 10)
+        PerevalAdded.objects.get(id=first).delete()
+        page = self.sync(token)
+        entries = {entry['id']: entry for entry in page['data']}
+        self.assertEqual(entries[second]['kinds'], ['status'])
+        self.assertEqual(entries[second]['data']['status'], 'pending')
+        self.assertTrue(entries[first]['deleted'])
+        self.assertIsNone(entries[first]['data'])
+
+    def test_pagination_and_constant_queries(self):
+        for index in range(5):
+            self.submit(title=f'Перевал {index}')
+        # Номера событиям присваиваются при первом чтении ленты
+        changes.assign_numbers()
+        # Проверка непронумерованных событий, пользователь, события, перевалы и их изображения —
+        # независимо от размера страницы
+        with self.assertNumQueries(5):
+            page = self.sync(limit=2)
+        self.assertTrue(page['has_more'])
+        seen = [entry['id'] for entry in page['data']]
+        while page['has_more']:
+            page = self.sync(page['next'], limit=2)
+            seen += [entry['id'] for entry in page['data']]
+        self.assertEqual(len(set(seen)), 5)
+
+        response = self.client.get(reverse('pereval_changes'), {'since': 'abc', 'user__email': 'sync@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_write_does_not_touch_sequence(self):
+        # Счётчик номеров блокирует только чтение ленты, запись перевала его не трогает
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.submit()
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'perevalchangesequence' in query['sql'].lower()])
+        self.assertTrue(PerevalChange.objects.filter(seq__isnull=True).exists())
+
+    def test_feed_of_all_passes_requires_staff(self):
+        first = self.submit()
+        response = self.client.get(reverse('pereval_changes'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_login(get_user_model().objects.create_user('moderator', is_staff=True))
+        response = self.client.get(reverse('pereval_changes'))
+        self.assertEqual([entry['id'] for entry in response.data['data']], [first])
+
+    def test_late_commit_is_not_skipped(self):
+        first = self.submit(title='Первый')
+        token = self.sync()['next']
+        event = PerevalChange.objects.get(pereval_id=first)
+
+        # Транзакция вставила событие раньше (меньший id), а зафиксировалась после выдачи токена:
+        # номер в ленте оно получает только теперь, и он больше токена
+        PerevalChange.objects.create(id=event.id - 1, pereval_id=first, user_id=event.user_id, kind='updated',
+                                     status='new')
+        page = self.sync(token)
+        self.assertEqual([entry['id'] for entry in page['data']], [first])
+        self.assertGreater(int(page['next']), int(token))
+
+
+@override_settings(PEREVAL_IMAGE_WORKERS=0, PEREVAL_RESPONSE_CACHE_TIMEOUT=0)
+class ImageBlobTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        # Записи ImageBlob откатываются после каждого теста, а файлы остаются — каждому тесту своё хранилище
+        self.enterContext(override_settings(MEDIA_ROOT=tempfile.mkdtemp()))
+
+    def tearDown(self):
+        Level.objects.clear_cache()
+        User.objects.clear_cache()
+        response_cache.get_cache().clear()
+
+    @staticmethod
+    def make_png_base64(color='blue'):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (32, 32), color=color).save(buffer, format='PNG')
+        return base64.b64encode(buffer.getvalue()).decode()
+
+    def submit(self, *payloads):
+        data = {
+            'title': 'Перевал с фото',
+            'user': {'email': 'blob@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': [{'data': payload, 'title': 'Седловина'} for payload in payloads]
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('submit_data'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['id']
+
+    def test_same_bytes_are_stored_once(self):
+        payload = self.make_png_base64()
+        first = self.submit(payload)
+        second = self.submit('data:image/png;base64,' + payload)
+
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.refcount, 2)
+        self.assertTrue(blob.name.startswith(f'pereval_blobs/{blob.sha256[:2]}/'))
+        self.assertEqual(set(PerevalImage.objects.values_list('data', 'status')), {(blob.name, 'ready')})
+        storage = default_storage
+        # На диске один оригинал и один набор уменьшенных копий
+        self.assertEqual(sorted(storage.listdir(f'pereval_blobs/{blob.sha256[:2]}')[1]), sorted([
+            blob.name.rsplit('/', 1)[1], *(thumbnails.variant_name(blob.name, size).rsplit('/', 1)[1]
+                                           for size in thumbnails.VARIANT_SIZES)]))
+
+        # Файл удаляется только вместе с последней ссылкой
+        with self.captureOnCommitCallbacks(execute=True):
+            PerevalAdded.objects.get(id=first).delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+        self.assertTrue(storage.exists(blob.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PerevalAdded.objects.get(id=second).delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(storage.exists(blob.name))
+        self.assertFalse(storage.exists(thumbnails.variant_name(blob.name, 128)))
+
+    def test_patch_releases_references_in_one_batch(self):
+        payload = self.make_png_base64()
+        pereval_id = self.submit(payload, payload, self.make_png_base64('red'))
+        self.assertEqual(sorted(ImageBlob.objects.values_list('refcount', flat=True)), [1, 2])
+        same, _, other = PerevalImage.objects.filter(pereval_id=pereval_id).order_by('id')
+        url = reverse('pereval_detail_update', kwargs={'id': pereval_id})
+
+        # Замена файла ссылкой освобождает старый, удаление — ещё одну ссылку на тот же файл
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {
+                'images': [{'id': other.id, 'data': 'pereval_images/external.jpg'}],
+                'images_to_delete': [same.id],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        blob = ImageBlob.objects.get()
+        self.assertEqual((blob.sha256, blob.refcount), (same.blob_id, 1))
+        self.assertFalse(default_storage.exists(other.data.name))
+        other.refresh_from_db()
+        self.assertIsNone(other.blob_id)
+
+    def test_path_to_shared_file_takes_reference(self):
+        first = self.submit(self.make_png_base64())
+        blob = ImageBlob.objects.get()
+        # Второй перевал ссылается на файл первого по пути, полученному из API
+        second = self.submit(blob.name)
+        image = PerevalImage.objects.get(pereval_id=second)
+        blob.refresh_from_db()
+        self.assertEqual((image.blob_id, blob.refcount), (blob.sha256, 2))
+
+        url = reverse('pereval_detail_update', kwargs={'id': second})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'images_to_delete': [image.id]}, format='json')
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+        self.assertTrue(default_storage.exists(blob.name))
+
+        # Без записи ImageBlob общий файл по пути тоже не удаляется
+        with self.captureOnCommitCallbacks(execute=True):
+            images.discard_file(blob.name)
+        self.assertTrue(default_storage.exists(blob.name))
+        self.assertEqual(PerevalImage.objects.get(pereval_id=first).blob_id, blob.sha256)
+
+    def test_dedupe_command_moves_legacy_files(self):
+        pereval = PerevalAdded.objects.create(
+            user=User.objects.create(email='legacy@example.com', fam='Иванов', name='Иван'),
+            coords=Coords.objects.create(latitude=43.1, longitude=42.5), title='Перевал')
+        names = [default_storage.save(f'pereval_images/legacy_{index}.jpg', ContentFile(b'jpeg'))
+                 for index in range(2)]
+        # На первый файл ссылаются два изображения, второй файл — копия первого
+        PerevalImage.objects.bulk_create([
+            PerevalImage(pereval=pereval, title='Фото', data=name) for name in (names[0], names[0], names[1])])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_images', stdout=io.StringIO())
+
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.refcount, 3)
+        self.assertEqual(set(PerevalImage.objects.values_list('data', 'blob')), {(blob.name, blob.sha256)})
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+        self.assertTrue(default_storage.exists(blob.name))
+
+
+@override_settings(PEREVAL_RESPONSE_CACHE_TIMEOUT=0)
+class ImageUploadTest(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=tempfile.mkdtemp(), PEREVAL_UPLOAD_DIR=tempfile.mkdtemp()))
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (64, 64), color='navy').save(buffer, format='PNG')
+        self.content = buffer.getvalue()
+
+    def tearDown(self):
+        Level.objects.clear_cache()
+        User.objects.clear_cache()
+        response_cache.get_cache().clear()
+
+    def start(self):
+        response = self.client.post(reverse('image_upload_create'), {'size': len(self.content)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['data']['id']
+
+    def put(self, upload_id, start, end):
+        return self.client.put(reverse('image_upload', kwargs={'id': upload_id}), self.content[start:end],
+                               content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(self.content)}')
+
+    def finalize(self, upload_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('image_upload_finalize', kwargs={'id': upload_id}))
+
+    def submit(self, reference):
+        data = {
+            'title': 'Перевал с фото',
+            'user': {'email': 'upload@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': [{'data': reference, 'title': 'Седловина'}]
+        }
+        return self.client.post(reverse('submit_data'), data, format='json')
+
+    def test_resumed_upload_is_referenced_in_submit(self):
+        upload_id = self.start()
+        half = len(self.content) // 2
+        self.assertEqual(self.put(upload_id, 0, half).data['data']['offset'], half)
+
+        # Часть после пропуска не принимается: ответ говорит, с какого байта продолжать
+        response = self.put(upload_id, half + 10, len(self.content))
+        self.assertEqual((response.status_code, response.data['offset']), (status.HTTP_409_CONFLICT, half))
+        response = self.client.post(reverse('image_upload_finalize', kwargs={'id': upload_id}))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        # Повтор с уже полученными байтами: они пропускаются, дописывается только остаток
+        response = self.put(upload_id, half - 5, len(self.content))
+        self.assertEqual(response.data['data']['offset'], len(self.content))
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        reference = response.data['data']['reference']
+        self.assertEqual(reference, f'upload:{upload_id}')
+
+        response = self.submit(reference)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        image = PerevalImage.objects.get(pereval_id=response.data['id'])
+        self.assertEqual(image.status, 'ready')
+        with image.data.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+        blob = ImageBlob.objects.get()
+        self.assertEqual((image.blob_id, blob.refcount), (blob.sha256, 1))
+
+        # Загрузку можно использовать один раз
+        response = self.submit(reference)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('images', response.data['errors'])
+
+    def test_upload_is_used_once_per_bulk_batch(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, len(self.content))
+        reference = self.finalize(upload_id).data['data']['reference']
+        item = {
+            'title': 'Перевал',
+            'user': {'email': 'upload@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': [{'data': reference, 'title': 'Седловина'}]
+        }
+        response = self.client.post(reverse('submit_data_bulk'), [item, item], format='json')
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+        self.assertIn('images', response.data['results'][1]['errors'])
+        self.assertEqual(PerevalImage.objects.count(), 1)
+        self.assertEqual(ImageBlob.objects.get().refcount, 1)
+
+        # Повтор id в одном вызове consume тоже отклоняется
+        with self.assertRaises(uploads.UploadError):
+            uploads.consume([ImageUpload(id=upload_id)] * 2)
+
+    @override_settings(ROOT_URLCONF='pereval.urls_async')
+    def test_async_submit_resolves_uploads_before_validation(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, len(self.content))
+        reference = self.finalize(upload_id).data['data']['reference']
+
+        response = async_to_sync(self.async_client.post)(reverse('submit_data'), {
+            'title': 'Перевал',
+            'user': {'email': 'upload@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': [{'data': reference, 'title': 'Седловина'}]
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(PerevalImage.objects.get().blob_id, ImageBlob.objects.get().sha256)
+
+    def test_chunks_are_copied_with_bounded_buffer(self):
+        class Stream(io.BytesIO):
+            largest = 0
+
+            def read(self, size=-1):
+                Stream.largest = max(Stream.largest, size)
+                return super().read(size)
+
+        self.content = bytes(range(256)) * 1024
+        upload = uploads.create(len(self.content))
+        uploads.write_chunk(upload, 0, len(self.content), Stream(self.content))
+        self.assertEqual(Stream.largest, uploads.COPY_BUFFER)
+        with open(uploads.part_path(upload.id), 'rb') as part:
+            self.assertEqual(part.read(), self.content)
+
+        response = self.client.post(reverse('image_upload_finalize', kwargs={'id': upload.id}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)  # Не изображение
+
+    def test_decompression_bomb_is_rejected_on_finalize(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, len(self.content))
+        self.addCleanup(setattr, PILImage, 'MAX_IMAGE_PIXELS', PILImage.MAX_IMAGE_PIXELS)
+        PILImage.MAX_IMAGE_PIXELS = 1000  # 64x64 больше двойного предела: DecompressionBombError, а не OSError
+
+        response = self.client.post(reverse('image_upload_finalize', kwargs={'id': upload_id}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_purge_releases_expired_uploads(self):
+        finished = self.start()
+        self.put(finished, 0, len(self.content))
+        self.finalize(finished)
+        unfinished = self.start()
+        blob = ImageBlob.objects.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(uploads.purge(timezone.now() + timedelta(seconds=uploads.get_ttl() + 1)), 2)
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.name))
+        self.assertFalse(os.path.exists(uploads.part_path(uuid.UUID(unfinished))))
+
+
+@override_settings(PEREVAL_RESPONSE_CACHE_TIMEOUT=0)
+class IdempotencyKeyTest(TestCase):
+    client_class = APIClient
+
+    def tearDown(self):
+        Level.objects.clear_cache()
+        User.objects.clear_cache()
+
+    def submit_data(self, title='Перевал'):
+        return {
+            'title': title,
+            'user': {'email': 'retry@example.com', 'fam': 'Иванов', 'name': 'Иван'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5},
+            'level': {'summer': '1А'},
+            'images': [{'data': 'path/to/image.jpg', 'title': 'Седловина'}]
+        }
+
+    def post(self, data, key='key-1', url='submit_data'):
+        return self.client.post(reverse(url), data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_returns_original_result(self):
+        first = self.post(self.submit_data())
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        # Повтор не проверяет данные и ничего не создаёт: только поиск сохранённого ответа
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.post(self.submit_data())
+        self.assertEqual((retry.status_code, retry.data), (first.status_code, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse([query for query in queries if 'mountain_pass_perevaladded' in query['sql']])
+        self.assertEqual((PerevalAdded.objects.count(), PerevalImage.objects.count()), (1, 1))
+
+        # Другой ключ — новая запись; тот же ключ с другими данными — ошибка
+        self.assertNotEqual(self.post(self.submit_data(), key='key-2').data['id'], first.data['id'])
+        response = self.post(self.submit_data('Другой перевал'))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_bulk_and_validation_errors_are_replayed(self):
+        response = self.post([self.submit_data(), self.submit_data('Второй')], url='submit_data_bulk')
+        self.assertEqual(response.data['created'], 2)
+        retry = self.post([self.submit_data(), self.submit_data('Второй')], url='submit_data_bulk')
+        self.assertEqual(retry.data, response.data)
+        self.assertEqual(PerevalAdded.objects.count(), 2)
+
+        invalid = {**self.submit_data(), 'coords': {}}
+        self.assertEqual(self.post(invalid, key='key-3').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.post(invalid, key='key-3')['Idempotent-Replayed'], 'true')
+
+    def test_expired_key_runs_again(self):
+        first = self.post(self.submit_data())
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        retry = self.post(self.submit_data())
+        self.assertNotIn('Idempotent-Replayed', retry)
+        self.assertNotEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(idempotency.purge(timezone.now() + timedelta(seconds=idempotency.get_ttl() + 1)), 1)
+
+    @override_settings(ROOT_URLCONF='pereval.urls_async')
+    def test_async_view_replays(self):
+        post = async_to_sync(self.async_client.post)
+        responses = [post(reverse('submit_data'), self.submit_data(), content_type='application/json',
+                          headers={'Idempotency-Key': 'async-key'}) for _ in range(2)]
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(responses[0].json(), responses[1].json())
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        self.assertEqual(PerevalAdded.objects.count(), 1)
+
+
+class PerevalSearchTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(email='search@example.com', fam='Иванов', name='Иван')
+        for title, other_titles in [('Перевал Дятлова', None), ('Пхия', 'Триев'), ('Белалакая', None)]:
+            PerevalAdded.objects.create(
+                user=user, title=title, other_titles=other_titles,
+                coords=Coords.objects.create(latitude=43.1, longitude=42.5))
+        self.url = reverse('pereval_search')
+
+    def titles(self, query):
+        response = self.client.get(self.url, {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['title'] for item in response.data['data']]
+
+    def test_normalize(self):
+        self.assertEqual(search.normalize('Перевал Дятлова'), search.normalize('перевал дятлову'))
+        self.assertEqual(search.normalize('Пхия'), 'pkhiya')
+
+    def test_search_with_typos_and_other_forms(self):
+        self.assertEqual(self.titles('Дятлов')[0], 'Перевал Дятлова')
+        self.assertEqual(self.titles('дятлава')[0], 'Перевал Дятлова')
+        # Латиница и альтернативное название
+        self.assertEqual(self.titles('Dyatlova')[0], 'Перевал Дятлова')
+        self.assertEqual(self.titles('Триев'), ['Пхия'])
+        self.assertEqual(self.titles('Эльбрус'), [])
+
+    def test_index_follows_title_changes(self):
+        pereval = PerevalAdded.objects.get(title='Белалакая')
+        pereval.title = 'Софруджу'
+        pereval.save()
+
+        self.assertEqual(self.titles('Софруджу'), ['Софруджу'])
+        self.assertEqual(self.titles('Белалакая'), [])
+
+    @staticmethod
+    def trigram_queries(queries):
+        return len([query for query in queries.captured_queries if 'perevalsearchtrigram' in query['sql'].lower()])
+
+    def test_index_is_rebuilt_only_when_titles_change(self):
+        user = User.objects.get()
+        coords = Coords.objects.create(latitude=43.2, longitude=42.6)
+        # Новый перевал: одна вставка, без удаления старых строк и перечитывания search_text
+        with CaptureQueriesContext(connection) as queries:
+            pereval = PerevalAdded.objects.create(user=user, title='Донгуз-Орун', coords=coords)
+        self.assertEqual(self.trigram_queries(queries), 1)
+
+        pereval.status = 'accepted'
+        pereval.connect = 'Через Азау'
+        with CaptureQueriesContext(connection) as queries:
+            pereval.save()
+            pereval.save(update_fields=['status'])
+        self.assertEqual(self.trigram_queries(queries), 0)
+
+        pereval.title = 'Бечо'
+        with CaptureQueriesContext(connection) as queries:
+            pereval.save()
+        self.assertEqual(self.trigram_queries(queries), 2)
+        self.assertEqual(self.titles('Бечо'), ['Бечо'])
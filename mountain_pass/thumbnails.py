@@ -0,0 +1,142 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from . import response_cache
+
+logger = logging.getLogger(__name__)
+
+# Размеры (по длинной стороне) уменьшенных копий изображений
+VARIANT_SIZES = (128, 512, 1600)
+VARIANT_FORMAT = 'WEBP'
+VARIANT_QUALITY = 80
+
+
+# Блокировки на имя копии: одну и ту же копию не генерируем параллельно, разные — генерируются одновременно
+_generate_locks = weakref.WeakValueDictionary()
+_generate_locks_guard = threading.Lock()
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+def variant_name(name, size):
+    # Копия хранится рядом с оригиналом: pereval_images/2024/10/09/abc.jpg -> pereval_images/2024/10/09/abc_128.webp
+    root, _ = os.path.splitext(name)
+    return f'{root}_{size}.webp'
+
+
+def get_cache_timeout():
+    return getattr(settings, 'PEREVAL_THUMBNAIL_CACHE_TIMEOUT', 24 * 3600)
+
+
+def _cache_key(name):
+    return f'pereval:thumbnail:{hashlib.sha1(name.encode()).hexdigest()}'
+
+
+def existing_variants(storage, names):
+    # Какие из копий уже есть в хранилище. Найденные запоминаются в кеше Django (тот же, что у ответов API):
+    # при каждой сериализации хранилище не опрашивается, а размер кеша и срок записей ограничены его настройками
+    cache = response_cache.get_cache()
+    keys = {_cache_key(name): name for name in names}
+    existing = {keys[key] for key in cache.get_many(list(keys))}
+    found = [name for name in names if name not in existing and storage.exists(name)]
+    if found:
+        cache.set_many({_cache_key(name): True for name in found}, get_cache_timeout())
+    return existing.union(found)
+
+
+def variant_exists(storage, name):
+    return name in existing_variants(storage, [name])
+
+
+def _lock_for(name):
+    with _generate_locks_guard:
+        lock = _generate_locks.get(name)
+        if lock is None:
+            lock = _generate_locks[name] = threading.Lock()
+        return lock
+
+
+def render_variant(source, size):
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or img.mode == 'P' else 'RGB')
+        img.thumbnail((size, size))
+        buffer = io.BytesIO()
+        img.save(buffer, format=VARIANT_FORMAT, quality=VARIANT_QUALITY)
+    return buffer.getvalue()
+
+
+def get_or_create_variant(image, size):
+    # Возвращает имя файла копии, создавая её при первом обращении
+    if size not in VARIANT_SIZES:
+        raise ThumbnailError(f'Размер {size} не поддерживается')
+    if not image.data:
+        raise ThumbnailError('Изображение ещё не обработано')
+
+    storage = image.data.storage
+    name = variant_name(image.data.name, size)
+    if variant_exists(storage, name):
+        return name
+
+    with _lock_for(name):
+        # Копию мог создать параллельный запрос, пока мы ждали блокировку
+        if variant_exists(storage, name):
+            return name
+        try:
+            with storage.open(image.data.name, 'rb') as source:
+                content = render_variant(source, size)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+            # DecompressionBombError — не OSError: слишком большое по числу пикселей изображение
+            raise ThumbnailError(f'Не удалось прочитать {image.data.name}: {exc}')
+
+        saved_name = storage.save(name, ContentFile(content))
+        if saved_name != name:
+            # Копию одновременно создал другой процесс — оставляем его файл
+            storage.delete(saved_name)
+        response_cache.get_cache().set(_cache_key(name), True, get_cache_timeout())
+    return name
+
+
+def generate_variants(image):
+    # Создаёт все копии сразу (вызывается после фоновой обработки загруженного изображения)
+    for size in VARIANT_SIZES:
+        try:
+            get_or_create_variant(image, size)
+        except ThumbnailError as exc:
+            logger.warning('Копия %spx для изображения %s не создана: %s', size, image.id, exc)
+            return
+
+
+def variant_urls(image):
+    # URL готовых копий ведут прямо в хранилище, для ещё не созданных — на endpoint ленивой генерации
+    if not image.data or image.status != 'ready':
+        return None
+    storage = image.data.storage
+    names = {size: variant_name(image.data.name, size) for size in VARIANT_SIZES}
+    existing = existing_variants(storage, list(names.values()))
+    urls = {}
+    for size, name in names.items():
+        if name in existing:
+            urls[str(size)] = storage.url(name)
+        else:
+            urls[str(size)] = reverse('pereval_image_thumbnail', kwargs={'id': image.id, 'size': size})
+    return urls
+
+
+def delete_variants(storage, name):
+    names = [variant_name(name, size) for size in VARIANT_SIZES]
+    response_cache.get_cache().delete_many([_cache_key(thumbnail_name) for thumbnail_name in names])
+    for thumbnail_name in names:
+        storage.delete(thumbnail_name)
@@ -0,0 +1,234 @@
+import os
+import re
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from . import blobs, images
+from .models import ImageUpload
+
+# Возобновляемая загрузка больших фотографий:
+#   POST /api/v1/uploads {"size": <байт>} — создать загрузку;
+#   PUT /api/v1/uploads/<id> с заголовком Content-Range: bytes <начало>-<конец>/<размер> — дописать часть;
+#   GET /api/v1/uploads/<id> — сколько байт уже получено (offset), с него и продолжается загрузка после обрыва;
+#   POST /api/v1/uploads/<id>/finalize — проверить изображение и перенести его в хранилище по содержимому.
+# Части пишутся во временный файл по мере чтения тела запроса буфером COPY_BUFFER, поэтому память
+# на загрузку не зависит ни от размера части, ни от размера файла.
+
+UPLOAD_PREFIX = 'upload:'
+
+# Размер буфера при копировании тела запроса в файл
+COPY_BUFFER = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status_code=400, offset=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+def get_upload_dir():
+    return getattr(settings, 'PEREVAL_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'uploads'))
+
+
+def get_ttl():
+    # Сколько секунд живёт загрузка (незавершённая или не использованная в submitData)
+    return getattr(settings, 'PEREVAL_UPLOAD_TTL', 24 * 3600)
+
+
+def get_max_chunk():
+    return getattr(settings, 'PEREVAL_UPLOAD_MAX_CHUNK', 8 * 1024 * 1024)
+
+
+def part_path(upload_id):
+    return os.path.join(get_upload_dir(), f'{upload_id.hex}.part')
+
+
+def reference(upload):
+    return f'{UPLOAD_PREFIX}{upload.id}'
+
+
+def is_reference(data):
+    return isinstance(data, str) and data.startswith(UPLOAD_PREFIX)
+
+
+def parse_reference(data):
+    # upload:<id> -> UUID; ValueError для некорректного id
+    return uuid.UUID(data[len(UPLOAD_PREFIX):])
+
+
+def submitted_ids(items):
+    # id загрузок из ещё не проверенных данных submitData (для предварительной выборки одним запросом)
+    ids = set()
+    for item in items:
+        image_list = item.get('images') if isinstance(item, dict) else None
+        for image_data in image_list if isinstance(image_list, list) else []:
+            data = image_data.get('data') if isinstance(image_data, dict) else None
+            if is_reference(data):
+                try:
+                    ids.add(parse_reference(data))
+                except ValueError:
+                    pass
+    return ids
+
+
+def completed(ids):
+    # Завершённые и ещё не использованные загрузки: {id: ImageUpload}
+    return ImageUpload.objects.filter(id__in=ids, status='complete', expires_at__gt=timezone.now()) \
+        .select_related('blob').in_bulk()
+
+
+def known(items):
+    # Загрузки, упомянутые в данных submitData: при проверке сериализатором к БД уже не обращаемся
+    ids = submitted_ids(items)
+    return completed(ids) if ids else {}
+
+
+async def aknown(items):
+    ids = submitted_ids(items)
+    if not ids:
+        return {}
+    queryset = ImageUpload.objects.filter(id__in=ids, status='complete', expires_at__gt=timezone.now())
+    return {upload.id: upload async for upload in queryset.select_related('blob')}
+
+
+def create(size):
+    max_bytes = getattr(settings, 'PEREVAL_IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+    if not 0 < size <= max_bytes:
+        raise UploadError(f'Размер должен быть от 1 до {max_bytes} байт')
+    os.makedirs(get_upload_dir(), exist_ok=True)
+    upload = ImageUpload.objects.create(size=size, expires_at=timezone.now() + timedelta(seconds=get_ttl()))
+    open(part_path(upload.id), 'wb').close()
+    return upload
+
+
+def parse_content_range(value, upload):
+    # Content-Range: bytes <начало>-<конец включительно>/<полный размер> -> (начало, длина)
+    match = CONTENT_RANGE_RE.match(value or '')
+    if not match:
+        raise UploadError('Ожидается заголовок Content-Range: bytes <начало>-<конец>/<размер>')
+    start, end, total = map(int, match.groups())
+    if total != upload.size or end < start or end >= upload.size:
+        raise UploadError(f'Диапазон выходит за размер загрузки ({upload.size} байт)', status_code=416)
+    if end - start + 1 > get_max_chunk():
+        raise UploadError(f'Часть больше {get_max_chunk()} байт', status_code=413)
+    return start, end - start + 1
+
+
+def write_chunk(upload, start, length, stream):
+    # Дописывает в файл байты [start, start + length) из stream и возвращает новый offset.
+    # Часть может начинаться раньше offset (повтор после обрыва) — уже полученные байты пропускаются;
+    # начинаться позже offset нельзя: в файле остался бы пропуск.
+    if upload.status != 'open':
+        raise UploadError('Загрузка уже завершена', status_code=409, offset=upload.offset)
+    if start > upload.offset:
+        raise UploadError(f'Ожидается часть, начинающаяся не позже байта {upload.offset}',
+                          status_code=409, offset=upload.offset)
+
+    skip = upload.offset - start
+    remaining = length
+    written = 0
+    try:
+        with open(part_path(upload.id), 'r+b') as part:
+            part.seek(upload.offset)
+            try:
+                while remaining:
+                    chunk = stream.read(min(COPY_BUFFER, remaining)) if stream is not None else b''
+                    if not chunk:
+                        break  # Тело короче Content-Range: сохраняем то, что успели получить
+                    remaining -= len(chunk)
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        skip -= dropped
+                        chunk = chunk[dropped:]
+                    part.write(chunk)
+                    written += len(chunk)
+            finally:
+                # offset в БД не должен опережать данные на диске
+                part.flush()
+                os.fsync(part.fileno())
+    finally:
+        # Полученное сохраняется и при обрыве соединения: повторять придётся только недостающие байты.
+        # Условие на offset защищает от параллельной записи той же части.
+        if written and not ImageUpload.objects.filter(id=upload.id, offset=upload.offset, status='open').update(
+                offset=F('offset') + written):
+            upload.refresh_from_db()
+            raise UploadError('Часть уже записана параллельным запросом', status_code=409, offset=upload.offset)
+    upload.offset += written
+    return upload.offset
+
+
+def verify(part):
+    # Проверка через Pillow (читает файл, а не загружает его в память целиком); возвращает расширение
+    try:
+        with Image.open(part) as img:
+            img.verify()
+            image_format = img.format
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as exc:
+        raise UploadError(f'Файл не является изображением: {exc}')
+    if image_format not in images.ALLOWED_FORMATS:
+        raise UploadError(f'Формат {image_format} не поддерживается')
+    return images.ALLOWED_FORMATS[image_format]
+
+
+def finalize(upload):
+    # Завершение загрузки: проверка, перенос в хранилище по содержимому (одинаковые файлы хранятся один раз).
+    # Повторный вызов для завершённой загрузки ничего не делает.
+    if upload.status != 'open':
+        if upload.status == 'used':
+            raise UploadError('Загрузка уже использована', status_code=409)
+        return upload
+    if upload.offset != upload.size:
+        raise UploadError(f'Получено {upload.offset} из {upload.size} байт', status_code=409, offset=upload.offset)
+
+    path = part_path(upload.id)
+    with open(path, 'rb') as part:
+        extension = verify(part)
+        digest, _ = blobs.acquire(File(part), extension)
+
+    with transaction.atomic():
+        if not ImageUpload.objects.filter(id=upload.id, status='open').update(status='complete', blob=digest):
+            images.release_blob(digest)  # Загрузку одновременно завершил другой запрос
+    remove_part(path)
+    upload.refresh_from_db()
+    return upload
+
+
+def remove_part(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def consume(uploads):
+    # Изображения забирают ссылки загрузок на файлы; каждую загрузку можно использовать один раз
+    # (повтор id в списке — тоже ошибка). Вызывается в транзакции создания изображений.
+    ids = [upload.id for upload in uploads]
+    if ids and ImageUpload.objects.filter(id__in=ids, status='complete').update(
+            status='used', blob=None) != len(ids):
+        raise UploadError('Загрузка уже использована')
+
+
+def purge(now=None):
+    # Удаляет просроченные загрузки: временные файлы незавершённых и ссылки на файлы неиспользованных
+    expired = ImageUpload.objects.filter(expires_at__lte=now or timezone.now())
+    with transaction.atomic(), images.batched_file_cleanup():
+        rows = list(expired.select_for_update().values_list('id', 'status', 'blob_id'))
+        for _, upload_status, blob_id in rows:
+            if upload_status == 'complete' and blob_id:
+                images.release_blob(blob_id)
+        ImageUpload.objects.filter(id__in=[upload_id for upload_id, _, _ in rows]).delete()
+    for upload_id, upload_status, _ in rows:
+        if upload_status == 'open':
+            remove_part(part_path(upload_id))
+    return len(rows)
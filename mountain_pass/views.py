@@ -1,11 +1,72 @@
-from django.shortcuts import render
+import itertools
+import json
+import math
+
+from django.conf import settings
+from django.db.models import ExpressionWrapper, FloatField, Q, Value
+from django.db.models.functions import Abs, Cast, Least
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.utils import timezone
+from django.views.decorators.http import require_GET
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.generics import CreateAPIView, ListAPIView, RetrieveUpdateAPIView
 from rest_framework.views import APIView
 
-from .models import PerevalAdded
-from .serializers import PerevalAddedSerializer, PerevalDetailSerializer
+from . import (changes, clusters, db_metrics, export, geo, idempotency, instrumentation, moderation, response_cache,
+               search, thumbnails, uploads)
+from .models import ImageUpload, Level, PerevalAdded, PerevalAreas, PerevalCluster, PerevalImage, User
+from .pagination import KeysetPagination
+from .parsers import NDJSONParser
+from .serializers import (ImageUploadSerializer, PerevalAddedSerializer, PerevalChangeSerializer,
+                          PerevalDetailSerializer, PerevalMapSerializer, PerevalModerationSerializer,
+                          PerevalNotEditable)
+
+# Максимальное число перевалов в одном пакетном запросе
+BULK_SUBMIT_MAX_ITEMS = getattr(settings, 'BULK_SUBMIT_MAX_ITEMS', 1000)
+
+# Размер порции при потоковой выдаче списка перевалов
+STREAM_CHUNK_SIZE = getattr(settings, 'STREAM_CHUNK_SIZE', 500)
+
+
+def submitted_emails(items):
+    # email отправителей из ещё не проверенных данных submitData
+    return {
+        item['user'].get('email') for item in items
+        if isinstance(item, dict) and isinstance(item.get('user'), dict)
+        and isinstance(item['user'].get('email'), str)
+    }
+
+
+def idempotent(request, handler):
+    # С заголовком Idempotency-Key повтор запроса возвращает сохранённый ответ, не выполняя handler
+    # (см. mountain_pass/idempotency.py); без заголовка handler просто выполняется
+    key = request.headers.get(idempotency.HEADER)
+    if key is None:
+        return handler()
+    request_fingerprint = idempotency.fingerprint(request.path, request.data)
+
+    def run():
+        response = handler()
+        return response.status_code, response.data
+
+    try:
+        status_code, payload, replayed = idempotency.run(key, request_fingerprint, run)
+    except idempotency.IdempotencyError as e:
+        return Response({
+            "status": e.status_code,
+            "message": str(e),
+        }, status=e.status_code)
+    response = Response(payload, status=status_code)
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
 
 
 # Обработка POST-запроса для создания записи
@@ -13,7 +74,11 @@ class PerevalCreateView(CreateAPIView):
     serializer_class = PerevalAddedSerializer
 
     def post(self, request, *args, **kwargs):
-        serializer = PerevalAddedSerializer(data=request.data)
+        return idempotent(request, lambda: self.submit(request.data))
+
+    @staticmethod
+    def submit(data):
+        serializer = PerevalAddedSerializer(data=data)
         if serializer.is_valid():
             try:
                 pereval_added = serializer.save()
@@ -37,6 +102,78 @@ class PerevalCreateView(CreateAPIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
+# Обработка пакетного POST-запроса: JSON-массив или NDJSON-поток записей в формате submitData
+class PerevalBulkCreateView(APIView):
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request, *args, **kwargs):
+        return idempotent(request, lambda: self.submit(request))
+
+    def submit(self, request):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({
+                "status": 400,
+                "message": "Bad Request (ожидается непустой массив записей)",
+                "results": []
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(items) > BULK_SUBMIT_MAX_ITEMS:
+            return Response({
+                "status": 400,
+                "message": f"Bad Request (не более {BULK_SUBMIT_MAX_ITEMS} записей в одном запросе)",
+                "results": []
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Всех упомянутых пользователей загружаем заранее (кеш и один запрос), чтобы валидация не ходила в БД
+        # на каждую запись
+        context = {
+            'request': request,
+            'known_users': User.objects.resolve_many(submitted_emails(items)),
+            'known_uploads': uploads.known(items),
+        }
+
+        results = []
+        valid_items = []
+        used_uploads = set()  # Загрузка (upload:<id>) может попасть только в одну запись пакета
+        for item in items:
+            serializer = PerevalAddedSerializer(data=item, context=context)
+            if serializer.is_valid():
+                upload_ids = {image_data['upload'].id for image_data in serializer.validated_data['images']
+                              if 'upload' in image_data}
+                if upload_ids & used_uploads:
+                    results.append({"id": None, "errors": {
+                        "images": ["Загрузка уже использована в другой записи пакета."]}})
+                    continue
+                used_uploads |= upload_ids
+                results.append({"id": None})
+                valid_items.append((len(results) - 1, serializer.validated_data))
+            else:
+                results.append({"id": None, "errors": serializer.errors})
+
+        if valid_items:
+            try:
+                list_serializer = PerevalAddedSerializer(many=True, context=context)
+                perevals = list_serializer.create([validated_data for _, validated_data in valid_items])
+            except Exception as e:
+                return Response({
+                    "status": 500,
+                    "message": f"Ошибка при выполнении операции: {str(e)}",
+                    "results": []
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            for (index, _), pereval in zip(valid_items, perevals):
+                results[index]["id"] = pereval.id
+
+        return Response({
+            "status": 200,
+            "message": "успех" if len(valid_items) == len(items) else "часть записей не прошла проверку",
+            "created": len(valid_items),
+            "failed": len(items) - len(valid_items),
+            "results": results
+        }, status=status.HTTP_200_OK)
+
+
 # Обработка GET и PATCH-запросов для получения и редактирования записи
 class PerevalDetailUpdateView(RetrieveUpdateAPIView):
     serializer_class = PerevalAddedSerializer
@@ -48,8 +185,8 @@ class PerevalDetailUpdateView(RetrieveUpdateAPIView):
 
         # Если id передан, фильтруем по нему, иначе возвращаем все объекты
         if pereval_id:
-            return PerevalAdded.objects.filter(id=pereval_id)
-        return PerevalAdded.objects.all()
+            return PerevalAdded.objects.with_related().filter(id=pereval_id)
+        return PerevalAdded.objects.with_related()
 
     def get_object(self):
         # Переопределяем get_object, чтобы управлять поведением, когда объект не найден
@@ -61,6 +198,13 @@ class PerevalDetailUpdateView(RetrieveUpdateAPIView):
             return None
 
     def get(self, request, *args, **kwargs):
+        # Готовый ответ берём из кеша; он сбрасывается при изменении перевала (см. response_cache.py)
+        key = response_cache.detail_key(self.kwargs[self.lookup_field])
+        cached = response_cache.get(key)
+        if cached is not None:
+            etag, payload = cached
+            return response_cache.respond(request, payload, etag)
+
         pereval = self.get_object()  # Используем наш переопределенный метод
         if pereval is None:
             return Response({
@@ -70,11 +214,12 @@ class PerevalDetailUpdateView(RetrieveUpdateAPIView):
             }, status=status.HTTP_404_NOT_FOUND)
 
         serializer = PerevalDetailSerializer(pereval)  # Используем другой сериализатор для GET запроса
-        return Response({
+        payload = {
             "status": 200,
             "message": "успех",
             "data": serializer.data
-        }, status=status.HTTP_200_OK)
+        }
+        return response_cache.respond(request, payload, response_cache.store(key, payload))
 
     def patch(self, request, *args, **kwargs):
         pereval = self.get_object()
@@ -85,23 +230,30 @@ class PerevalDetailUpdateView(RetrieveUpdateAPIView):
                 "data": None
             }, status=status.HTTP_404_NOT_FOUND)
 
-        # Проверяем статус
+        # Проверяем статус (окончательно — под блокировкой строки при сохранении)
         if pereval.status != 'new':
-            return Response({
-                "state": 0,
-                "message": "Редактирование доступно только для записей со статусом 'new'."
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return self.not_editable()
 
         # Получаем сериализатор с данными запроса
         serializer = self.get_serializer(pereval, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        try:
+            self.perform_update(serializer)
+        except PerevalNotEditable:
+            return self.not_editable()
 
         return Response({
             "state": 1,
             "message": "Запись успешно отредактирована."
         }, status=status.HTTP_200_OK)
 
+    @staticmethod
+    def not_editable():
+        return Response({
+            "state": 0,
+            "message": "Редактирование доступно только для записей со статусом 'new'."
+        }, status=status.HTTP_400_BAD_REQUEST)
+
 
 # Обработка GET-запроса для получения записи (в данном случае по email)
 class PerevalListByEmailView(ListAPIView):
@@ -110,28 +262,592 @@ class PerevalListByEmailView(ListAPIView):
     def get_queryset(self):
         email = self.request.query_params.get('user__email', None)  # Получаем email из параметров запроса
         if email:
-            return PerevalAdded.objects.filter(user__email=email)
+            return PerevalAdded.objects.with_related().filter(user__email=email)
         return PerevalAdded.objects.none()  # Возвращаем пустой queryset, если email не указан
 
     def get(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
+        stream = request.query_params.get('stream') in ('1', 'true')
+        if stream:
+            return self.build_response(request, stream)
+
+        # Обычные (не потоковые) ответы кешируются по email и параметрам страницы
+        email = request.query_params.get('user__email')
+        if not email:
+            return self.build_response(request, stream)
+
+        key = response_cache.list_key(email, {
+            name: request.query_params.get(name)
+            for name in (KeysetPagination.cursor_query_param, KeysetPagination.limit_query_param)
+        })
+        cached = response_cache.get(key)
+        if cached is not None:
+            etag, payload = cached
+            return response_cache.respond(request, payload, etag)
+
+        response = self.build_response(request, stream)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        return response_cache.respond(request, response.data, response_cache.store(key, response.data))
+
+    def build_response(self, request, stream):
+        queryset = self.get_queryset().order_by(*KeysetPagination.ordering)
+
+        # Постраничная выдача включается параметрами cursor/limit, без них возвращаются все записи
+        paginator = None
+        if KeysetPagination.cursor_query_param in request.query_params \
+                or KeysetPagination.limit_query_param in request.query_params:
+            paginator = KeysetPagination()
+            perevals = iter(paginator.paginate_queryset(queryset, request, view=self))
+        elif stream:
+            # Читаем записи порциями, не загружая весь список в память
+            perevals = queryset.iterator(chunk_size=STREAM_CHUNK_SIZE)
+        else:
+            # Выполняем запрос сразу: отдельный exists() был бы лишним запросом к БД
+            perevals = iter(list(queryset))
 
         # Проверяем, найден ли хотя бы один объект
-        if not queryset.exists():
+        first = next(perevals, None)
+        if first is None:
             return Response({
                 "status": 404,
                 "message": "Email не найден или записи отсутствуют",
                 "data": []
             }, status=status.HTTP_404_NOT_FOUND)
+        perevals = itertools.chain([first], perevals)
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response({
+        if stream:
+            return StreamingHttpResponse(
+                self.stream_json(perevals, paginator), content_type='application/json')
+
+        serializer = self.get_serializer(perevals, many=True)
+        payload = {
             "status": 200,
             "message": "успех",
             "data": serializer.data
+        }
+        if paginator is not None:
+            payload["next"] = paginator.next_cursor
+        return Response(payload, status=status.HTTP_200_OK)
+
+    def stream_json(self, perevals, paginator=None):
+        # Ответ собирается по одной записи: память не зависит от числа перевалов,
+        # а первые байты уходят клиенту сразу после первой порции из БД
+        yield '{"status": 200, "message": "успех", "data": ['
+        for index, pereval in enumerate(perevals):
+            item = json.dumps(self.get_serializer(pereval).data, cls=JSONEncoder, ensure_ascii=False)
+            yield item if index == 0 else ',' + item
+        yield ']'
+        if paginator is not None:
+            yield ', "next": ' + json.dumps(paginator.next_cursor)
+        yield '}'
+
+
+# Уменьшенная копия изображения: создаётся при первом обращении, дальше отдаётся из хранилища
+class PerevalImageThumbnailView(APIView):
+    def get(self, request, id, size, *args, **kwargs):
+        image = get_object_or_404(PerevalImage, id=id)
+        try:
+            name = thumbnails.get_or_create_variant(image, size)
+        except thumbnails.ThumbnailError as e:
+            return Response({
+                "status": 404,
+                "message": str(e),
+            }, status=status.HTTP_404_NOT_FOUND)
+        return redirect(image.data.storage.url(name))
+
+
+def upload_response(upload, status_code=status.HTTP_200_OK):
+    return Response({
+        "status": status_code,
+        "message": "успех",
+        "data": ImageUploadSerializer(upload).data
+    }, status=status_code)
+
+
+def upload_error(exc):
+    # offset — с какого байта продолжать загрузку (для ошибок, связанных с положением части)
+    return Response({
+        "status": exc.status_code,
+        "message": str(exc),
+        "offset": exc.offset
+    }, status=exc.status_code)
+
+
+# POST {"size": <байт>}: начать загрузку изображения по частям (см. mountain_pass/uploads.py)
+class ImageUploadCreateView(APIView):
+    def post(self, request, *args, **kwargs):
+        size = request.data.get('size') if isinstance(request.data, dict) else None
+        if not isinstance(size, int) or isinstance(size, bool):
+            raise ValidationError({'size': 'Ожидается целое число байт.'})
+        try:
+            upload = uploads.create(size)
+        except uploads.UploadError as e:
+            return upload_error(e)
+        return upload_response(upload, status.HTTP_201_CREATED)
+
+
+class ImageUploadBaseView(APIView):
+    @staticmethod
+    def get_upload(id):
+        # Просроченные загрузки ещё не удалены командой purge_uploads, но уже недоступны
+        try:
+            return ImageUpload.objects.get(id=id, expires_at__gt=timezone.now())
+        except ImageUpload.DoesNotExist:
+            raise Http404
+
+
+# GET: состояние загрузки (offset — сколько байт получено); PUT с Content-Range: дописать часть.
+# Тело PUT не разбирается парсерами DRF, а копируется в файл по мере чтения.
+class ImageUploadView(ImageUploadBaseView):
+    def get(self, request, id, *args, **kwargs):
+        return upload_response(self.get_upload(id))
+
+    def put(self, request, id, *args, **kwargs):
+        upload = self.get_upload(id)
+        try:
+            start, length = uploads.parse_content_range(request.headers.get('Content-Range'), upload)
+            uploads.write_chunk(upload, start, length, request.stream)
+        except uploads.UploadError as e:
+            return upload_error(e)
+        return upload_response(upload)
+
+
+# POST: завершить загрузку; в ответе reference — значение для поля data изображения в submitData
+class ImageUploadFinalizeView(ImageUploadBaseView):
+    def post(self, request, id, *args, **kwargs):
+        try:
+            upload = uploads.finalize(self.get_upload(id))
+        except uploads.UploadError as e:
+            return upload_error(e)
+        return upload_response(upload)
+
+
+# Поиск перевалов по области карты (bbox) или в радиусе от точки
+class PerevalGeoSearchView(APIView):
+    default_limit = 500
+    max_limit = 5000
+    # Поиск по кругу: наибольший радиус (км) и сколько кандидатов на одну запись результата читается из БД
+    max_radius_km = 1000
+    radius_candidates_factor = 2
+
+    @staticmethod
+    def parse_float(value, name, low, high):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValidationError({name: 'Ожидается число.'})
+        if not low <= value <= high:
+            raise ValidationError({name: f'Значение должно быть в диапазоне [{low}, {high}].'})
+        return value
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается целое число.'})
+        return max(1, min(limit, self.max_limit))
+
+    def get_area(self, request):
+        # Возвращает список прямоугольников (min_lat, min_lon, max_lat, max_lon) и центр с радиусом для поиска
+        # по кругу. Круг, пересекающий антимеридиан, покрывается двумя прямоугольниками.
+        params = request.query_params
+        if 'bbox' in params:
+            parts = params['bbox'].split(',')
+            if len(parts) != 4:
+                raise ValidationError({'bbox': 'Ожидается bbox=min_lon,min_lat,max_lon,max_lat.'})
+            min_lon, max_lon = (self.parse_float(parts[i], 'bbox', -180, 180) for i in (0, 2))
+            min_lat, max_lat = (self.parse_float(parts[i], 'bbox', -90, 90) for i in (1, 3))
+            if min_lat > max_lat or min_lon > max_lon:
+                raise ValidationError({'bbox': 'Минимальные координаты больше максимальных.'})
+            return [(min_lat, min_lon, max_lat, max_lon)], None
+
+        if 'lat' in params and 'lon' in params and 'radius' in params:
+            latitude = self.parse_float(params['lat'], 'lat', -90, 90)
+            longitude = self.parse_float(params['lon'], 'lon', -180, 180)
+            radius = self.parse_float(params['radius'], 'radius', 0, self.max_radius_km)
+            return geo.radius_bboxes(latitude, longitude, radius), (latitude, longitude, radius)
+
+        raise ValidationError({'detail': 'Укажите bbox=min_lon,min_lat,max_lon,max_lat или lat, lon и radius (км).'})
+
+    @staticmethod
+    def approx_distance(latitude, longitude):
+        # Квадрат расстояния в градусах широты: монотонен по расстоянию для небольших радиусов.
+        # Разница долгот берётся по кратчайшей дуге — через антимеридиан, если так ближе.
+        dlat = Cast('coords__latitude', FloatField()) - Value(latitude)
+        dlon = Abs(Cast('coords__longitude', FloatField()) - Value(longitude))
+        dlon = Least(dlon, Value(360.0) - dlon) * Value(math.cos(math.radians(latitude)))
+        return ExpressionWrapper(dlat * dlat + dlon * dlon, output_field=FloatField())
+
+    @staticmethod
+    def area_filter(boxes):
+        area_filter = Q()
+        for min_lat, min_lon, max_lat, max_lon in boxes:
+            box_filter = Q(coords__latitude__range=(min_lat, max_lat), coords__longitude__range=(min_lon, max_lon))
+            # Сужаем выборку по индексу геохеша; точная проверка границ — условием выше
+            prefixes = geo.cover_bbox(min_lat, min_lon, max_lat, max_lon)
+            if prefixes:
+                prefix_filter = Q()
+                for prefix in prefixes:
+                    prefix_filter |= Q(coords__geohash__startswith=prefix)
+                box_filter &= prefix_filter
+            area_filter |= box_filter
+        return area_filter
+
+    def get(self, request, *args, **kwargs):
+        boxes, circle = self.get_area(request)
+        limit = self.get_limit(request)
+
+        queryset = PerevalAdded.objects.select_related('coords', 'level').filter(self.area_filter(boxes))
+
+        pereval_status = request.query_params.get('status')
+        if pereval_status:
+            queryset = queryset.filter(status=pereval_status)
+
+        if circle is None:
+            perevals = list(queryset.order_by('id')[:limit])
+            data = PerevalMapSerializer(perevals, many=True).data
+        else:
+            # В БД — сортировка по приближённому расстоянию (плоская проекция с масштабом долготы в центре)
+            # и ограниченное число кандидатов; точное расстояние по формуле гаверсинуса — только для них.
+            # Ближайшие перевалы — первыми.
+            latitude, longitude, radius = circle
+            queryset = queryset.annotate(approx_distance=self.approx_distance(latitude, longitude)) \
+                .order_by('approx_distance', 'id')[:limit * self.radius_candidates_factor]
+            found = []
+            for pereval in queryset:
+                distance = geo.haversine_km(latitude, longitude, pereval.coords.latitude, pereval.coords.longitude)
+                if distance <= radius:
+                    found.append((distance, pereval))
+            found.sort(key=lambda item: item[0])
+            data = []
+            for distance, pereval in found[:limit]:
+                item = PerevalMapSerializer(pereval).data
+                item['distance_km'] = round(distance, 3)
+                data.append(item)
+
+        return Response({
+            "status": 200,
+            "message": "успех",
+            "data": data
         }, status=status.HTTP_200_OK)
 
 
+# Агрегаты перевалов по ячейкам сетки для обзорной карты: число, центр и преобладающая сложность
+class PerevalClusterView(PerevalGeoSearchView):
+    def get(self, request, *args, **kwargs):
+        try:
+            zoom = int(request.query_params.get('zoom', ''))
+        except ValueError:
+            raise ValidationError({'zoom': 'Ожидается целое число.'})
+        if not clusters.MIN_ZOOM <= zoom <= clusters.MAX_ZOOM:
+            raise ValidationError({'zoom': f'Значение должно быть в диапазоне [{clusters.MIN_ZOOM}, {clusters.MAX_ZOOM}].'})
+
+        boxes, _ = self.get_area(request)
+        cell_filter = Q()
+        for min_lat, min_lon, max_lat, max_lon in boxes:
+            # В Web Mercator номер строки растёт к югу
+            min_x, min_y = clusters.tile(max_lat, min_lon, zoom)
+            max_x, max_y = clusters.tile(min_lat, max_lon, zoom)
+            cell_filter |= Q(cell_x__range=(min_x, max_x), cell_y__range=(min_y, max_y))
+
+        cells = PerevalCluster.objects.filter(cell_filter, zoom=zoom, count__gt=0)
+
+        data = [{
+            "cell": [cell.cell_x, cell.cell_y],
+            "count": cell.count,
+            "latitude": round(cell.latitude_sum / cell.count, 6),
+            "longitude": round(cell.longitude_sum / cell.count, 6),
+            "difficulty": clusters.dominant_difficulty(cell),
+        } for cell in cells]
+
+        return Response({
+            "status": 200,
+            "message": "успех",
+            "zoom": zoom,
+            "data": data
+        }, status=status.HTTP_200_OK)
+
+
+# Поиск перевалов по статусу, сложности в заданный сезон, району и виду активности
+class PerevalFilterView(APIView):
+    def get_queryset(self, params):
+        queryset = PerevalAdded.objects.select_related('coords', 'level')
+
+        if params.get('status'):
+            statuses = params['status'].split(',')
+            allowed = {value for value, _ in PerevalAdded.CHOICE_STATUS}
+            if not set(statuses) <= allowed:
+                raise ValidationError({'status': f'Допустимые значения: {", ".join(sorted(allowed))}.'})
+            queryset = queryset.filter(status__in=statuses)
+
+        season = params.get('season')
+        if season:
+            if season not in Level.SEASONS:
+                raise ValidationError({'season': f'Допустимые значения: {", ".join(Level.SEASONS)}.'})
+            # Сравнение категорий — по порядковым номерам (Level.<сезон>_rank) с индексом
+            ranks = {}
+            for param in ('min_level', 'max_level'):
+                if params.get(param):
+                    try:
+                        ranks[param] = Level.rank(params[param])
+                    except ValueError:
+                        raise ValidationError({param: 'Неизвестная категория сложности.'})
+            queryset = queryset.filter(**{f'level__{season}_rank__range': (
+                max(ranks.get('min_level', 1), 1), ranks.get('max_level', len(Level.CHOICE_LEVEL) - 1))})
+        elif params.get('min_level') or params.get('max_level'):
+            raise ValidationError({'season': 'Укажите сезон для фильтра по сложности.'})
+
+        if params.get('area'):
+            try:
+                queryset = queryset.filter(area_id=int(params['area']))
+            except ValueError:
+                raise ValidationError({'area': 'Ожидается целое число.'})
+
+        if params.get('activities'):
+            try:
+                activity_ids = [int(value) for value in params['activities'].split(',')]
+            except ValueError:
+                raise ValidationError({'activities': 'Ожидается список целых чисел через запятую.'})
+            # Подзапрос вместо JOIN: перевал с несколькими подходящими видами активности не дублируется
+            queryset = queryset.filter(id__in=PerevalAdded.activities.through.objects.filter(
+                spractivitiestypes_id__in=activity_ids).values('perevaladded_id'))
+
+        return queryset
+
+    def get(self, request, *args, **kwargs):
+        paginator = KeysetPagination()
+        perevals = paginator.paginate_queryset(self.get_queryset(request.query_params), request, view=self)
+        return Response({
+            "status": 200,
+            "message": "успех",
+            "data": PerevalMapSerializer(perevals, many=True).data,
+            "next": paginator.next_cursor
+        }, status=status.HTTP_200_OK)
+
+
+def area_not_found():
+    return Response({
+        "status": 404,
+        "message": "Район не найден.",
+        "data": None
+    }, status=status.HTTP_404_NOT_FOUND)
+
+
+# Дерево районов перевалов (целиком или поддерево ?root=<id>) из кеша в памяти процесса
+class PerevalAreaTreeView(APIView):
+    def get(self, request, *args, **kwargs):
+        tree = PerevalAreas.objects.tree()
+        root = request.query_params.get('root')
+        if root:
+            try:
+                root = int(root)
+            except ValueError:
+                raise ValidationError({'root': 'Ожидается целое число.'})
+            if root not in tree:
+                return area_not_found()
+        return Response({
+            "status": 200,
+            "message": "успех",
+            "data": tree.as_list(root or None)
+        }, status=status.HTTP_200_OK)
+
+
+# Перевалы района вместе со всеми подрайонами: один запрос по материализованному пути (area.path LIKE '<путь>%'),
+# путь района берётся из дерева в памяти. Остальные фильтры и постраничная выдача — как у PerevalFilterView.
+class PerevalAreaPassesView(PerevalFilterView):
+    def get(self, request, id, *args, **kwargs):
+        self.area_tree = PerevalAreas.objects.tree()
+        if id not in self.area_tree:
+            return area_not_found()
+        return super().get(request, id, *args, **kwargs)
+
+    def get_queryset(self, params):
+        return super().get_queryset(params).filter(area__path__startswith=self.area_tree.path(self.kwargs['id']))
+
+
+# Нечёткий поиск перевалов по названию (title, beauty_title, other_titles) с ранжированием
+class PerevalSearchView(APIView):
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'Укажите строку поиска.'})
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', self.default_limit)), self.max_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается целое число.'})
+
+        data = []
+        for pereval, similarity in search.search(query, limit=limit):
+            item = PerevalMapSerializer(pereval).data
+            item['score'] = round(similarity, 3)
+            data.append(item)
+
+        return Response({
+            "status": 200,
+            "message": "успех",
+            "data": data
+        }, status=status.HTTP_200_OK)
+
+
+# Очередь модерации (mountain_pass/moderation.py); доступна сотрудникам (is_staff)
+class ModerationView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @staticmethod
+    def parse_ids(data, required=True):
+        ids = data.get('ids')
+        if ids is None and not required:
+            return None
+        if not isinstance(ids, list) or not all(isinstance(value, int) for value in ids):
+            raise ValidationError({'ids': 'Ожидается список id перевалов.'})
+        return ids
+
+    def claimed_response(self, request, message="успех"):
+        perevals = moderation.claimed(request.user)
+        return Response({
+            "status": 200,
+            "message": message,
+            "data": PerevalModerationSerializer(perevals, many=True).data
+        }, status=status.HTTP_200_OK)
+
+
+# GET: записи, которые модератор взял в работу; POST {"limit": n}: взять из очереди ещё n записей
+class ModerationClaimView(ModerationView):
+    default_limit = 10
+
+    def get(self, request, *args, **kwargs):
+        return self.claimed_response(request)
+
+    def post(self, request, *args, **kwargs):
+        limit = request.data.get('limit', self.default_limit)
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            raise ValidationError({'limit': 'Ожидается целое число больше нуля.'})
+        claimed = moderation.claim(request.user, limit)
+        return self.claimed_response(request, message=f"взято в работу: {len(claimed)}")
+
+
+# POST {"ids": [...], "status": "accepted" | "rejected"}: решение по записям, взятым модератором
+class ModerationDecideView(ModerationView):
+    def post(self, request, *args, **kwargs):
+        ids = self.parse_ids(request.data)
+        decision = request.data.get('status')
+        if decision not in moderation.DECISIONS:
+            raise ValidationError({'status': f'Допустимые значения: {", ".join(moderation.DECISIONS)}.'})
+        changed = moderation.decide(request.user, ids, decision)
+        return Response({
+            "status": 200,
+            "message": "успех",
+            "updated": changed,
+            "skipped": sorted(set(ids) - set(changed))  # Не в работе у этого модератора
+        }, status=status.HTTP_200_OK)
+
+
+# POST {"ids": [...]}: вернуть записи в очередь (без ids — все записи модератора)
+class ModerationReleaseView(ModerationView):
+    def post(self, request, *args, **kwargs):
+        ids = self.parse_ids(request.data, required=False)
+        released = moderation.release(request.user, ids)
+        return Response({
+            "status": 200,
+            "message": "успех",
+            "updated": released
+        }, status=status.HTTP_200_OK)
+
+
+# Счётчики соединений с БД: переиспользование постоянных соединений, переподключения, статистика пула.
+# Как и /metrics, доступны при PEREVAL_METRICS_ENABLED, иначе — только персоналу.
+class DatabaseMetricsView(APIView):
+    def get(self, request, *args, **kwargs):
+        if not settings.PEREVAL_METRICS_ENABLED and not request.user.is_staff:
+            raise Http404
+        return Response({
+            "status": 200,
+            "message": "успех",
+            "data": db_metrics.snapshot()
+        }, status=status.HTTP_200_OK)
+
+
+# Лента изменений для синхронизации клиентов: ?since=<токен>&user__email=<email>&limit=<число>.
+# Возвращает только перевалы, изменённые после токена (текущее состояние или признак удаления),
+# и токен для следующего запроса. Без user__email — лента всех перевалов, только для персонала.
+class PerevalChangesView(APIView):
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        try:
+            since = changes.parse_token(params.get('since'))
+        except ValueError:
+            raise ValidationError({'since': 'Некорректный токен.'})
+        try:
+            limit = max(1, min(int(params.get('limit', changes.DEFAULT_LIMIT)), changes.MAX_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается целое число.'})
+
+        events, has_more = [], False
+        email = params.get('user__email')
+        # Лента всех перевалов (в том числе новых, на модерации и отклонённых, с контактами отправителей) —
+        # только для персонала; остальным — изменения перевалов одного пользователя
+        if not email and not request.user.is_staff:
+            raise ValidationError({'user__email': 'Обязательный параметр.'})
+        user = User.objects.resolve(email) if email else None
+        if not email or user is not None:
+            events, has_more = changes.feed(since, user.id if user else None, limit)
+
+        entries = changes.collapse(events)
+        perevals = PerevalAdded.objects.with_related().filter(id__in=[entry['id'] for entry in entries])
+        current = {item['id']: item for item in PerevalChangeSerializer(perevals, many=True).data}
+        for entry in entries:
+            entry['deleted'] = entry['id'] not in current
+            entry['data'] = current.get(entry['id'])
+
+        return Response({
+            "status": 200,
+            "message": "успех",
+            "data": entries,
+            "next": str(events[-1].seq if events else since),
+            "has_more": has_more
+        }, status=status.HTTP_200_OK)
+
+
+# Потоковая выгрузка перевалов: ?format=geojson|csv|ndjson&status=<статусы через запятую>&gzip=1.
+# Обычная функция, а не APIView: параметр format в DRF зарезервирован под выбор рендерера.
+@require_GET
+def export_passes(request):
+    export_format = request.GET.get('format', 'geojson')
+    if export_format not in export.FORMATS:
+        return JsonResponse({'format': f'Допустимые значения: {", ".join(export.FORMATS)}.'}, status=400,
+                            json_dumps_params={'ensure_ascii': False})
+    statuses = request.GET.get('status', 'accepted').split(',')
+    allowed = {value for value, _ in PerevalAdded.CHOICE_STATUS}
+    if not set(statuses) <= allowed:
+        return JsonResponse({'status': f'Допустимые значения: {", ".join(sorted(allowed))}.'}, status=400,
+                            json_dumps_params={'ensure_ascii': False})
+    # Публично выгружаются только принятые перевалы; новые, на модерации и отклонённые — только персоналу
+    if set(statuses) != {'accepted'} and not request.user.is_staff:
+        return JsonResponse({'status': 'Перевалы с другими статусами, кроме accepted, выгружаются только '
+                                       'для персонала.'}, status=403, json_dumps_params={'ensure_ascii': False})
+    compress = request.GET.get('gzip') in ('1', 'true')
+
+    chunks = export.stream(export_format, export.get_queryset(statuses), build_url=request.build_absolute_uri,
+                           compress=compress)
+    if isinstance(request, ASGIRequest):
+        chunks = export.aiterate(chunks)
+    filename = f'passes.{export_format}' + ('.gz' if compress else '')
+    response = StreamingHttpResponse(
+        chunks, content_type='application/gzip' if compress else f'{export.FORMATS[export_format]}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# Метрики процесса в текстовом формате Prometheus (включаются PEREVAL_METRICS_ENABLED)
+def metrics(request):
+    if not settings.PEREVAL_METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(instrumentation.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # Главная страница
 def index(request):
     return render(request, 'index.html')
\ No newline at end of file
@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pereval.settings')
+# Асинхронные представления основных методов API (pereval/urls_async.py); FSTR_ASYNC_VIEWS=0 — синхронные
+os.environ.setdefault('FSTR_ASYNC_VIEWS', '1')
+# Постоянные соединения (persistent) привязаны к потоку, а синхронный код под ASGI выполняется в разных потоках:
+# соединения копились бы до истечения FSTR_DB_CONN_MAX_AGE. Поэтому по умолчанию соединение закрывается
+# после запроса; при установленном psycopg[pool] лучше задать FSTR_DB_CONN_MODE=pool
+os.environ.setdefault('FSTR_DB_CONN_MODE', 'close')
 
 application = get_asgi_application()
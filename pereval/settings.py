@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 import os
 import psycopg2
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv, find_dotenv
 from pathlib import Path
 
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'mountain_pass.apps.MountainPassConfig',
 
@@ -51,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mountain_pass.instrumentation.PerformanceMiddleware',  # Первым: замеряет весь запрос
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,7 +63,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'pereval.urls'
+# Под ASGI (FSTR_ASYNC_VIEWS=1, по умолчанию в pereval/asgi.py) основные методы API обслуживают асинхронные представления
+ROOT_URLCONF = 'pereval.urls_async' if os.getenv('FSTR_ASYNC_VIEWS') == '1' else 'pereval.urls'
 
 TEMPLATES = [
     {
@@ -97,6 +101,52 @@ DATABASES = {
     }
 }
 
+# Подключения к БД, FSTR_DB_CONN_MODE:
+# persistent (по умолчанию под WSGI) — соединение переиспользуется между запросами в течение FSTR_DB_CONN_MAX_AGE секунд
+#   и проверяется перед первым использованием в запросе (FSTR_DB_CONN_HEALTH_CHECKS);
+# pool — пул соединений psycopg 3 (нужен пакет psycopg[pool]): FSTR_DB_POOL_MIN_SIZE, FSTR_DB_POOL_MAX_SIZE,
+#   FSTR_DB_POOL_TIMEOUT — сколько секунд ждать свободное соединение. Рекомендуется при запуске через ASGI;
+# close (по умолчанию под ASGI, см. pereval/asgi.py) — новое соединение на каждый запрос.
+DB_CONN_MODE = os.getenv('FSTR_DB_CONN_MODE') or 'persistent'
+if DB_CONN_MODE == 'persistent':
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('FSTR_DB_CONN_MAX_AGE', 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = os.getenv('FSTR_DB_CONN_HEALTH_CHECKS', '1') == '1'
+elif DB_CONN_MODE == 'pool':
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('FSTR_DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('FSTR_DB_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('FSTR_DB_POOL_TIMEOUT', 10)),
+        },
+    }
+elif DB_CONN_MODE != 'close':
+    raise ImproperlyConfigured(f'FSTR_DB_CONN_MODE: ожидается persistent, pool или close, получено {DB_CONN_MODE!r}')
+
+
+# Кеш (в том числе кеш ответов API, см. mountain_pass/response_cache.py).
+# FSTR_CACHE_BACKEND: locmem (по умолчанию, в памяти процесса с вытеснением давно не использованных записей),
+# file (каталог FSTR_CACHE_LOCATION) или redis (адрес FSTR_CACHE_LOCATION, нужен пакет redis).
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[os.getenv('FSTR_CACHE_BACKEND') or 'locmem'],
+        'LOCATION': os.getenv('FSTR_CACHE_LOCATION', ''),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('FSTR_CACHE_MAX_ENTRIES', 10000)),
+        },
+    }
+}
+if os.getenv('FSTR_CACHE_BACKEND') == 'redis':
+    # У RedisCache нет ограничения MAX_ENTRIES: вытеснением управляет сам Redis (maxmemory-policy)
+    CACHES['default']['OPTIONS'] = {}
+
+# Время жизни закешированных ответов API в секундах (0 — не кешировать)
+PEREVAL_RESPONSE_CACHE_TIMEOUT = int(os.getenv('FSTR_RESPONSE_CACHE_TIMEOUT', 3600))
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -141,3 +191,32 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Временные файлы загрузок изображений по частям (api/v1/uploads); каталог должен быть общим для всех процессов
+PEREVAL_UPLOAD_DIR = os.getenv('FSTR_UPLOAD_DIR') or os.path.join(BASE_DIR, 'uploads')
+
+# Файловое хранилище медиафайлов с учётом записанных байт в замерах запроса
+STORAGES = {
+    'default': {'BACKEND': 'mountain_pass.storage.InstrumentedFileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Замеры запросов (mountain_pass/instrumentation.py): заголовок Server-Timing добавляется всегда,
+# строка журнала mountain_pass.performance пишется при FSTR_PERF_LOG_LEVEL=INFO,
+# GET /metrics в формате Prometheus включается FSTR_METRICS_ENABLED=1
+PEREVAL_METRICS_ENABLED = os.getenv('FSTR_METRICS_ENABLED') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'mountain_pass.performance': {
+            'handlers': ['console'],
+            'level': os.getenv('FSTR_PERF_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
@@ -22,7 +22,12 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
 
-from mountain_pass.views import PerevalCreateView, PerevalDetailUpdateView, PerevalListByEmailView, index
+from mountain_pass.views import (PerevalCreateView, PerevalBulkCreateView, PerevalDetailUpdateView,
+                                 PerevalListByEmailView, PerevalImageThumbnailView, PerevalGeoSearchView,
+                                 PerevalClusterView, PerevalFilterView, PerevalSearchView, PerevalAreaTreeView,
+                                 PerevalAreaPassesView, ModerationClaimView, ModerationDecideView,
+                                 ModerationReleaseView, PerevalChangesView, DatabaseMetricsView, ImageUploadCreateView,
+                                 ImageUploadView, ImageUploadFinalizeView, export_passes, index, metrics)
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -43,12 +48,61 @@ urlpatterns = [
     # POST: создание записи
     path('api/v1/submitData', PerevalCreateView.as_view(), name='submit_data'),
 
+    # POST: пакетное создание записей (JSON-массив или NDJSON)
+    path('api/v1/submitData/bulk', PerevalBulkCreateView.as_view(), name='submit_data_bulk'),
+
     # GET: получение записи по id; # PATCH: редактирование записи по id
     path('api/v1/submitData/<int:id>', PerevalDetailUpdateView.as_view(), name='pereval_detail_update'),
 
     # GET: получение записей по email пользователя (...submitData/?user__email=<email>)
     path('api/v1/submitData/', PerevalListByEmailView.as_view(), name='submit_data_by_email'),
 
+    # GET: уменьшенная копия изображения (128, 512 или 1600 px по длинной стороне)
+    path('api/v1/images/<int:id>/thumbnail/<int:size>', PerevalImageThumbnailView.as_view(),
+         name='pereval_image_thumbnail'),
+
+    # Загрузка изображения по частям: POST — начать ({"size": <байт>}), PUT с Content-Range — дописать часть,
+    # GET — сколько байт получено, POST .../finalize — завершить (в submitData: "data": "upload:<id>")
+    path('api/v1/uploads', ImageUploadCreateView.as_view(), name='image_upload_create'),
+    path('api/v1/uploads/<uuid:id>', ImageUploadView.as_view(), name='image_upload'),
+    path('api/v1/uploads/<uuid:id>/finalize', ImageUploadFinalizeView.as_view(), name='image_upload_finalize'),
+
+    # GET: поиск перевалов по области (?bbox=min_lon,min_lat,max_lon,max_lat) или по кругу (?lat=&lon=&radius=)
+    path('api/v1/geo/passes', PerevalGeoSearchView.as_view(), name='pereval_geo_search'),
+
+    # GET: кластеры перевалов для обзорной карты (?zoom=<0..16>&bbox=min_lon,min_lat,max_lon,max_lat)
+    path('api/v1/geo/clusters', PerevalClusterView.as_view(), name='pereval_clusters'),
+
+    # GET: поиск перевалов по статусу, сложности в сезон, району и видам активности
+    path('api/v1/passes', PerevalFilterView.as_view(), name='pereval_filter'),
+
+    # GET: нечёткий поиск перевалов по названию (?q=<строка>)
+    path('api/v1/passes/search', PerevalSearchView.as_view(), name='pereval_search'),
+
+    # GET: дерево районов перевалов (?root=<id> — только поддерево района)
+    path('api/v1/areas', PerevalAreaTreeView.as_view(), name='pereval_area_tree'),
+
+    # GET: перевалы района вместе со всеми подрайонами (фильтры и постраничная выдача как у api/v1/passes)
+    path('api/v1/areas/<int:id>/passes', PerevalAreaPassesView.as_view(), name='pereval_area_passes'),
+
+    # Очередь модерации (для сотрудников): GET — записи в работе у модератора, POST — взять пачку записей new;
+    # принять или отклонить взятые записи; вернуть записи в очередь
+    path('api/v1/moderation/claim', ModerationClaimView.as_view(), name='moderation_claim'),
+    path('api/v1/moderation/decide', ModerationDecideView.as_view(), name='moderation_decide'),
+    path('api/v1/moderation/release', ModerationReleaseView.as_view(), name='moderation_release'),
+
+    # GET: изменения перевалов после токена для синхронизации клиентов (?since=<токен>&user__email=<email>)
+    path('api/v1/changes', PerevalChangesView.as_view(), name='pereval_changes'),
+
+    # GET: потоковая выгрузка перевалов в GeoJSON, CSV или NDJSON (?format=&status=&gzip=1)
+    path('api/v1/export/passes', export_passes, name='export_passes'),
+
+    # GET: счётчики соединений с БД (режим подключения, переподключения, статистика пула)
+    path('api/v1/metrics/db', DatabaseMetricsView.as_view(), name='db_metrics'),
+
+    # GET: гистограммы времени запросов по маршрутам в формате Prometheus (при FSTR_METRICS_ENABLED=1)
+    path('metrics', metrics, name='metrics'),
+
     # Пути для Swagger
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
@@ -0,0 +1,19 @@
+"""
+URL configuration for running under ASGI.
+
+Основные методы API обслуживаются асинхронными представлениями (mountain_pass/async_views.py),
+остальные пути — те же, что в pereval/urls.py. Используется при FSTR_ASYNC_VIEWS=1 (задаётся в pereval/asgi.py).
+"""
+from django.urls import path
+
+from mountain_pass.async_views import (PerevalCreateAsyncView, PerevalDetailUpdateAsyncView,
+                                       PerevalListByEmailAsyncView)
+
+from .urls import urlpatterns as sync_urlpatterns
+
+# Стоят раньше синхронных путей с теми же адресами, поэтому выбираются они
+urlpatterns = [
+    path('api/v1/submitData', PerevalCreateAsyncView.as_view(), name='submit_data'),
+    path('api/v1/submitData/<int:id>', PerevalDetailUpdateAsyncView.as_view(), name='pereval_detail_update'),
+    path('api/v1/submitData/', PerevalListByEmailAsyncView.as_view(), name='submit_data_by_email'),
+] + sync_urlpatterns